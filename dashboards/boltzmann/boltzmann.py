@@ -3,7 +3,6 @@ import dash
 import dash_bootstrap_components as dbc
 import dash_daq as daq
 import plotly.graph_objs as go
-import re
 from dash import callback, dcc, html
 from dash import dash_table
 from dash.dependencies import Input, Output, State, MATCH, ALL
@@ -13,13 +12,13 @@ from flask import Flask, request
 from flask_babel import Babel, gettext
 from plotly.subplots import make_subplots
 try: # when running as an independent app
-    from model import population
+    from model import population, thermo, k_B, rigid_rotor, harmonic_ladder, morse_ladder, particle_in_a_box
 except: # when running in a multipage dashboard
-    from .model import population
+    from .model import population, thermo, k_B, rigid_rotor, harmonic_ladder, morse_ladder, particle_in_a_box
 try: # when running as an independent app
-    from utilities import _id, common_setup
+    from utilities import _id, common_setup, update_container
 except Exception as e: # when running in a multipage dashboard
-    from .utilities import _id, common_setup
+    from .utilities import _id, common_setup, update_container
     
 
 # define translator function
@@ -51,7 +50,44 @@ order = 3
 
 e_max_r = [0.01, 5] # energy range
 T_r = [1, 1e4] # temperature range
-n_r = [2, 25] # number of levels range
+n_r = [2, 10**6] # number of levels range
+T_sweep = np.geomspace(T_r[0], T_r[1], 300) # temperatures for the heat capacity plot
+max_bars = 100 # above this number of levels, levels are grouped in energy bins in plot and table
+max_sweep = 3*10**7 # maximum number of levels times temperatures for the heat capacity plot
+
+
+def spectrum(kind, e_max, n):
+    '''
+    energy levels of a model spectrum, scaled so that the highest level is e_max
+    
+    Parameters
+    ----------
+    kind : str
+        'linear' (equally spaced), 'rotor', 'harmonic', 'morse' or 'box' (3D)
+    e_max : float
+        energy of the highest level (eV)
+    n : int
+        number of levels
+        
+    Returns
+    -------
+    E : np.array
+        energy levels (eV)
+    g : np.array
+        degeneracy of each level
+    '''
+    if kind == 'rotor':
+        E, g = rigid_rotor(1, n)
+    elif kind == 'harmonic':
+        E, g = harmonic_ladder(1, n)
+    elif kind == 'morse': # anharmonicity such that there are just n bound levels
+        E, g = morse_ladder(1, 1/(2*n), n)
+    elif kind == 'box':
+        E, g = particle_in_a_box(1, n, dim=3)
+    else:
+        return np.linspace(0, e_max, n), np.ones(n, dtype=int)
+    E = E.to('eV').magnitude
+    return E*e_max/E[-1], g
 
 
 #######################################
@@ -109,8 +145,18 @@ def controls_factory(uid):
                         dbc.Col(dbc.Input(id={'type': _id('t-input'), 'uid': uid}, type='number',
                                          min=T_r[0], max=T_r[1], value=298))
                         ])
+    spectrum_dropdown = dcc.Dropdown(id={'type': _id('spectrum-dropdown'), 'uid': uid},
+                                     options=[
+                                         {'label': _('equally spaced'), 'value': 'linear'},
+                                         {'label': _('rigid rotor'), 'value': 'rotor'},
+                                         {'label': _('harmonic oscillator'), 'value': 'harmonic'},
+                                         {'label': _('Morse oscillator'), 'value': 'morse'},
+                                         {'label': _('particle in a box'), 'value': 'box'}
+                                     ],
+                                     value='linear', clearable=False)
     delete_button = dbc.Col(dbc.Button(_('delete'), id={'type': _id('delete-button'), 'uid': uid}), width='auto')
     input_row = dbc.Container([
+        spectrum_dropdown,
         e_max_input,
         n_input,
         t_input
@@ -119,6 +165,7 @@ def controls_factory(uid):
         id = {'type': _id('data-table'), 'uid': uid},
         columns = [
                 {'name': _('energy'), 'id': _id('energy'), 'type': 'numeric', 'format': Format(precision=2, scheme=Scheme.fixed)},
+                {'name': _('degeneracy'), 'id': _id('degeneracy'), 'type': 'numeric'},
                 {'name': _('pop fract'), 'id': _id('population'), 'type': 'numeric', 'format': Format(precision=3, scheme=Scheme.fixed)}
             ],
         data = [],
@@ -131,84 +178,42 @@ def controls_factory(uid):
     return controls
 
 
-def add_to_container(item, container_list, max_col=2, col_props={}, row_props={}):
+def group_levels(E, pop, g):
     '''
-    add an item to a container (such as a Panel, etc.) in a rows, columns structure
+    group levels in max_bars energy bins, if there are more of them
     
-    Parameters:
-    item : object
-        the item to add
-    container : object
-        the container
-    max_col : int
-        maximum number of columns per row
-    col_props : dict
-        column properties
-    row_props : dict
-        row properties
+    Returns
+    -------
+    E, pop, g : np.array
+        energy (center of the bin), population and degeneracy (number of states) of each group
+    width : float or None
+        width of the bins (None if levels are not grouped)
     '''
-    # create a column with the item inside and the required properties
-    new_col = dbc.Col([item], **col_props)
-    if not container_list: # add the first row
-        return [dbc.Row([new_col], **row_props)]
-    # if the last row is full
-    row = container_list[-1]
-    if isinstance(row, dbc.Row):
-        n_cols = len(row.children)
-    else:
-        n_cols = len(row['props']['children'])
-    if n_cols==max_col:
-        new_row = dbc.Row([new_col], **row_props)
-        return container_list + [new_row]
-    else:
-        # add the column to the row
-        if isinstance(row, dbc.Row):
-            row.children += [new_col]
-        else:
-            row['props']['children'] += [new_col]
-        container_list[-1] = row
-        return container_list
+    if len(E) <= max_bars:
+        return E, pop, g, None
+    bins = np.linspace(E.min(), E.max(), max_bars+1)
+    pop, _bins = np.histogram(E, bins, weights=pop)
+    g, _bins = np.histogram(E, bins, weights=g)
+    keep = g > 0 # skip empty bins
+    return ((bins[:-1] + bins[1:])/2)[keep], pop[keep], g[keep].astype(int), bins[1] - bins[0]
 
 
-def remove_from_container(uid, container_list):
-    '''
-    Remove item from container
-    
-    Parameters
-    ----------
-    uid : int
-        unique ID of the item to remove
-    container : object
-        container
-    max_col : int
-        maximum number of columns per row
-    
-    '''
-    new_container_list = []
-    for row in container_list:
-        for col in row['props']['children']:
-            item = col['props']['children'][0]
-            if item['props']['id']['uid'] != uid:
-                new_container_list = add_to_container(item, new_container_list)
-    return new_container_list
-
-
-def update_table(E, pop):
+def update_table(E, pop, g):
     '''
     remove energy E and sort table
     '''
     # sort list on E values
-    data = [{_id('energy'): e, _id('population'): p } for e, p in sorted(zip(E, pop.magnitude))]
+    data = [{_id('energy'): e, _id('degeneracy'): d, _id('population'): p } for e, p, d in sorted(zip(E, pop, g))]
     return data
 
 
 add_button = dbc.Button(_('Add plot'), id=_id('add-button'), style={'margin-bottom':5})
-panels_container = dbc.Container([], id=_id('panels-container'), fluid=True)
+panels_container = dbc.Row([], id=_id('panels-container'), align='left') # two panels per row
 layout = dbc.Container([
         header(),
         html.Hr(),
         dbc.Row([dbc.Col(add_button, xl=6, align='left')]),
-        dbc.Row([panels_container], align='left')
+        panels_container
     ],
     id='layout',
     fluid=True
@@ -227,23 +232,12 @@ def setup_language_specific(*messages):
 @callback(Output(_id('panels-container'), 'children'),
               [Input(_id('add-button'), 'n_clicks'),
               Input({'type':_id('delete-button'), 'uid': ALL}, 'n_clicks')],
-              State(_id('panels-container'), 'children')
+              State({'type':_id('panel'), 'uid': ALL}, 'id')
              )
-def update_panels_container(add_n_clicks, clear_n_clicks, panels_container_list):
+def update_panels_container(add_n_clicks, clear_n_clicks, panel_ids):
     '''update container adding or removing controls as required'''
-    ctx = dash.callback_context # this is needed to know which button has been pushed
-    trigger = ctx.triggered[0]
-    if 'add-button' in trigger['prop_id']: # add a new panel
-        uid = add_n_clicks # unique id 
-        new_panel = panel_factory(uid=uid)
-        return add_to_container(new_panel, panels_container_list)
-    else: # some delete button has been pushed
-        match = re.search(r'"uid":(\d+)',trigger['prop_id'])
-        if match:
-            uid = int(match.group(1)) # uid of the card
-            return remove_from_container(uid, panels_container_list)
-        else:
-            raise PreventUpdate # needed when app starts
+    return update_container(_id('add-button'), add_n_clicks, panel_ids, panel_factory,
+                            wrapper=lambda panel: dbc.Col([panel], xl=6))
             
 
 # this is the most important function
@@ -252,26 +246,41 @@ def update_panels_container(add_n_clicks, clear_n_clicks, panels_container_list)
                Output({'type': _id('data-table'), 'uid': MATCH}, 'data')
               ],
               [
+               Input({'type': _id('spectrum-dropdown'), 'uid': MATCH}, 'value'),
                Input({'type': _id('e-max-input'), 'uid': MATCH}, 'value'),
                Input({'type': _id('n-input'), 'uid': MATCH}, 'value'),
                Input({'type': _id('t-input'), 'uid': MATCH}, 'value')
               ]
              )
-def update_plot_table(e_max, n, T):
+def update_plot_table(kind, e_max, n, T):
     if None in (e_max, n, T): # values outside ranges 
         return go.Figure(), []
     for val, vrange in zip((e_max, n, T), (e_max_r, n_r, T_r)):
         if (val<vrange[0]) or (val>vrange[1]):
             return go.Figure(), []
-    E = np.linspace(0, e_max, n)
-    pop = population(E, T)
-    fig = go.Figure(go.Bar(
-            x=pop.magnitude,
-            y=E,
-            orientation='h'))
-    fig.update_layout(xaxis_title=_('population fraction'))
-    fig.update_yaxes(tickmode='array',  tickvals=E, ticktext=[_('level')+ f' {i} ' for i in range(n)])
-    table_data = update_table(E, pop)
+    E, g = spectrum(kind, e_max, int(n))
+    pop = population(E, T, g).magnitude
+    # heat capacity on the whole temperature range and at T, in a single call
+    # (on fewer temperatures for very large spectra)
+    sweep = np.geomspace(T_r[0], T_r[1], int(np.clip(max_sweep//len(E), 30, len(T_sweep))))
+    Cv = thermo(E, np.append(sweep, T), g)[3].to('J/K').magnitude/k_B
+    E_bar, pop_bar, g_bar, width = group_levels(E, pop, g)
+    fig = make_subplots(rows=1, cols=2, horizontal_spacing=0.2)
+    fig.add_trace(go.Bar(
+            x=pop_bar,
+            y=E_bar,
+            width=width,
+            orientation='h', showlegend=False), row=1, col=1)
+    fig.add_trace(go.Scatter(x=sweep, y=Cv[:-1], mode='lines', showlegend=False), row=1, col=2)
+    fig.add_trace(go.Scatter(x=[T], y=Cv[-1:], mode='markers', marker={'size': 10}, showlegend=False), row=1, col=2)
+    fig.update_xaxes(title=_('population fraction'), row=1, col=1)
+    if width is None:
+        fig.update_yaxes(tickmode='array',  tickvals=E, ticktext=[_('level')+ f' {i} ' for i in range(len(E))], row=1, col=1)
+    else:
+        fig.update_yaxes(title=_('energy (eV)'), row=1, col=1)
+    fig.update_xaxes(title=_('temperature (K)'), type='log', row=1, col=2)
+    fig.update_yaxes(title=_('heat capacity (Cv/k)'), rangemode='tozero', row=1, col=2)
+    table_data = update_table(E_bar, pop_bar, g_bar)
     return fig, table_data
 
 
@@ -2,9 +2,16 @@ import numpy as np
 import pint
 import warnings
 
+# define needed physical constants
+# we could use scipy for this, but there is no need to have such big dependency
+# from scipy.constants import k, h
+
+k_B = 1.380649e-23 # the Boltzmann constant (in J/K)
+h_P = 6.62607015e-34 # the Planck constant (in J s)
 
 # initialize units registry
 ureg = pint.UnitRegistry()
+Q_ = ureg.Quantity
 
 # Silence NEP 18 warning
 # see Pint documentation
@@ -12,6 +19,132 @@ ureg = pint.UnitRegistry()
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
 
+# units are checked only at the boundary of the model: parameters are
+# converted once to SI magnitudes, computations are done on plain arrays
+# and only the results are tagged with units.
+# Set to True to do all the computations with pint quantities instead
+# (much slower, useful to validate the model)
+CHECK_UNITS = False
+
+
+def _boundary(x, unit):
+    '''
+    convert a parameter at the boundary of the model
+
+    Parameters
+    ----------
+    x : float, array or pint.Quantity
+        value of the parameter (in unit, if it has no units)
+    unit : str
+        default unit of the parameter
+
+    Returns
+    -------
+    x : array or pint.Quantity
+        magnitude of x in SI units, or x as a pint.Quantity if CHECK_UNITS is True
+    '''
+    if not isinstance(x, pint.Quantity):
+        x = Q_(np.asarray(x, dtype=float), unit)
+    if CHECK_UNITS:
+        return x
+    return x.to_base_units().magnitude
+
+
+def _output(x, unit):
+    '''tag a result with its SI unit, if it has been computed without units'''
+    if isinstance(x, pint.Quantity):
+        return x
+    return Q_(x, unit)
+
+
+def _boltzmann_constant():
+    '''Boltzmann constant, with units if they are checked'''
+    return ureg.boltzmann_constant if CHECK_UNITS else k_B
+
+
+def _dimensionless(x):
+    '''magnitude of a dimensionless value (pint checks the units, if any)'''
+    if isinstance(x, pint.Quantity):
+        return x.to('dimensionless').magnitude
+    return x
+
+
+def _boltzmann_factor(E, T):
+    '''Boltzmann factor for energies E and temperature T (in SI units or pint.Quantity)'''
+    return np.exp(-1*E/(_boltzmann_constant()*T))
+
+
+def _energy(x):
+    '''
+    energy at the boundary of the model (eV by default); wavenumbers and
+    frequencies are converted to energies with the spectroscopy context
+    '''
+    if isinstance(x, pint.Quantity) and not x.check('[energy]'):
+        x = x.to('J', 'sp')
+    return _boundary(x, 'eV')
+
+
+def _boltzmann_stats(E, T, g=None):
+    '''
+    partition function and moments of the energy for each temperature.
+    Levels are processed in chunks keeping running sums, so that memory
+    stays bounded for spectra with millions of levels: the partition
+    function is a log-sum-exp with a running maximum (it does not underflow
+    at low temperature or high energy) and means and variances of the chunks
+    are merged as weighted statistics.
+
+    Parameters
+    ----------
+    E : array
+        energy levels (in SI units or pint.Quantity)
+    T : float or array
+        temperatures (in SI units or pint.Quantity)
+    g : array, optional
+        degeneracy of each level (1 by default)
+
+    Returns
+    -------
+    lnQ : array
+        logarithm of the partition function, with energies measured
+        from the lowest level, for each temperature
+    mean, var : array
+        mean and variance of the energy measured from the lowest level,
+        in units of kT, for each temperature
+    E0 : float or pint.Quantity
+        energy of the lowest level
+    '''
+    T = T.reshape(-1, 1) if np.ndim(T) else T*np.ones((1, 1))
+    kT = _boltzmann_constant()*T
+    E0 = E.min()
+    lng = np.zeros(len(E)) if g is None else np.log(g)
+    n_T = len(T)
+    m = np.full(n_T, -np.inf) # running maximum of the exponents
+    W = np.zeros(n_T) # running sum of the weights, rescaled by exp(-m)
+    mean = np.zeros(n_T)
+    M2 = np.zeros(n_T) # running sum of squared deviations, rescaled by exp(-m)
+    size = max(1, 2**20//n_T) # levels in each chunk
+    for start in range(0, len(E), size):
+        chunk = slice(start, start+size)
+        y = _dimensionless((E[chunk] - E0)/kT)
+        x = lng[chunk] - y
+        m_chunk = x.max(axis=1)
+        w = np.exp(x - m_chunk[:, None])
+        W_chunk = w.sum(axis=1)
+        mean_chunk = (w*y).sum(axis=1)/W_chunk
+        M2_chunk = (w*(y - mean_chunk[:, None])**2).sum(axis=1)
+        # merge with the previous chunks, on the scale of the new maximum
+        m_new = np.maximum(m, m_chunk)
+        a = np.exp(m - m_new)
+        b = np.exp(m_chunk - m_new)
+        W_new = W*a + W_chunk*b
+        delta = mean_chunk - mean
+        mean = mean + delta*W_chunk*b/W_new
+        M2 = M2*a + M2_chunk*b + delta**2*W*a*W_chunk*b/W_new
+        W = W_new
+        m = m_new
+    return m + np.log(W), mean, M2/W, E0
+
+
 def boltzmann_factor(E, T):
     '''
     computes Boltzman factor
@@ -19,7 +152,7 @@ def boltzmann_factor(E, T):
     Parameters
     ----------
     E : float or pint.Quantity
-        energy level (joule by default)
+        energy level (eV by default)
     T : float or pint.Quantity
         Temperature (kelvin, by default)
         
@@ -28,32 +161,216 @@ def boltzmann_factor(E, T):
     bf : pint.Quantity
         Boltzman factor
     '''
-    # use quantites with units
-    if not isinstance(E, pint.Quantity):
-        E *= ureg.eV
-    if not isinstance(T, pint.Quantity):
-        T *= ureg.kelvin
-    k = ureg.boltzmann_constant
-    bf = np.exp(-1*E/(k*T))
-    return bf
+    bf = _boltzmann_factor(_boundary(E, 'eV'), _boundary(T, 'kelvin'))
+    return _output(bf, 'dimensionless')
 
-def population(E, T):
+def population(E, T, g=None):
     '''
     Computes population distribution of a set energy levels
     
     Parameters
     ----------
     E : np.array of float or pint.Quantity
-        energy levels (joule by default)
-    T : float or pint.Quantity
+        energy levels (eV by default)
+    T : float, np.array of float or pint.Quantity
         Temperature (kelvin, by default)
+    g : np.array of int, optional
+        degeneracy of each level (1 by default)
         
     Returns
     -------
     pop : pint.Quantity
+        population of each level (including all its degenerate states);
+        if T is an array, one row for each temperature (n_T x n_levels)
+    '''
+    E = _energy(E)
+    T = _boundary(T, 'kelvin')
+    lnQ, mean, var, E0 = _boltzmann_stats(E, T, g)
+    kT = _boltzmann_constant()*(T.reshape(-1, 1) if np.ndim(T) else T)
+    x = -1*_dimensionless((E - E0)/kT) - lnQ[:, None]
+    if g is not None:
+        x = x + np.log(g)
+    pop = np.exp(x)
+    if not np.ndim(T):
+        pop = pop[0]
+    return _output(pop, 'dimensionless')
+
+
+def thermo(E, T, g=None):
+    '''
+    Computes thermodynamic functions of a set of energy levels as functions
+    of temperature, for one molecule, from the partition function:
+    U = <E>, A = -kT ln(Q), S = (U - A)/T, Cv = (<E^2> - <E>^2)/(kT^2)
+    
+    Parameters
+    ----------
+    E : np.array of float or pint.Quantity
+        energy levels (eV by default)
+    T : float, np.array of float or pint.Quantity
+        Temperature (kelvin, by default)
+    g : np.array of int, optional
+        degeneracy of each level (1 by default)
+        
+    Returns
+    -------
+    U : pint.Quantity
+        internal energy
+    S : pint.Quantity
+        entropy
+    A : pint.Quantity
+        Helmholtz energy
+    Cv : pint.Quantity
+        heat capacity at constant volume
+    '''
+    E = _energy(E)
+    T = _boundary(T, 'kelvin')
+    lnQ, mean, var, E0 = _boltzmann_stats(E, T, g)
+    k = _boltzmann_constant()
+    if not np.ndim(T):
+        lnQ, mean, var = lnQ[0], mean[0], var[0]
+    U = E0 + k*T*mean
+    A = E0 - k*T*lnQ
+    S = (U - A)/T
+    Cv = k*var
+    return _output(U, 'J'), _output(S, 'J/K'), _output(A, 'J'), _output(Cv, 'J/K')
+
+
+#################
+# level spectra #
+#################
+
+def box_energy(L, m):
+    '''
+    energy scale h^2/(8 m L^2) of a particle in a box
+
+    Parameters
+    ----------
+    L : float or pint.Quantity
+        length of the box (angstrom by default)
+    m : float or pint.Quantity
+        mass of the particle (atomic mass units by default)
+
+    Returns
+    -------
+    E1 : pint.Quantity
+        energy scale
+    '''
+    h = ureg.planck_constant if CHECK_UNITS else h_P
+    E1 = h**2/(8*_boundary(m, 'u')*_boundary(L, 'angstrom')**2)
+    return _output(E1, 'J')
+
+
+def rigid_rotor(B, n_levels):
+    '''
+    levels of a rigid rotor, E = B J(J+1) with degeneracy 2J+1
+
+    Parameters
+    ----------
+    B : float or pint.Quantity
+        rotational constant (eV by default, or a wavenumber)
+    n_levels : int
+        number of levels
+
+    Returns
+    -------
+    E : pint.Quantity
+        energy levels
+    g : np.array of int
+        degeneracy of each level
+    '''
+    J = np.arange(n_levels)
+    return _output(_energy(B)*J*(J+1), 'J'), 2*J+1
+
+
+def harmonic_ladder(we, n_levels):
+    '''
+    levels of a harmonic oscillator, E = we (v+1/2), not degenerate
+
+    Parameters
+    ----------
+    we : float or pint.Quantity
+        vibrational quantum (eV by default, or a wavenumber)
+    n_levels : int
+        number of levels
+
+    Returns
+    -------
+    E : pint.Quantity
+        energy levels
+    g : np.array of int
+        degeneracy of each level
+    '''
+    v = np.arange(n_levels)
+    return _output(_energy(we)*(v+0.5), 'J'), np.ones(n_levels, dtype=int)
+
+
+def morse_ladder(we, wexe, n_levels=None):
+    '''
+    bound levels of a Morse oscillator, E = we (v+1/2) - wexe (v+1/2)^2,
+    not degenerate
+
+    Parameters
+    ----------
+    we : float or pint.Quantity
+        vibrational quantum (eV by default, or a wavenumber)
+    wexe : float or pint.Quantity
+        anharmonic parameter (same units as we)
+    n_levels : int, optional
+        number of levels; if None, or if it is larger, all the bound levels
+
+    Returns
+    -------
+    E : pint.Quantity
+        energy levels
+    g : np.array of int
+        degeneracy of each level
+    '''
+    we = _energy(we)
+    wexe = _energy(wexe)
+    # levels increase up to the dissociation limit
+    v_max = int(_dimensionless(we/(2*wexe)) - 0.5)
+    if n_levels is None or n_levels > v_max+1:
+        n_levels = v_max+1
+    v = np.arange(n_levels)
+    return _output(we*(v+0.5) - wexe*(v+0.5)**2, 'J'), np.ones(n_levels, dtype=int)
+
+
+def particle_in_a_box(E1, n_levels, dim=1):
+    '''
+    lowest levels of a particle in a (square or cubic) box,
+    E = E1 (n_x^2 + n_y^2 + ...), with their degeneracies
+
+    Parameters
+    ----------
+    E1 : float or pint.Quantity
+        energy scale (eV by default, see box_energy)
+    n_levels : int
+        number of distinct levels
+    dim : int
+        number of dimensions of the box
+
+    Returns
+    -------
+    E : pint.Quantity
+        energy levels
+    g : np.array of int
+        degeneracy of each level
     '''
-    levels = boltzmann_factor(E,T)
-    # compute partition function
-    Q = levels.sum()
-    pop = levels/Q
-    return pop
\ No newline at end of file
+    if dim == 1:
+        N = np.arange(1, n_levels+1)**2
+        return _output(_energy(E1)*N, 'J'), np.ones(n_levels, dtype=int)
+    size = 2*n_levels + dim # largest sum of squares to consider
+    while True:
+        # number of ways to write each integer as a sum of dim squares of
+        # positive integers, as a convolution computed with FFT
+        squares = np.zeros(size+1)
+        squares[np.arange(1, int(np.sqrt(size))+1)**2] = 1
+        n_fft = 2**int(np.ceil(np.log2(dim*(size+1))))
+        ways = np.fft.irfft(np.fft.rfft(squares, n_fft)**dim, n_fft)[:size+1]
+        ways = np.rint(ways).astype(np.int64)
+        N = np.flatnonzero(ways)
+        if len(N) >= n_levels:
+            break
+        size *= 2
+    N = N[:n_levels]
+    return _output(_energy(E1)*N, 'J'), ways[N]
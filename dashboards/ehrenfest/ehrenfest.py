@@ -2,19 +2,21 @@ import numpy as np
 import dash
 import dash_bootstrap_components as dbc
 import plotly.graph_objs as go
-from dash import callback, dcc, html
+from dash import callback, clientside_callback, dcc, html, Patch
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from flask import Flask, request
 from flask_babel import Babel, gettext
+from numpy.random import default_rng, SeedSequence
 from plotly.subplots import make_subplots
 try: # when running as an independent app
-    from model import Ehrenfest
+    from model import EhrenfestSimulation, ehrenfest_exact, ehrenfest_ensemble, ehrenfest_equilibrium, hist_quantile
 except: # when running in a multipage dashboard
-    from .model import Ehrenfest
+    from .model import EhrenfestSimulation, ehrenfest_exact, ehrenfest_ensemble, ehrenfest_equilibrium, hist_quantile
 try: # when running as an independent app
-    from utilities import _id, common_setup
+    from utilities import _id, common_setup, minmax_decimate, minmax_rebucket
 except Exception as e: # when running in a multipage dashboard
-    from .utilities import _id, common_setup
+    from .utilities import _id, common_setup, minmax_decimate, minmax_rebucket
     
 
 # define translator function
@@ -35,6 +37,224 @@ info = _(r'''
     ''')
 order = 5
 
+##################################
+# common variables and utilities #
+##################################
+
+max_playback_steps = 5000 # longer runs are streamed instead of animated
+stream_chunk = 500000 # steps simulated for each update of a streamed run
+stream_points = 1000 # number of buckets of steps displayed for a streamed run
+max_particles = 10**5 # maximum number of particles in each box
+webgl_threshold = 1000 # larger systems are drawn with WebGL
+density_threshold = 20000 # larger systems are drawn as a density map
+density_bins = 50 # cells of the density map along each side of a box
+max_bars = 200 # maximum number of bars of the histogram of the fluctuation
+box_width = 100 # width of one box
+box_height = 100 # height of one box
+
+
+def particle_coordinates(A, seed, width, height):
+    '''
+    generate random coordinates for particles in the box
+    
+    Parameters
+    ----------
+    A : array of bool
+        mask of particles in box A
+    seed : int
+        seed for the random coordinates, the same seed gives
+        the same coordinates for each particle
+    width, height : float
+        box dimensions
+    
+    Returns
+    -------
+    X, Y : array
+        X and Y coordinates for the particles
+    '''
+    XY = default_rng(seed).random((len(A), 2))*np.array((width, height))
+    X = XY[:,0]
+    Y = XY[:,1]
+    # add box witdh to X coordinates of particles in box B
+    # in order to plot them in the box B
+    X[~A] += width # particles in B are in the right box
+    return X, Y
+
+
+def particle_cells(n, seed):
+    '''
+    cells of the density map occupied by the particles, inside their box.
+    The same seed of particle_coordinates gives the cells that contain
+    the particles drawn by it
+    
+    Parameters
+    ----------
+    n : int
+        number of particles
+    seed : int
+        seed for the random coordinates
+    
+    Returns
+    -------
+    cells : array of int
+        index row*density_bins + column of the cell of each particle
+    '''
+    ix, iy = (default_rng(seed).random((n, 2))*density_bins).astype(int).T
+    return iy*density_bins + ix
+
+
+def particle_view(A, seed):
+    '''
+    data for the trace of the particles in the boxes: their coordinates,
+    or the number of particles in each cell of a grid for large systems,
+    which could not be drawn one by one
+    
+    Parameters
+    ----------
+    A : array of bool
+        mask of particles in box A
+    seed : int
+        seed for the random coordinates
+    
+    Returns
+    -------
+    view : dict
+        x and y of the particles for a scatter trace, or z for a heatmap
+    '''
+    n = len(A)
+    if n > density_threshold:
+        cells = particle_cells(n, seed)
+        row, col = np.divmod(cells, density_bins)
+        # the cells of box B are on the right of the ones of box A
+        index = row*2*density_bins + col + density_bins*(~A)
+        z = np.bincount(index, minlength=2*density_bins**2)
+        return {'z': z.reshape(density_bins, 2*density_bins)}
+    X, Y = particle_coordinates(A, seed, box_width, box_height)
+    # no need for more digits on screen
+    return {'x': np.round(X, 2), 'y': np.round(Y, 2)}
+
+
+def particle_trace(view):
+    '''
+    trace for the particles in the boxes, with a rendering that
+    scales with the number of particles
+    
+    Parameters
+    ----------
+    view : dict
+        data of the particles, given by particle_view
+    '''
+    if 'z' in view:
+        # coordinates of the centers of the cells
+        x = (np.arange(2*density_bins) + 0.5)*box_width/density_bins
+        y = (np.arange(density_bins) + 0.5)*box_height/density_bins
+        return go.Heatmap(x=x, y=y, z=view['z'], colorscale='Blues', showscale=False,
+                          hovertemplate='%{z}<extra></extra>')
+    if len(view['x']) > webgl_threshold:
+        return go.Scattergl(**view, mode='markers', marker={'size': 3}, hoverinfo='skip')
+    return go.Scatter(**view, mode='markers')
+
+
+def display_distribution(P, start=0, threshold=5e-5):
+    '''
+    part of a distribution of N_A worth drawing: negligible tails are cut
+    and, if too many values remain, groups of them are averaged, so that
+    large systems do not send more than max_bars values to the browser
+    
+    Parameters
+    ----------
+    P : array
+        probability that N_A = start, start+1, ...
+    start : int
+        value of N_A of the first probability
+    threshold : float
+        smaller probabilities are discarded
+    
+    Returns
+    -------
+    start : int
+        value of N_A of the first probability kept
+    step : int
+        number of values of N_A averaged in each group
+    P : array
+        probabilities kept (averaged in groups)
+    '''
+    kept = np.flatnonzero(P >= threshold)
+    if len(kept):
+        start += kept[0]
+        P = P[kept[0]:kept[-1]+1]
+    step = -(-len(P)//max_bars)
+    if step > 1:
+        groups = np.arange(0, len(P), step)
+        P = np.add.reduceat(P, groups)/np.diff(np.append(groups, len(P)))
+    return int(start), step, P
+
+
+def fluctuation_axis(n, start, step, size):
+    '''
+    fluctuation (N_B-N_A)/n at the center of groups of step values of N_A,
+    starting from N_A = start (see display_distribution)
+    '''
+    return (n - 2*(start + step*np.arange(size) + (step-1)/2))/n
+
+
+def display_hist(sim):
+    '''
+    histogram of the fluctuation of a simulation, only in the range
+    observed so far (large systems have many more bins than that).
+    If they are too many, groups of bars are merged: since the fluctuation
+    changes by 2 at each step, only one bin out of two can be occupied, so
+    merged bars show the mean probability of the values they contain,
+    as display_distribution
+    
+    Returns
+    -------
+    x, y : array
+        fluctuation divided by the number of particles and probability
+    '''
+    hist, bins = sim.hist
+    observed = np.flatnonzero(hist)
+    observed = slice(observed[0], observed[-1]+1)
+    x, y = bins[observed]/sim.n, hist[observed]
+    if len(y) > max_bars:
+        group = 2*(-(-len(y)//(2*max_bars)))
+        groups = np.arange(0, len(y), group)
+        sizes = np.diff(np.append(groups, len(y)))
+        x, y = x[groups], np.add.reduceat(y, groups)/np.ceil(sizes/2)
+    return x, y
+
+
+def extend_stream(stream, nsteps):
+    '''
+    set up the stream of a simulation to run nsteps more steps.
+    The bucket of steps for each displayed point is chosen for the whole
+    run, and the points already displayed are decimated again with it,
+    so that the number of points displayed does not grow
+    
+    Parameters
+    ----------
+    stream : dict
+        stream data, with the state of the simulation
+    nsteps : int
+        number of steps to add
+    
+    Returns
+    -------
+    stream : dict
+        updated stream data
+    '''
+    total = stream['sim']['step'] + nsteps
+    bucket = -(-total//stream_points) # steps for each displayed point
+    stream['bucket'] = bucket
+    stream['chunk'] = bucket*(-(-stream_chunk//bucket)) # steps simulated at each update
+    stream['nsteps'] = total
+    # the first step is alone in its bucket, and the buckets of the old
+    # and of the new steps are not aligned: at most stream_points+3 buckets
+    stream['points'] = 2*(stream_points+3)
+    x, NA = minmax_rebucket(stream['x'], stream['NA'], bucket, start=1)
+    stream['x'], stream['NA'] = x.tolist(), NA.tolist()
+    return stream
+
 #######################################
 # set up general layout and callbacks #
 #######################################
@@ -46,35 +266,67 @@ header, setup_language_general, show_info = common_setup(title, subtitle, info)
 
 steps_input = dbc.Row([dbc.Col(dbc.Label(_('steps'), id=_id('steps-label')), md=2),
                        dbc.Col(dbc.Input(id = _id('steps-input'), type='number',
-                                     min=10, max=1000, value=200))
+                                     min=10, max=10**7, value=200))
                       ])
 
 nA_input = dbc.Row([dbc.Col(dcc.Markdown('$N_A$', id=_id('nA-label'), mathjax=True), md=2),
                     dbc.Col(dbc.Input(id = _id('nA-input'), type='number',
-                                     min=0, max=50, value=10))
+                                     min=0, max=max_particles, value=10))
                     ])
 
 nB_input = dbc.Row([dbc.Col(dcc.Markdown('$N_B$', id=_id('nB-label'), mathjax=True), md=2),
                     dbc.Col(dbc.Input(id = _id('nB-input'), type='number',
-                                     min=0, max=50, value=10))
+                                     min=0, max=max_particles, value=10))
                     ])
 
+replicas_input = dbc.Row([dbc.Col(dbc.Label(_('replicas'), id=_id('replicas-label')), md=2),
+                          dbc.Col(dbc.Input(id = _id('replicas-input'), type='number',
+                                            min=0, max=10000, value=0))
+                         ])
+
 generate_button = dbc.Button(_('generate'), id=_id('generate-button'), style={'margin-bottom':5})
+continue_button = dbc.Button(_('continue'), id=_id('continue-button'), style={'margin-bottom':5})
 
 commands = dbc.Container([dbc.Row([dbc.Col(nA_input),]),
                           dbc.Row([dbc.Col(nB_input),]),
                           dbc.Row([dbc.Col(steps_input),]),
-                          dbc.Row([dbc.Col(generate_button),])
+                          dbc.Row([dbc.Col(replicas_input),]),
+                          dbc.Row([dbc.Col(generate_button, width='auto'),
+                                   dbc.Col(continue_button, width='auto')])
                          ])
 
+# particles are in their own figure, that is redrawn at each step,
+# while the fractions of a streamed run are only extended
+particles_graph = dcc.Graph(id=_id('particles'), config= {'displayModeBar': False})
 graph = dcc.Graph(id=_id('plot'), config= {'displayModeBar': False})
 
+# the animation is played in the browser: the server sends the whole
+# trajectory once and a clientside callback draws each step
+play_button = dbc.Button('Play', id=_id('play-button'), n_clicks=0)
+step_slider = dcc.Slider(id=_id('step-slider'), min=0, max=0, step=1, value=0,
+                         marks=None, tooltip={'placement': 'bottom', 'always_visible': True})
+step_label = dbc.Label(_('Step: '), id=_id('step-label'))
+player = dbc.Row([dbc.Col(play_button, width='auto'), dbc.Col(step_label, width='auto'),
+                  dbc.Col(step_slider)], align='center')
+playback = dcc.Store(id=_id('playback'))
+interval = dcc.Interval(id=_id('interval'), interval=50, disabled=True)
+
+# long runs are simulated in chunks and streamed to the figure
+stream = dcc.Store(id=_id('stream'))
+stream_interval = dcc.Interval(id=_id('stream-interval'), interval=250, disabled=True)
+
 def layout():
     layout = dbc.Container([
     header(),
     html.Hr(),
-    dbc.Row([dbc.Col(commands, md=2), dbc.Col(graph, md=8),],
-             align="center",)
+    dbc.Row([dbc.Col(commands, md=2), dbc.Col([dbc.Row([dbc.Col(particles_graph, width='auto'),
+                                                     dbc.Col(graph, width='auto')]),
+                                            player], md=10),],
+             align="center",),
+    playback,
+    interval,
+    stream,
+    stream_interval
     ],
     fluid=True,
     id =_id('layout')
@@ -87,119 +339,411 @@ def layout():
 
 @callback([Output(_id('steps-label'), 'children'),
                Output(_id('generate-button'), 'children'),
+               Output(_id('continue-button'), 'children'),
                Output(_id('nA-label'), 'children'),
                Output(_id('nB-label'), 'children'),
+               Output(_id('replicas-label'), 'children'),
+               Output(_id('step-label'), 'children'),
               ],
               [Input(_id('steps-label'), 'children'),
                Input(_id('generate-button'), 'children'),
+               Input(_id('continue-button'), 'children'),
                Input(_id('nA-label'), 'children'),
                Input(_id('nB-label'), 'children'),
+               Input(_id('replicas-label'), 'children'),
+               Input(_id('step-label'), 'children'),
               ])
 def setup_language_specific(*messages):
     return [_(m) for m in messages]
 
-@callback(Output(_id('plot'), 'figure'),
+@callback([Output(_id('particles'), 'figure'),
+           Output(_id('plot'), 'figure'),
+           Output(_id('playback'), 'data'),
+           Output(_id('step-slider'), 'max'),
+           Output(_id('step-slider'), 'value'),
+           Output(_id('interval'), 'disabled'),
+           Output(_id('stream'), 'data'),
+           Output(_id('stream-interval'), 'disabled')],
               [Input(_id('generate-button'), 'n_clicks')],
               [State(_id('nA-input'), 'value'),
                State(_id('nB-input'), 'value'),
-               State(_id('steps-input'), 'value')]
+               State(_id('steps-input'), 'value'),
+               State(_id('replicas-input'), 'value')]
              )
-def generate_animation(n_clicks, nA, nB, nsteps):
+def generate_animation(n_clicks, nA, nB, nsteps, replicas):
     '''
-    set-up figure and generate frames for animation
+    set-up figures for the first step and send the whole trajectory
+    to the browser, where each step of the animation is drawn.
+    The histogram is compared with the exact distribution of the
+    fluctuation, averaged over the steps as the histogram.
+    If replicas are requested, the fractions are compared with the
+    average over an ensemble of independent simulations.
+    Long runs are not animated, but streamed to the figures while they
+    are simulated (see stream_simulation).
+    In both cases the state of the simulation is kept, so that it can
+    be continued (see continue_simulation)
     ''' 
-    width = 100 # width of one box
-    height = 100  # height of one box
     n = nA + nB
-    model = Ehrenfest(nA, nB, nsteps, width, height)
-    X, Y, fA, fB, hist, hist_fit = next(model)
+    streaming = nsteps > max_playback_steps
+    density = n > density_threshold
+    seed = SeedSequence()
+    sim = EhrenfestSimulation(nA, nB, seed=seed)
+    # seed for the coordinates of particles in the box
+    coords_seed = int(sim.rng.integers(2**62))
+    view = particle_view(sim.A0, coords_seed)
+    particles = go.Figure(particle_trace(view))
+    hist_x, hist_y = display_hist(sim)
     #Initialize figure with subplots
-    fig = make_subplots(rows=2, cols=2,
-                    column_widths=[0.8, 0.2],
-                    row_heights=[0.5, 0.5],
-                    specs=[[{'type': 'xy', 'rowspan': 2}, {'type': 'xy'}],
-                          [            None             , {'type': 'xy'}]],
-                   )
+    fig = make_subplots(rows=2, cols=1, row_heights=[0.5, 0.5], vertical_spacing=0.15)
+    # decimated number of particles in A, to redraw the fractions when continued
+    stream = {'seed': coords_seed,
+              'x': [0],
+              'NA': sim.NA[:1].tolist()}
+    if streaming:
+        # the run is simulated in chunks when the figure is already shown,
+        # the histogram is compared with the equilibrium distribution
+        exact_start, exact_step, exact = display_distribution(ehrenfest_equilibrium(n))
+        stream['mode'] = 'stream'
+        stream['sim'] = sim.get_state()
+        stream = extend_stream(stream, nsteps)
+        playback = None
+    else:
+        sim.run(nsteps)
+        # exact distribution, stored for at most ~100 steps and only for
+        # the values of N_A that can be reached, to keep the payload small
+        every = max(1, nsteps//100)
+        window = (max(0, nA - nsteps), min(n, nA + nsteps) + 1)
+        P = ehrenfest_exact(nA, nB, nsteps, every=every, cumulative=True, window=window)[0]
+        snapshots = []
+        for p in P:
+            start, step, p = display_distribution(p, window[0])
+            snapshots.append({'start': start, 'step': step, 'p': np.round(p, 4).tolist()})
+        exact_start, exact_step, exact = snapshots[0].values()
+        # the trajectory is sent only once as compact arrays: the browser
+        # replays the moves and updates the histogram one step at a time
+        playback = {'key': str(coords_seed),
+                    'n': n,
+                    'width': box_width,
+                    'flips': sim.flips.tolist(),
+                    'NA': sim.NA.tolist(),
+                    'every': every,
+                    'bars': max_bars,
+                    'exact': snapshots}
+        if density:
+            # the browser moves the counts of the cells of the density map
+            playback['cells'] = particle_cells(n, coords_seed).tolist()
+            playback['nx'] = density_bins
+        else:
+            playback['X'] = view['x'].tolist()
+        stream['mode'] = 'playback'
+        stream['sim'] = sim.get_state()
+        stream['nsteps'] = nsteps
+    exact_x = fluctuation_axis(n, exact_start, exact_step, len(exact))
     # init data
-    fig.update(data = [go.Scatter(x=X, y=Y, mode='markers', showlegend=False, xaxis='x1', yaxis='y1'),
-                   go.Scatter(y=fA, name='A', xaxis='x2', yaxis='y2'),
-                   go.Scatter(y=fB, name='B', xaxis='x2', yaxis='y2'),
-                   go.Bar(x=hist[1]/n, y=hist[0], showlegend=False, xaxis='x3', yaxis='y3'),
-                   go.Scatter(x=[], y=[], mode='lines', showlegend=False, xaxis='x3', yaxis='y3')
+    fig.update(data = [go.Scatter(x=[0], y=sim.fA[:1], name='A', mode='lines', xaxis='x1', yaxis='y1'),
+                   go.Scatter(x=[0], y=sim.fB[:1], name='B', mode='lines', xaxis='x1', yaxis='y1'),
+                   go.Bar(x=hist_x, y=hist_y, showlegend=False, xaxis='x2', yaxis='y2'),
+                   go.Scatter(x=exact_x, y=exact, mode='lines', name=_('exact'), showlegend=False, xaxis='x2', yaxis='y2')
                   ]
               )
-    
-    # genrate frames for each step
-    frames = []
-    for X, Y, fA, fB, hist, hist_fit in model:
-        frame = dict(name = str(len(frames)),
-                     data = [go.Scatter(x=X, y=Y, mode='markers', showlegend=False),
-                             go.Scatter(y=fA, name='A', mode='lines'),
-                             go.Scatter(y=fB, name='B', mode='lines'),
-                             go.Bar(x=hist[1]/n, y=hist[0], showlegend=False),
-                             go.Scatter(x=hist[1]/n, y=hist_fit, mode='lines', showlegend=False)
-                            ],
-                     traces = [0, 1, 2, 3, 4])
-        frames.append(frame)
-    fig.update(frames=frames)
-    
-    # generate menu and input for animation
-    updatemenus = [dict(type='buttons',
-                        buttons=[dict(label='Play',
-                        method='animate',
-                        args=[[f'{k}' for k in range(nsteps)], 
-                               dict(frame=dict(duration=50, redraw=False), 
-                                    transition=dict(duration=0),
-                                    #easing='linear',
-                                    fromcurrent=True,
-                                    #mode='immediate'
-                                                       )])],
-                        direction= 'left', 
-                        pad=dict(r= 10, t=85), 
-                        showactive =True, x= 0.1, y= 0, xanchor= 'right', yanchor= 'top')
-                  ]
-
-    sliders = [{'yanchor': 'top',
-                'xanchor': 'left', 
-                'currentvalue': {'font': {'size': 16}, 'prefix': _('Step: '), 'visible': True, 'xanchor': 'right'},
-                'transition': {'duration': 500.0, 'easing': 'linear'},
-                'pad': {'b': 10, 't': 50}, 
-                'len': 0.9, 'x': 0.1, 'y': 0, 
-                'steps': [{'args': [[k], {'frame': {'duration': 500.0, 'easing': 'linear', 'redraw': False},
-                                          'transition': {'duration': 0, 'easing': 'linear'}}], 
-                           'label': k, 'method': 'animate'} for k in range(nsteps)       
-                         ]}]
-              
-    fig.update_layout(updatemenus=updatemenus, sliders=sliders)      
+    if replicas and not streaming:
+        # ensemble average and 95% band of the fraction of particles in A;
+        # the histograms are stored for at most stream_points steps and
+        # only for the values of N_A reached by the replicas
+        every = max(1, nsteps//stream_points)
+        ens_hist, ens_offset, ens_mean = ehrenfest_ensemble(nA, nB, nsteps, replicas, every=every)[:3]
+        band_x = np.arange(0, nsteps+1, every)
+        fA_low = hist_quantile(ens_hist, 0.025, ens_offset)/n
+        fA_high = hist_quantile(ens_hist, 0.975, ens_offset)/n
+        fig.add_traces([go.Scatter(x=band_x, y=fA_high, mode='lines', line={'width': 0}, showlegend=False,
+                                   hoverinfo='skip', xaxis='x1', yaxis='y1'),
+                        go.Scatter(x=band_x, y=fA_low, mode='lines', line={'width': 0}, fill='tonexty', showlegend=False,
+                                   hoverinfo='skip', xaxis='x1', yaxis='y1'),
+                        go.Scatter(y=ens_mean/n, name=_('ensemble'), mode='lines', line={'dash': 'dot'},
+                                   xaxis='x1', yaxis='y1')])
 
     # set up ranges for axes of various plots
-    xdelta  = 2*width*0.05
-    ydelta = height*0.05
-    xrange = [-xdelta, 2*width+xdelta]
-    yrange = [-ydelta, height+ydelta]
-    fig.update_xaxes(range=xrange, autorange=False, showticklabels=False,
-                     showgrid=False, showline=True, mirror=True, linewidth=2,
-                     linecolor='black', row=1, col=1)
-    fig.update_yaxes(range=yrange, autorange=False, showticklabels=False,
-                     showgrid=False, showline=True, mirror=True, linewidth=2,
-                     linecolor='black', row=1, col=1)
+    xdelta  = 2*box_width*0.05
+    ydelta = box_height*0.05
+    xrange = [-xdelta, 2*box_width+xdelta]
+    yrange = [-ydelta, box_height+ydelta]
+    particles.update_xaxes(range=xrange, autorange=False, showticklabels=False,
+                           showgrid=False, zeroline=False, showline=True, mirror=True,
+                           linewidth=2, linecolor='black')
+    particles.update_yaxes(range=yrange, autorange=False, showticklabels=False,
+                           showgrid=False, zeroline=False, showline=True, mirror=True,
+                           linewidth=2, linecolor='black')
+    particles.add_vline(x=box_width, line_width=2)
+    particles.update_layout(width=650, height=600, showlegend=False, plot_bgcolor='rgb(255, 255, 255)',
+                            modebar_remove=['zoom', 'pan'])
     
     pop_xrange = [0, nsteps]
     pop_yrange = [0, 1]
-    fig.update_xaxes(range=pop_xrange, autorange=False, showline=True, mirror=True,
-                     linewidth=1, linecolor='black', title=_('steps'), row=1, col=2)
+    # streamed fractions can be continued, they need autorange
+    fig.update_xaxes(range=pop_xrange, autorange=streaming, showline=True, mirror=True,
+                     linewidth=1, linecolor='black', title=_('steps'), row=1, col=1)
     fig.update_yaxes(range=pop_yrange, autorange=False, showline=True, mirror=True,
-                     linewidth=1, linecolor='black', title=_('fraction'), row=1, col=2)
-    hist_range = [hist[1][0]/n, hist[1][-1]/n]
-    fig.update_xaxes(range=hist_range, autorange=False, showline=True, mirror=True,
-                     linewidth=1, linecolor='black', title=_('fluctuation'), row=2, col=2)
-    fig.update_yaxes(range=[0, hist[0][1:].max()], showline=True, autorange=False, mirror=True,
-                     linewidth=1, linecolor='black', title=_('probability'), row=2, col=2)
-    
-    fig.add_vline(x=width, line_width=2, row=1, col=1)
-    fig.add_hline(y=0.5, line_dash='dash', row=1, col=2)
-    fig.update_layout(width=1000, height=600, plot_bgcolor='rgb(255, 255, 255)', modebar_remove=['zoom', 'pan'])
-    return fig
+                     linewidth=1, linecolor='black', title=_('fraction'), row=1, col=1)
+    # large systems are shown only in the range of fluctuations observed
+    fig.update_xaxes(range=[-1, 1], autorange=n > 100, showline=True, mirror=True,
+                     linewidth=1, linecolor='black', title=_('fluctuation'), row=2, col=1)
+    # streamed histograms become very low, they need autorange
+    fig.update_yaxes(range=[0, 1], showline=True, autorange=streaming, mirror=True,
+                     linewidth=1, linecolor='black', title=_('probability'), row=2, col=1)
+    
+    fig.add_hline(y=0.5, line_dash='dash', row=1, col=1)
+    fig.update_layout(width=400, height=600, plot_bgcolor='rgb(255, 255, 255)', modebar_remove=['zoom', 'pan'],
+                      legend={'orientation': 'h', 'yanchor': 'bottom', 'y': 1.02})
+    return particles, fig, playback, 0 if streaming else nsteps, 0, True, stream, not streaming
+
+
+@callback([Output(_id('plot'), 'extendData'),
+           Output(_id('particles'), 'figure', allow_duplicate=True),
+           Output(_id('stream'), 'data', allow_duplicate=True),
+           Output(_id('stream-interval'), 'disabled', allow_duplicate=True)],
+          Input(_id('stream-interval'), 'n_intervals'),
+          State(_id('stream'), 'data'),
+          prevent_initial_call=True
+         )
+def stream_simulation(n_intervals, stream):
+    '''
+    run the next chunk of a long simulation and append it to the figure.
+    The simulation keeps full resolution, but the fractions are decimated
+    (minimum and maximum in each bucket of steps) so that the browser never
+    holds more than 2*stream_points points for each curve
+    '''
+    if not stream:
+        raise PreventUpdate
+    sim = EhrenfestSimulation.from_state(stream['sim'])
+    nsteps = min(stream['chunk'], stream['nsteps'] - sim.start)
+    if nsteps <= 0:
+        return dash.no_update, dash.no_update, dash.no_update, True
+    sim.run(nsteps)
+    # the extremes of fB are at the same steps as those of fA
+    x, NA = minmax_decimate(sim.NA[1:], stream['bucket'], start=sim.start+1)
+    stream['x'] += x.tolist()
+    stream['NA'] += NA.tolist()
+    hist_x, hist_y = display_hist(sim)
+    # the fractions are appended, while the histogram is replaced in place,
+    # extending it with as many points as it has.
+    # Updating the figure property would discard the appended points
+    max_points = [stream['points'], stream['points'], len(hist_x)]
+    extend = [{'x': [x, x, hist_x],
+               'y': [NA/sim.n, 1 - NA/sim.n, hist_y]},
+              [0, 1, 2],
+              {'x': max_points, 'y': max_points}]
+    # the particles are in a separate figure, that can be patched
+    particles = Patch()
+    for key, value in particle_view(sim.A, stream['seed']).items():
+        particles['data'][0][key] = value
+    stream['sim'] = sim.get_state()
+    done = stream['sim']['step'] >= stream['nsteps']
+    return extend, particles, stream, done
+
+
+@callback([Output(_id('particles'), 'figure', allow_duplicate=True),
+           Output(_id('plot'), 'figure', allow_duplicate=True),
+           Output(_id('playback'), 'data', allow_duplicate=True),
+           Output(_id('step-slider'), 'max', allow_duplicate=True),
+           Output(_id('step-slider'), 'value', allow_duplicate=True),
+           Output(_id('interval'), 'disabled', allow_duplicate=True),
+           Output(_id('stream'), 'data', allow_duplicate=True),
+           Output(_id('stream-interval'), 'disabled', allow_duplicate=True)],
+          Input(_id('continue-button'), 'n_clicks'),
+          [State(_id('steps-input'), 'value'),
+           State(_id('stream'), 'data'),
+           State(_id('playback'), 'data')],
+          prevent_initial_call=True
+         )
+def continue_simulation(n_clicks, nsteps, stream, playback):
+    '''
+    continue the current simulation for nsteps more steps.
+    The simulation is resumed from its saved state and only the new
+    steps are streamed to the figure (see stream_simulation), after
+    the fractions already shown are decimated again (see extend_stream)
+    '''
+    if not (stream and nsteps):
+        raise PreventUpdate
+    particles = dash.no_update
+    fig = Patch()
+    n = stream['sim']['n']
+    if stream['mode'] == 'playback':
+        # show the whole animated run as a streamed one, before continuing
+        stream['x'] = list(range(len(playback['NA'])))
+        stream['NA'] = playback['NA']
+        sim = EhrenfestSimulation.from_state(stream['sim'])
+        hist_x, hist_y = display_hist(sim)
+        start, step, P = display_distribution(ehrenfest_equilibrium(n))
+        particles = Patch()
+        for key, value in particle_view(sim.A, stream['seed']).items():
+            particles['data'][0][key] = value
+        fig['data'][2]['x'] = hist_x
+        fig['data'][2]['y'] = hist_y
+        fig['data'][3]['x'] = fluctuation_axis(n, start, step, len(P))
+        fig['data'][3]['y'] = P
+        fig['layout']['xaxis']['autorange'] = True
+        fig['layout']['yaxis2']['autorange'] = True
+        stream['mode'] = 'stream'
+    stream = extend_stream(stream, nsteps)
+    NA = np.array(stream['NA'])
+    fig['data'][0]['x'] = stream['x']
+    fig['data'][0]['y'] = NA/n
+    fig['data'][1]['x'] = stream['x']
+    fig['data'][1]['y'] = 1 - NA/n
+    return particles, fig, None, 0, 0, True, stream, False
+
+
+# the run can be continued only when it is not being streamed,
+# otherwise the stream callbacks would overwrite each other's state
+clientside_callback(
+    """
+    function(disabled) {
+        return !disabled;
+    }
+    """,
+    Output(_id('continue-button'), 'disabled'),
+    Input(_id('stream-interval'), 'disabled')
+)
+
+
+# start or stop the animation
+clientside_callback(
+    """
+    function(n_clicks, disabled, step, max_step) {
+        if (disabled && step >= max_step) {
+            step = 0; // restart from the beginning
+        }
+        return [!disabled, step];
+    }
+    """,
+    [Output(_id('interval'), 'disabled', allow_duplicate=True),
+     Output(_id('step-slider'), 'value', allow_duplicate=True)],
+    Input(_id('play-button'), 'n_clicks'),
+    [State(_id('interval'), 'disabled'),
+     State(_id('step-slider'), 'value'),
+     State(_id('step-slider'), 'max')],
+    prevent_initial_call=True
+)
+
+
+# advance the animation by one step
+clientside_callback(
+    """
+    function(n_intervals, step, max_step) {
+        step = Math.min(step + 1, max_step);
+        return [step, step >= max_step];
+    }
+    """,
+    [Output(_id('step-slider'), 'value', allow_duplicate=True),
+     Output(_id('interval'), 'disabled', allow_duplicate=True)],
+    Input(_id('interval'), 'n_intervals'),
+    [State(_id('step-slider'), 'value'),
+     State(_id('step-slider'), 'max')],
+    prevent_initial_call=True
+)
+
+
+# draw one step of the animation in the browser
+clientside_callback(
+    """
+    function(step, playback, particles, figure) {
+        if (!playback || !particles || !figure) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const n = playback.n;
+        const NA = playback.NA;
+        const flips = playback.flips;
+        const cells = playback.cells;
+        const nx = playback.nx;
+        const bin = na => Math.min(2*(n - na), 2*n - 1);
+        let c = window.ehrenfestPlayback;
+        if (!c || c.key !== playback.key) {
+            // new trajectory: prepare particles, fractions and histogram
+            c = {key: playback.key, t: 0,
+                 counts: new Float64Array(2*n),
+                 lo: new Int32Array(NA.length), hi: new Int32Array(NA.length),
+                 fA: NA.map(na => na/n), fB: NA.map(na => 1 - na/n)};
+            if (cells) {
+                // density map, the first NA[0] particles start in A
+                c.z = Array.from({length: nx}, () => new Array(2*nx).fill(0));
+                cells.forEach((cell, i) => {
+                    c.z[Math.floor(cell/nx)][cell % nx + (i < NA[0] ? 0 : nx)] += 1;
+                });
+            } else {
+                c.X = playback.X.slice();
+            }
+            // range of the fluctuations observed up to each step
+            let lo = bin(NA[0]), hi = lo;
+            NA.forEach((na, k) => {
+                lo = Math.min(lo, bin(na));
+                hi = Math.max(hi, bin(na));
+                c.lo[k] = lo;
+                c.hi[k] = hi;
+            });
+            c.counts[bin(NA[0])] = 1;
+            window.ehrenfestPlayback = c;
+        }
+        // move particle i to A (d = 1) or to B (d = -1)
+        const move = (i, d) => {
+            if (c.X) {
+                c.X[i] -= d*playback.width;
+            } else {
+                const row = Math.floor(cells[i]/nx), col = cells[i] % nx;
+                c.z[row][col + (d > 0 ? nx : 0)] -= 1;
+                c.z[row][col + (d > 0 ? 0 : nx)] += 1;
+            }
+        };
+        // move forward or backward from the last step drawn
+        while (c.t < step) {
+            move(flips[c.t], NA[c.t + 1] - NA[c.t]);
+            c.t++;
+            c.counts[bin(NA[c.t])] += 1;
+        }
+        while (c.t > step) {
+            c.counts[bin(NA[c.t])] -= 1;
+            move(flips[c.t - 1], NA[c.t - 1] - NA[c.t]);
+            c.t--;
+        }
+        const t = c.t;
+        // histogram in the observed range, merging groups of bars
+        // if they are too many (as display_hist on the server)
+        const size = c.hi[t] - c.lo[t] + 1;
+        const group = size > playback.bars ? 2*Math.ceil(size/(2*playback.bars)) : 1;
+        const hist_x = [], hist_y = [];
+        for (let b = c.lo[t]; b <= c.hi[t]; b += group) {
+            const end = Math.min(b + group, c.hi[t] + 1);
+            let sum = 0;
+            for (let k = b; k < end; k++) {
+                sum += c.counts[k];
+            }
+            hist_x.push((b - n)/n);
+            hist_y.push(sum/(t + 1)/Math.ceil((end - b)/2));
+        }
+        // exact distribution stored for the last step before t
+        const exact = playback.exact[Math.floor(t/playback.every)];
+        const exact_x = exact.p.map((v, j) => (n - 2*(exact.start + exact.step*j + (exact.step - 1)/2))/n);
+        const view = c.X ? {x: c.X.slice()} : {z: c.z.map(row => row.slice())};
+        const data = figure.data;
+        return [
+            {...particles, data: [{...particles.data[0], ...view}]},
+            {...figure, data: [
+                {...data[0], x: null, y: c.fA.slice(0, t + 1)},
+                {...data[1], x: null, y: c.fB.slice(0, t + 1)},
+                {...data[2], x: hist_x, y: hist_y},
+                {...data[3], x: exact_x, y: exact.p},
+                ...data.slice(4) // ensemble traces do not change
+            ]}
+        ];
+    }
+    """,
+    [Output(_id('particles'), 'figure', allow_duplicate=True),
+     Output(_id('plot'), 'figure', allow_duplicate=True)],
+    Input(_id('step-slider'), 'value'),
+    [State(_id('playback'), 'data'),
+     State(_id('particles'), 'figure'),
+     State(_id('plot'), 'figure')],
+    prevent_initial_call=True
+)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,12 @@
+import base64
+import json
 import numpy as np
+import os
 import plotly.graph_objs as go
-from numpy.random import default_rng
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from math import comb
+from numpy.random import default_rng, SeedSequence
 from plotly.subplots import make_subplots
 
 
@@ -12,6 +18,924 @@ def normpdf(x, mean, sd):
     return num/denom
 
 
+# above this number of replicas*steps ensembles are run in a process pool
+parallel_threshold = 2*10**7
+# maximum number of processes of the pool, so that each request of the page
+# does not take all the cores of the server
+max_processes = 4
+# cost of each pass of the loop on the extractions of urn models (a vectorized
+# pass on the particles extracted for the r-th time), in units of the cost per
+# element of the passes of pointer doubling. Both methods were timed on
+# HoppingModel runs with 1-10^4 particles, 2-5 boxes and 10^4-10^6 steps, on
+# one core of an x86_64 Linux virtual machine (Intel Xeon, python 3.11, numpy
+# 1.25): about 5 us for each pass of the loop, about 15 ns for each element of
+# a pass of pointer doubling. The costs for each step of the two methods are
+# similar (0.2-0.4 us) and are left out. Only the order of magnitude matters:
+# where the two costs are close, both methods take about the same time
+level_cost = 300
+
+
+def _flip_parity(flips):
+    '''
+    for each extraction, tell if the chosen particle has already been
+    extracted an odd number of times since the beginning of the batch
+
+    Parameters
+    ----------
+    flips : array of int
+        index of the particle extracted at each step
+
+    Returns
+    -------
+    odd : array of bool
+        True if the particle has been moved an odd number of times before
+    '''
+    m = len(flips)
+    # numpy uses radix sort for small integers, that is much faster
+    keys = flips.astype(np.uint16) if m and flips.max() < 2**16 else flips
+    # group the extractions by particle, keeping the time order in each group
+    order = np.argsort(keys, kind='stable')
+    sorted_flips = flips[order]
+    start = np.ones(m, dtype=bool)
+    start[1:] = sorted_flips[1:] != sorted_flips[:-1]
+    # position of each extraction inside its group
+    idx = np.arange(m)
+    rank = idx - np.maximum.accumulate(np.where(start, idx, 0))
+    odd = np.empty(m, dtype=bool)
+    odd[order] = rank % 2 == 1
+    return odd
+
+
+class EhrenfestSimulation:
+    '''
+    Vectorized simulation of the Ehrenfest model for ideal gas expansion.
+    Klein, M. J. Entropy and the Ehrenfest Urn Model. Physica 1956, 22 (6), 569–575.
+    https://doi.org/10.1016/S0031-8914(56)90001-5.
+
+    All the extractions of a run are drawn at once and the occupation of the
+    boxes is obtained with a cumulative sum, so that a run costs
+    O(nsteps log nsteps) instead of O(nsteps*(nsteps+n)).
+    The simulation keeps its state, so that it can be advanced further by
+    calling run() again.
+
+    Attributes
+    ----------
+    n : int
+        total number of particles
+    start : int
+        step of the first value stored in NA (not 0 for resumed simulations)
+    A : array of bool
+        mask of particles currently in box A
+    flips : array of int
+        index of the particle moved at each step
+    delta : array of int
+        change in the number of particles in A at each step (+1 or -1)
+    NA : array of int
+        number of particles in A at each step (first element is the initial state)
+    counts : array of int
+        histogram (counts) of the fluctuation over all the steps
+    '''
+    def __init__(self, nA=10, nB=10, seed=None):
+        '''
+        Parameters
+        ----------
+        nA, nB : int
+            initial number of particles in box A and box B, respectively
+        seed : int or numpy.random.SeedSequence
+            seed for the random number generator
+        '''
+        n = nA + nB
+        # Assign nA particles in box A and nB in box B
+        A = np.zeros(n, dtype=bool) # mask for box A
+        A[:nA] = True
+        self._setup(default_rng(seed), A)
+        self.counts[self._bin_index(self.fluctuation)] += 1
+        # sums for the first two moments of the fluctuation (Gaussian fit)
+        self._sum = np.cumsum(self.fluctuation, dtype=float)
+        self._sum2 = np.cumsum(self.fluctuation.astype(float)**2)
+
+    def _setup(self, rng, A, start=0):
+        '''initialize the simulation with particles in A given by the mask A'''
+        self.rng = rng
+        self.n = n = len(A)
+        self.start = start
+        self.A0 = A.copy() # initial mask for box A
+        self.A = A.copy() # current mask for box A
+        self.flips = np.zeros(0, dtype=np.int64)
+        self.delta = np.zeros(0, dtype=np.int8)
+        self.NA = np.array([A.sum()], dtype=np.int64)
+        # histogram of fluctuations, with the same bins used by np.histogram
+        self.bins = np.arange(-n, n+1, 1)
+        self.counts = np.zeros(len(self.bins)-1, dtype=np.int64)
+
+    def get_state(self):
+        '''
+        current state of the simulation, as a JSON serializable dictionary.
+        The trajectory is not included, only what is needed to resume the
+        simulation with from_state: random number generator, particles in A,
+        histogram and moments accumulators.
+        '''
+        nonzero = np.flatnonzero(self.counts)
+        return {'step': self.start + self.nsteps,
+                'n': self.n,
+                # big integers in the generator state do not survive javascript
+                'rng': json.dumps(self.rng.bit_generator.state),
+                'A': base64.b64encode(np.packbits(self.A)).decode(),
+                'bins': nonzero.tolist(),
+                'counts': self.counts[nonzero].tolist(),
+                'sum': self._sum[-1],
+                'sum2': self._sum2[-1]}
+
+    @classmethod
+    def from_state(cls, state):
+        '''
+        resume a simulation from a state saved with get_state
+
+        Parameters
+        ----------
+        state : dict
+            state of the simulation
+
+        Returns
+        -------
+        sim : EhrenfestSimulation
+            the simulation, with the current state as first step
+        '''
+        sim = cls.__new__(cls)
+        rng = default_rng()
+        rng.bit_generator.state = json.loads(state['rng'])
+        packed = np.frombuffer(base64.b64decode(state['A']), dtype=np.uint8)
+        A = np.unpackbits(packed, count=state['n']).astype(bool)
+        sim._setup(rng, A, start=state['step'])
+        sim.counts[state['bins']] = state['counts']
+        sim._sum = np.array([state['sum']])
+        sim._sum2 = np.array([state['sum2']])
+        return sim
+
+    def _bin_index(self, fluctuation):
+        '''histogram bin of each fluctuation value (last bin is closed)'''
+        return np.minimum(fluctuation + self.n, len(self.bins)-2)
+
+    def run(self, nsteps):
+        '''
+        advance the simulation by nsteps extractions
+
+        Parameters
+        ----------
+        nsteps : int
+            number of steps (extractions) to run
+
+        Returns
+        -------
+        NA : array of int
+            number of particles in A after each new step
+        '''
+        flips = self.rng.integers(0, self.n, nsteps) # choose random particles
+        # a particle is in A before being moved if it started the batch in A
+        # and has been moved an even number of times, or vice versa
+        in_A = self.A[flips] ^ _flip_parity(flips)
+        delta = np.where(in_A, -1, 1).astype(np.int8)
+        NA = self.NA[-1] + np.cumsum(delta)
+        # particles moved an odd number of times changed box
+        self.A ^= np.bincount(flips, minlength=self.n) % 2 == 1
+        self.flips = np.concatenate((self.flips, flips))
+        self.delta = np.concatenate((self.delta, delta))
+        self.NA = np.concatenate((self.NA, NA))
+        # update histogram and moments only with the new values
+        fluctuation = self.n - 2*NA
+        self.counts += np.bincount(self._bin_index(fluctuation), minlength=len(self.counts))
+        self._sum = np.concatenate((self._sum, self._sum[-1] + np.cumsum(fluctuation, dtype=float)))
+        self._sum2 = np.concatenate((self._sum2, self._sum2[-1] + np.cumsum(fluctuation.astype(float)**2)))
+        return NA
+
+    @property
+    def nsteps(self):
+        '''number of steps run so far'''
+        return len(self.flips)
+
+    @property
+    def fA(self):
+        '''fraction of particles in A at each step'''
+        return self.NA/self.n
+
+    @property
+    def fB(self):
+        '''fraction of particles in B at each step'''
+        return 1 - self.NA/self.n
+
+    @property
+    def fluctuation(self):
+        '''difference between particles in B and in A at each step'''
+        return self.n - 2*self.NA
+
+    @property
+    def hist(self):
+        '''normalized histogram of fluctuations over all the steps, as np.histogram'''
+        return self.counts/self.counts.sum(), self.bins
+
+    @property
+    def mean(self):
+        '''running mean of the fluctuation'''
+        return self._sum/np.arange(self.start+1, self.start+len(self._sum)+1)
+
+    @property
+    def std(self):
+        '''running standard deviation of the fluctuation'''
+        var = self._sum2/np.arange(self.start+1, self.start+len(self._sum2)+1) - self.mean**2
+        return np.sqrt(np.maximum(var, 0))
+
+    def hist_fit(self):
+        '''gaussian fit for the histogram of fluctuations over all the steps'''
+        return normpdf(self.bins, self.mean[-1], self.std[-1])
+
+
+def ehrenfest_exact(nA=10, nB=10, nsteps=100, every=1, cumulative=False, window=None):
+    '''
+    Exact evolution of the probability distribution of the Ehrenfest model.
+    The number of particles in A, N_A, is a birth-death Markov chain:
+    at each step it decreases by one with probability N_A/n and
+    increases by one with probability (n-N_A)/n. Applying the (tridiagonal)
+    transition operator t times gives the exact distribution at step t,
+    with no sampling noise. Only the values of N_A that can be reached
+    in t steps are updated, so the cost is O(t*min(n, t)) and large
+    systems remain cheap for short runs.
+
+    Parameters
+    ----------
+    nA, nB : int
+        initial number of particles in box A and box B, respectively
+    nsteps : int
+        number of steps (extractions)
+    every : int
+        store the distribution only every `every` steps
+    cumulative : bool
+        if True, the stored distributions are averaged over all the previous
+        steps, as the histogram collected along a single simulation
+    window : tuple of int, optional
+        (lo, hi): store only the probabilities that lo <= N_A < hi,
+        to keep the output small for large systems
+
+    Returns
+    -------
+    P : array
+        probability that N_A = 0, 1, ..., n (or lo, ..., hi-1 if a window is
+        given), one row for each stored step
+    mean, var : array
+        mean and variance of the fluctuation (N_B - N_A) at each step
+    S : array
+        Boltzmann entropy, ln W, averaged over the distribution at each step
+        (in units of the Boltzmann constant)
+    '''
+    n = nA + nB
+    k = np.arange(n+1)
+    down = k/n # probability to move a particle from A to B
+    up = (n-k)/n # probability to move a particle from B to A
+    fluctuation = n - 2*k
+    # number of microstates W = n!/(N_A! N_B!) computed as a running product
+    lnW = np.zeros(n+1)
+    lnW[1:] = np.cumsum(np.log((n-k[1:]+1)/k[1:]))
+    store = slice(*window) if window else slice(None)
+    p = np.zeros(n+1)
+    p[nA] = 1
+    new = np.zeros(n+1)
+    p_sum = p.copy() # sum of distributions, for cumulative averages
+    P = [p[store].copy()]
+    mean = np.zeros(nsteps+1)
+    var = np.zeros(nsteps+1)
+    S = np.zeros(nsteps+1)
+    lo = hi = nA # values of N_A with nonzero probability
+    for t in range(nsteps+1):
+        if t:
+            # apply the transition operator on the reachable values only:
+            # p and new are zero outside them
+            lo, hi = max(lo-1, 0), min(hi+1, n)
+            new[lo:hi+1] = 0
+            a = min(hi, n-1)
+            new[lo:a+1] += p[lo+1:a+2]*down[lo+1:a+2]
+            a = max(lo, 1)
+            new[a:hi+1] += p[a-1:hi]*up[a-1:hi]
+            p, new = new, p
+            p_sum[lo:hi+1] += p[lo:hi+1]
+            if not t % every:
+                P.append(p_sum[store]/(t+1) if cumulative else p[store].copy())
+        reach = slice(lo, hi+1)
+        mean[t] = p[reach] @ fluctuation[reach]
+        var[t] = p[reach] @ fluctuation[reach]**2 - mean[t]**2
+        S[t] = p[reach] @ lnW[reach]
+    return np.array(P), mean, var, S
+
+
+def ehrenfest_equilibrium(n):
+    '''
+    equilibrium (binomial) distribution of the Ehrenfest model,
+    that is reached after many steps
+
+    Parameters
+    ----------
+    n : int
+        total number of particles
+
+    Returns
+    -------
+    P : array
+        probability that N_A = 0, 1, ..., n
+    '''
+    k = np.arange(n+1)
+    # ln of n!/(N_A! N_B!), computed as a running product
+    lnW = np.zeros(n+1)
+    lnW[1:] = np.cumsum(np.log((n-k[1:]+1)/k[1:]))
+    W = np.exp(lnW - lnW.max()) # rescaled to avoid overflow
+    return W/W.sum()
+
+
+def _ensemble_shard(nA, n, nsteps, replicas, every, seed):
+    '''
+    run a group of independent replicas of the Ehrenfest model
+    (see ehrenfest_ensemble)
+
+    Returns
+    -------
+    lo : array of int
+        smallest N_A among the replicas, for each stored step
+    rows : list of array
+        counts of replicas with N_A = lo, lo+1, ..., for each stored step
+    s1, s2 : array
+        sum of N_A and of N_A**2 over the replicas at each step
+    '''
+    rng = default_rng(seed)
+    NA = np.full(replicas, nA) # only the counts are needed, not the particles
+    lo = np.zeros(nsteps//every+1, dtype=np.int64)
+    rows = [np.array([replicas], dtype=np.int64)]
+    s1 = np.zeros(nsteps+1)
+    s2 = np.zeros(nsteps+1)
+    lo[0] = nA
+    s1[0] = replicas*nA
+    s2[0] = replicas*nA**2
+    # random numbers are drawn in blocks of about 10^6 values
+    block = max(1, 2**20//max(replicas, 1))
+    t = 0
+    for start in range(0, nsteps, block):
+        u = rng.random((min(block, nsteps-start), replicas))*n
+        for row in u:
+            # the particle extracted is in A with probability N_A/n
+            NA += np.where(row < NA, -1, 1)
+            t += 1
+            s1[t] = NA.sum()
+            s2[t] = (NA*NA).sum()
+            if not t % every:
+                # only the values spanned by the replicas are counted: about
+                # a few sqrt(n) values, whatever n and nsteps are
+                lo[t//every] = NA.min()
+                rows.append(np.bincount(NA - lo[t//every]))
+    return lo, rows, s1, s2
+
+
+def ehrenfest_ensemble(nA=10, nB=10, nsteps=100, replicas=1000, every=1, processes=None, seed=None):
+    '''
+    Run many independent replicas of the Ehrenfest model at once.
+    The state of each replica is just its number of particles in A, so that
+    each step is a vectorized operation on all the replicas.
+    When replicas*nsteps is large, replicas are split among a pool of
+    at most max_processes processes.
+
+    Parameters
+    ----------
+    nA, nB : int
+        initial number of particles in box A and box B, respectively
+    nsteps : int
+        number of steps (extractions) to run
+    replicas : int
+        number of independent replicas
+    every : int
+        store the ensemble histogram only every `every` steps
+    processes : int
+        number of processes to use; if None, up to max_processes are used
+        when replicas*nsteps is larger than parallel_threshold
+    seed : int or numpy.random.SeedSequence
+        seed for the random number generators
+
+    Returns
+    -------
+    hist : array
+        hist[i, k] is the number of replicas with N_A = offset[i] + k,
+        one row for each stored step; the columns only span the values
+        reached by the replicas at each step
+    offset : array of int
+        value of N_A of the first column of hist, for each stored step
+    mean, std : array
+        ensemble average and standard deviation of N_A at each step
+    '''
+    n = nA + nB
+    if processes is None:
+        processes = min(os.cpu_count() or 1, max_processes) if replicas*nsteps >= parallel_threshold else 1
+    processes = max(1, min(processes, replicas))
+    # each group of replicas has an independent random number generator
+    seeds = SeedSequence(seed).spawn(processes)
+    sizes = np.diff(np.linspace(0, replicas, processes+1).astype(int))
+    args = [(nA, n, nsteps, size, every, s) for size, s in zip(sizes, seeds)]
+    if processes > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_ensemble_shard, *zip(*args)))
+    else:
+        results = [_ensemble_shard(*args[0])]
+    # merge the histograms of the groups on the union of their ranges
+    offset = np.min([r[0] for r in results], axis=0)
+    width = max((r[0] - offset + [len(row) for row in r[1]]).max() for r in results)
+    hist = np.zeros((len(offset), width), dtype=np.int64)
+    for r in results:
+        for i, (start, row) in enumerate(zip(r[0] - offset, r[1])):
+            hist[i, start:start+len(row)] += row
+    mean = sum(r[2] for r in results)/replicas
+    var = sum(r[3] for r in results)/replicas - mean**2
+    return hist, offset, mean, np.sqrt(np.maximum(var, 0))
+
+
+def hist_quantile(hist, q, offset=0):
+    '''
+    compute quantiles of N_A from the ensemble histograms
+
+    Parameters
+    ----------
+    hist : array
+        number of replicas with N_A = offset, offset+1, ..., one row for each step
+    q : float
+        quantile, between 0 and 1
+    offset : int or array of int
+        value of N_A of the first column of hist, for each step (see ehrenfest_ensemble)
+
+    Returns
+    -------
+    NA : array of int
+        quantile of N_A for each step
+    '''
+    cdf = np.cumsum(hist, axis=1)
+    return (cdf >= q*cdf[:, -1:]).argmax(axis=1) + offset
+
+
+def _previous_pick(picks):
+    '''
+    for each extraction, index of the previous extraction of the same item
+
+    Parameters
+    ----------
+    picks : array of int
+        index of the item extracted at each step
+
+    Returns
+    -------
+    prev : array of int
+        index of the previous extraction of the same item, -1 for the first one
+    '''
+    m = len(picks)
+    # numpy uses radix sort for small integers, that is much faster
+    keys = picks.astype(np.uint16) if m and picks.max() < 2**16 else picks
+    # group the extractions by item, keeping the time order in each group
+    order = np.argsort(keys, kind='stable')
+    same = picks[order[1:]] == picks[order[:-1]]
+    prev = np.full(m, -1)
+    prev[order[1:][same]] = order[:-1][same]
+    return prev
+
+
+def _last_pick(picks, prev, size):
+    '''index of the last extraction of each item (-1 if never extracted)'''
+    # the last extractions are the ones that are not previous to any other
+    followed = np.zeros(len(picks), dtype=bool)
+    followed[prev[prev >= 0]] = True
+    steps = np.flatnonzero(~followed)
+    last = np.full(size, -1)
+    last[picks[steps]] = steps
+    return last
+
+
+def _pick_levels(picks):
+    '''
+    group the extractions by the number of previous extractions of the
+    same item, so that all the items extracted for the r-th time can be
+    processed together
+
+    Parameters
+    ----------
+    picks : array of int
+        index of the item extracted at each step
+
+    Returns
+    -------
+    steps : array of int
+        steps sorted by level, in time order inside each level
+    bounds : array of int
+        position in steps of the first step of each level (and of the end)
+    '''
+    m = len(picks)
+    # numpy uses radix sort for small integers, that is much faster
+    keys = picks.astype(np.uint16) if m and picks.max() < 2**16 else picks
+    order = np.argsort(keys, kind='stable')
+    sorted_picks = picks[order]
+    start = np.ones(m, dtype=bool)
+    start[1:] = sorted_picks[1:] != sorted_picks[:-1]
+    idx = np.arange(m)
+    level = np.empty(m, dtype=np.int64)
+    level[order] = idx - np.maximum.accumulate(np.where(start, idx, 0))
+    steps = np.argsort(level.astype(np.uint32), kind='stable')
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(level))))
+    return steps, bounds
+
+
+def _compose_chains(prev, maps):
+    '''
+    compose random maps along chains of extractions: maps[t] is applied at
+    step t after all the maps of the previous extractions of the same item.
+    Pointer doubling needs only log2(length of the longest chain)
+    vectorized passes, instead of one pass for each step.
+
+    Parameters
+    ----------
+    prev : array of int
+        previous extraction of the same item (see _previous_pick)
+    maps : array of int
+        maps[t, i] is the state of the item after step t, if it was i before
+
+    Returns
+    -------
+    maps : array of int
+        composition of the maps of the chain up to each step
+    '''
+    maps = maps.copy()
+    prev = prev.copy()
+    active = np.flatnonzero(prev >= 0)
+    while len(active):
+        before = prev[active]
+        # the right hand sides are evaluated before the assignments,
+        # so each pass uses the maps of the previous one
+        maps[active] = np.take_along_axis(maps[active], maps[before], axis=1)
+        prev[active] = prev[before]
+        active = active[prev[active] >= 0]
+    return maps
+
+
+def _chain_roots(prev):
+    '''first element of the chain of each element, following prev (-1 ends a chain)'''
+    root = np.where(prev >= 0, prev, np.arange(len(prev)))
+    while True:
+        # pointer doubling: each pass halves the distance from the roots
+        jump = root[root]
+        if np.array_equal(jump, root):
+            return root
+        root = jump
+
+
+def _compositions(n, k):
+    '''all the ways to put n identical particles in k boxes, one for each row'''
+    bars = np.array(list(combinations(range(n+k-1), k-1)), dtype=np.int64).reshape(-1, k-1)
+    edges = np.hstack((np.full((len(bars), 1), -1), bars, np.full((len(bars), 1), n+k-1)))
+    return np.diff(edges, axis=1) - 1
+
+
+class UrnModel:
+    '''
+    Base class for urn models, where particles (or balls) move among boxes
+    (or urns) at each step with probabilities that only depend on the numbers
+    of particles in each box. The counts are the state shared by all the
+    models: Monte Carlo runs store them at each step and update the
+    statistics only with the new values, while the exact master equation
+    evolves the probability of each possible vector of counts with a sparse
+    transition operator.
+
+    Subclasses define:
+
+    - _run_batch(nsteps): simulate nsteps steps and return the counts after each of them
+    - _states(): all the vectors of counts that the model can reach
+    - _moves(states): changes of the counts of each move and their probabilities from each state
+
+    Attributes
+    ----------
+    counts : array of int
+        counts at each step, one row for each step (first row is the initial state)
+    occupancy : array of int
+        histogram of the values of each count over all the steps, one row for each count
+    '''
+    # larger state spaces are not evolved exactly
+    max_states = 10**6
+
+    def _setup(self, rng, counts, max_count):
+        '''initialize counts and statistics with the initial counts'''
+        self.rng = rng
+        counts = np.asarray(counts, dtype=np.int64)
+        self.counts = counts.reshape(1, -1)
+        self.occupancy = np.zeros((len(counts), max_count+1), dtype=np.int64)
+        self.occupancy[np.arange(len(counts)), counts] = 1
+        self._sum = counts.astype(float)
+        self._sum2 = counts.astype(float)**2
+        self._operator = None
+
+    def run(self, nsteps):
+        '''
+        advance the simulation by nsteps steps
+
+        Parameters
+        ----------
+        nsteps : int
+            number of steps to run
+
+        Returns
+        -------
+        counts : array of int
+            counts after each new step, one row for each step
+        '''
+        counts = self._run_batch(nsteps)
+        self.counts = np.concatenate((self.counts, counts))
+        # update histograms and moments only with the new values
+        size = self.occupancy.shape[1]
+        index = counts + size*np.arange(counts.shape[1])
+        self.occupancy += np.bincount(index.ravel(), minlength=self.occupancy.size).reshape(self.occupancy.shape)
+        self._sum += counts.sum(axis=0)
+        self._sum2 += (counts.astype(float)**2).sum(axis=0)
+        return counts
+
+    @property
+    def nsteps(self):
+        '''number of steps run so far'''
+        return len(self.counts) - 1
+
+    @property
+    def hist(self):
+        '''normalized histogram of each count over all the steps, one row for each count'''
+        return self.occupancy/len(self.counts)
+
+    @property
+    def mean(self):
+        '''mean of each count over all the steps'''
+        return self._sum/len(self.counts)
+
+    @property
+    def std(self):
+        '''standard deviation of each count over all the steps'''
+        var = self._sum2/len(self.counts) - self.mean**2
+        return np.sqrt(np.maximum(var, 0))
+
+    @property
+    def states(self):
+        '''all the vectors of counts that the model can reach, one for each row'''
+        if self._operator is None:
+            self.transition_operator()
+        return self._operator[0]
+
+    def _index(self, states, counts):
+        '''position in states of each vector of counts (rows of counts)'''
+        # vectors of counts are ranked as numbers with base max_count+1
+        base = self.occupancy.shape[1]
+        if base**states.shape[1] >= 2**63:
+            raise ValueError('too many boxes for the exact evolution')
+        weights = base**np.arange(states.shape[1], dtype=np.int64)
+        keys = states @ weights
+        order = np.argsort(keys)
+        return order[np.searchsorted(keys, counts @ weights, sorter=order)]
+
+    def transition_operator(self):
+        '''
+        sparse transition operator of the Markov chain of the counts,
+        computed once for each model
+
+        Returns
+        -------
+        states : array of int
+            all the vectors of counts that the model can reach, one for each row
+        rows, cols : array of int
+            index of the states before and after each transition
+        probs : array
+            probability of each transition
+        '''
+        if self._operator is None:
+            states = self._states()
+            if len(states) > self.max_states:
+                raise ValueError(f'{len(states)} states are too many for the exact evolution')
+            changes, probs = self._moves(states)
+            S = len(states)
+            rows, cols = np.nonzero(probs)
+            targets = self._index(states, states[rows] + changes[cols])
+            # the remaining probability is for staying in the same state
+            stay = 1 - probs.sum(axis=1)
+            self._operator = (states,
+                              np.concatenate((rows, np.arange(S))),
+                              np.concatenate((targets, np.arange(S))),
+                              np.concatenate((probs[rows, cols], stay)))
+        return self._operator
+
+    def exact(self, nsteps=100, every=1):
+        '''
+        exact evolution of the probability of each vector of counts, from
+        the current state, obtained by applying the sparse transition operator
+        (master equation) with a cost O(nsteps*transitions)
+
+        Parameters
+        ----------
+        nsteps : int
+            number of steps
+        every : int
+            store the distribution only every `every` steps
+
+        Returns
+        -------
+        P : array
+            probability of each state (see states), one row for each stored step
+        mean, var : array
+            mean and variance of each count at each step, one row for each step
+        '''
+        states, rows, cols, probs = self.transition_operator()
+        p = np.zeros(len(states))
+        p[self._index(states, self.counts[-1:])] = 1
+        P = [p]
+        mean = np.zeros((nsteps+1, states.shape[1]))
+        var = np.zeros((nsteps+1, states.shape[1]))
+        for t in range(nsteps+1):
+            if t:
+                # sparse product p @ T, with T[rows, cols] = probs
+                p = np.bincount(cols, weights=probs*p[rows], minlength=len(states))
+                if not t % every:
+                    P.append(p)
+            mean[t] = p @ states
+            var[t] = p @ states**2 - mean[t]**2
+        return np.array(P), mean, var
+
+
+class HoppingModel(UrnModel):
+    '''
+    Particles hopping among k boxes, a generalization of the Ehrenfest model.
+    At each step a particle is chosen at random and moved from its box i to
+    box j with probability connectivity[i, j]; if the boxes have an energy
+    (in units of kT) moves that increase it are accepted only with probability
+    exp(-(E_j - E_i)) (Metropolis), so that a field drives the particles
+    towards the boxes with lower energy.
+    Two boxes, all connected and with the same energy, are the Ehrenfest model.
+
+    The particles are independent, so that each one follows its own Markov
+    chain, driven by the steps when it is extracted: all the extractions of a
+    run are drawn at once and the chains of all the particles are advanced
+    together, one extraction of each particle at a time (or with pointer
+    doubling, when few particles are extracted many times).
+    '''
+    def __init__(self, counts=(10, 10), connectivity=None, energy=None, seed=None):
+        '''
+        Parameters
+        ----------
+        counts : array of int
+            initial number of particles in each box
+        connectivity : array, optional
+            probability to try a move from box i to box j, for the chosen particle;
+            if None, the other boxes are chosen with the same probability
+        energy : array, optional
+            energy of each box in units of kT; if None, all the boxes have
+            the same energy
+        seed : int or numpy.random.SeedSequence
+            seed for the random number generator
+        '''
+        counts = np.asarray(counts)
+        k = len(counts)
+        self.n = n = int(counts.sum())
+        if connectivity is None:
+            connectivity = (1 - np.eye(k))/max(k-1, 1)
+        connectivity = np.array(connectivity, dtype=float)
+        np.fill_diagonal(connectivity, 0)
+        if energy is None:
+            energy = np.zeros(k)
+        self.energy = np.asarray(energy, dtype=float)
+        # probability that the chosen particle moves from box i to box j
+        Q = connectivity*np.minimum(1, np.exp(self.energy[:, None] - self.energy[None, :]))
+        Q[np.diag_indices(k)] = 1 - Q.sum(axis=1)
+        if (Q < -1e-12).any():
+            raise ValueError('the probabilities to leave a box add up to more than 1')
+        self.Q = Q
+        self.box = np.repeat(np.arange(k), counts) # box of each particle
+        self._setup(default_rng(seed), counts, n)
+
+    def _run_batch(self, nsteps):
+        k = len(self.Q)
+        picks = self.rng.integers(0, self.n, nsteps) # choose random particles
+        u = self.rng.random(nsteps)
+        # the chosen particle moves from box i to the first box j with u < cdf[i, j]
+        cdf = np.cumsum(self.Q, axis=1)
+        cdf[:, -1] = np.inf # avoid rounding errors of the cumulative sum
+        # box of the extracted particle before and after each step
+        before = np.empty(nsteps, dtype=np.int64)
+        after = np.empty(nsteps, dtype=np.int64)
+        # the loop makes one pass for each level of extractions, while
+        # pointer doubling makes log2(levels) passes on the maps of all the steps
+        levels = max(nsteps/self.n, 1)
+        loop_cost = level_cost*levels
+        doubling_cost = k*np.log2(levels)*nsteps
+        if doubling_cost < loop_cost:
+            # few particles extracted many times: the moves of each
+            # particle are composed with pointer doubling
+            maps = (cdf[None, :, :] <= u[:, None, None]).sum(axis=2)
+            prev = _previous_pick(picks)
+            after[:] = _compose_chains(prev, maps)[np.arange(nsteps), self.box[picks]]
+            before[:] = np.where(prev >= 0, after[prev], self.box[picks])
+            last = _last_pick(picks, prev, self.n)
+            self.box[last >= 0] = after[last[last >= 0]]
+        else:
+            # the particles extracted for the r-th time move together
+            steps, bounds = _pick_levels(picks)
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                step = steps[lo:hi]
+                particle = picks[step]
+                before[step] = self.box[particle]
+                after[step] = (cdf[before[step]] <= u[step, None]).sum(axis=1)
+                self.box[particle] = after[step]
+        change = np.zeros((nsteps, k), dtype=np.int64)
+        change[np.arange(nsteps), after] += 1
+        change[np.arange(nsteps), before] -= 1
+        return self.counts[-1] + np.cumsum(change, axis=0)
+
+    def _states(self):
+        k = len(self.Q)
+        # check the number of states before listing them
+        size = comb(self.n+k-1, k-1)
+        if size > self.max_states:
+            raise ValueError(f'{size} states are too many for the exact evolution')
+        return _compositions(self.n, k)
+
+    def _moves(self, states):
+        k = len(self.Q)
+        i, j = np.nonzero(~np.eye(k, dtype=bool) & (self.Q > 0))
+        changes = np.zeros((len(i), k), dtype=np.int64)
+        changes[np.arange(len(i)), i] = -1
+        changes[np.arange(len(i)), j] = 1
+        # the chosen particle is in box i with probability N_i/n
+        probs = states[:, i]/self.n*self.Q[i, j]
+        return changes, probs
+
+    @property
+    def fractions(self):
+        '''fraction of particles in each box at each step'''
+        return self.counts/self.n
+
+
+class BernoulliLaplace(UrnModel):
+    '''
+    Bernoulli-Laplace model of diffusion of two species: two urns contain
+    white and black balls and at each step a ball is drawn at random from
+    each urn and the two balls are exchanged, so that the number of balls
+    in each urn does not change.
+    The state is given by the number of white balls in urn A and in urn B.
+
+    A ball leaving an urn is the one brought in its place by the last
+    exchange involving the same position, so the color of each ball moved
+    is found following these chains back to the initial state, with
+    pointer doubling for all the steps of a run together.
+    '''
+    def __init__(self, nA=10, nB=10, wA=10, wB=0, seed=None):
+        '''
+        Parameters
+        ----------
+        nA, nB : int
+            number of balls in urn A and in urn B
+        wA, wB : int
+            initial number of white balls in urn A and in urn B
+        seed : int or numpy.random.SeedSequence
+            seed for the random number generator
+        '''
+        if not (0 <= wA <= nA and 0 <= wB <= nB):
+            raise ValueError('white balls must be at most as many as the balls in the urn')
+        self.nA = nA
+        self.nB = nB
+        # color of the ball in each position of the urns (True for white)
+        self.white_A = np.arange(nA) < wA
+        self.white_B = np.arange(nB) < wB
+        self._setup(default_rng(seed), (wA, wB), max(nA, nB))
+
+    def _run_batch(self, nsteps):
+        a = self.rng.integers(0, self.nA, nsteps) # position drawn in urn A
+        b = self.rng.integers(0, self.nB, nsteps) # position drawn in urn B
+        # step t leaves in position a[t] of A the ball drawn from B (element
+        # nsteps+t), and in position b[t] of B the ball drawn from A (element t)
+        prev_A = _previous_pick(a)
+        prev_B = _previous_pick(b)
+        prev = np.concatenate((np.where(prev_A >= 0, prev_A + nsteps, -1), prev_B))
+        initial = np.concatenate((self.white_A[a], self.white_B[b]))
+        white = initial[_chain_roots(prev)]
+        from_A, from_B = white[:nsteps], white[nsteps:]
+        change = from_B.astype(np.int64) - from_A
+        wA = self.counts[-1, 0] + np.cumsum(change)
+        last = _last_pick(a, prev_A, self.nA)
+        self.white_A[last >= 0] = from_B[last[last >= 0]]
+        last = _last_pick(b, prev_B, self.nB)
+        self.white_B[last >= 0] = from_A[last[last >= 0]]
+        return np.column_stack((wA, self.counts[0].sum() - wA))
+
+    def _states(self):
+        w = self.counts[0].sum()
+        wA = np.arange(max(0, w - self.nB), min(w, self.nA)+1)
+        return np.column_stack((wA, w - wA))
+
+    def _moves(self, states):
+        wA, wB = states.T
+        changes = np.array([[-1, 1], [1, -1]])
+        # a white ball from A and a black one from B, or vice versa
+        probs = np.column_stack((wA/self.nA*(self.nB - wB)/self.nB,
+                                 (self.nA - wA)/self.nA*wB/self.nB))
+        return changes, probs
+
+
 def Ehrenfest(nA=10, nB=10, nsteps=100, width=100., height=100):
     """
     Generator functions that simulates Ehrenfest model for
@@ -20,7 +944,8 @@ def Ehrenfest(nA=10, nB=10, nsteps=100, width=100., height=100):
     https://doi.org/10.1016/S0031-8914(56)90001-5.
 
     Each step yelds the configuration after a new extraction
-    in the model
+    in the model. The whole run is computed at once by EhrenfestSimulation,
+    the generator is just a step by step view over its results.
     
     Parameters
     ----------
@@ -34,56 +959,47 @@ def Ehrenfest(nA=10, nB=10, nsteps=100, width=100., height=100):
     Return
     X, Y : array
         X and Y coordinates for the particles in the box
-    fA, fB : float
+    fA, fB : array
         fraction of particles in box A and box B respect
     hist : array
         histogram of fluctuations
     hist_fit : array
         gaussian fit for the histogram   
     """
-    # initialize random number generator
-    rng = default_rng()
-    n = nA + nB # total number of particles
+    sim = EhrenfestSimulation(nA, nB)
+    rng = sim.rng
+    n = sim.n # total number of particles
     # generate random coordinates for particles in the box
     XY = rng.random((n, 2))*np.array((width, height))
-    # Assign nA particles in box A and nB in box B
-    A = np.zeros(len(XY),dtype=bool) # mask for box A
-    A[:nA] = True
-    B = np.invert(A) # mask for box B
     X = XY[:,0]
     Y = XY[:,1]
     # add box witdh to X coordinates of particles in box B
     # in order to plot them in the box B
-    X[B] += width # particles in B are in the right box
-    # fA, fB and fluctuation are lists storing a value for each step
-    fA = [A.sum()/n,] # fraction of particles in A 
-    fB = [B.sum()/n,] # fraction of particles in B
-    fluctuation = [B.sum()-A.sum(),]
-    # compute istogram of fluctuation
-    bins = np.arange(-n, n+1, 1)
-    hist = np.histogram(fluctuation, bins=bins, density=True)
+    X[~sim.A0] += width # particles in B are in the right box
+    sim.run(nsteps)
+    fA = sim.fA
+    fB = sim.fB
+    mean = sim.mean
+    std = sim.std
+    bins = sim.bins
+    # histogram of fluctuation, updated one value at a time
+    counts = np.zeros(len(bins)-1)
+    bin_index = sim._bin_index(sim.fluctuation)
+    counts[bin_index[0]] += 1
+    hist = (counts.copy(), bins) # counts is updated in place at the next steps
     # initialize histogram fit (none for first step)
     hist_fit = [[],[]]
     # yield first configuration
-    yield X, Y, fA, fB, hist, hist_fit
+    yield X, Y, fA[:1], fB[:1], hist, hist_fit
     # yield nsteps configurations
     for step in range(nsteps):
-        i = rng.choice(len(XY), 1) # choose random particle
-        A[i] = not A[i] # move the particle from one box
-        B[i] = not B[i] # to the other
-        if B[i]: # if the particles moved from A to B
-            X[i] += width # add box width to X coordinate
-        else: # if particle moved from B to A
-            X[i] -= width # subtract box width to X coordinate
-        # append new fraction values for this step
-        fA.append(A.sum()/n)
-        fB.append(B.sum()/n)
-        # append new fluctuation value for this step
-        fluctuation.append(B.sum()-A.sum())
-        # calculate new histogram with current data
-        hist = np.histogram(fluctuation, bins=bins, density=True)
-        # fit a gaussian distribution to the histogram
-        fluct_arr = np.array(fluctuation)
-        hist_fit = normpdf(hist[1], fluct_arr.mean(), fluct_arr.std())
-        yield X, Y, fA, fB, hist, hist_fit
-    return
\ No newline at end of file
+        i = sim.flips[step]
+        # move the particle from one box to the other:
+        # add box width to X coordinate if it moved from A to B
+        # subtract box width to X coordinate if it moved from B to A
+        X[i] -= sim.delta[step]*width
+        counts[bin_index[step+1]] += 1
+        hist = (counts/(step+2), bins)
+        hist_fit = normpdf(bins, mean[step+1], std[step+1])
+        yield X, Y, fA[:step+2], fB[:step+2], hist, hist_fit
+    return
@@ -4,8 +4,7 @@ import dash_bootstrap_components as dbc
 import dash_daq as daq
 import plotly.colors as pcolors
 import plotly.graph_objs as go
-import re
-from dash import callback, dcc, html
+from dash import callback, dcc, html, no_update
 from dash.dependencies import Input, Output, State, MATCH, ALL
 from dash.exceptions import PreventUpdate
 from flask import Flask, request
@@ -15,9 +14,9 @@ try: # when running as an independent app
 except: # when running in a multipage dashboard
     from .model import hill
 try: # when running as an independent app
-    from utilities import _id, common_setup
+    from utilities import _id, adaptive_sample, common_setup, update_container, update_figure
 except Exception as e: # when running in a multipage dashboard
-    from .utilities import _id, common_setup
+    from .utilities import _id, adaptive_sample, common_setup, update_container, update_figure
     
 
 # define translator function
@@ -92,6 +91,7 @@ def controls_card_factory(uid=None):
 add_button = dbc.Button(_('Add plot'), id=_id('add-button'), style={'margin-bottom':5})
 controls_container = dbc.Container([], id=_id('controls-container'), fluid=True)
 plot = dcc.Graph(id=_id('plot'), style={'height': '80vh'})
+traces = dcc.Store(id=_id('traces')) # number of traces of each curve in the plot
 pO2_slider = dbc.Container([html.H5("pO\u2082 --:-- mbar", id=_id('pO2-output')),
                             dcc.RangeSlider(id = _id('pO2-slider'),
                                             min=0, max=2000, step=50,
@@ -109,7 +109,7 @@ def layout():
     html.Hr(),
     dbc.Row([
         dbc.Col(left, align='left'),
-        dbc.Col([plot], xl=8, align='left')
+        dbc.Col([plot, traces], xl=8, align='left')
         ])
     ],
     fluid=True,
@@ -125,23 +125,11 @@ def layout():
 @callback(Output(_id('controls-container'), 'children'),
               [Input(_id('add-button'), 'n_clicks'),
                Input({'type':_id('clear-button'), 'uid': ALL}, 'n_clicks')],
-              State(_id('controls-container'), 'children')
+              State({'type':_id('controls-card'), 'uid': ALL}, 'id')
              )
-def update_controls_container(add_n_clicks, clear_n_clicks, controls_container_list):
+def update_controls_container(add_n_clicks, clear_n_clicks, card_ids):
     '''update container adding or removing controls as required'''
-    ctx = dash.callback_context # this is needed to know which button has been pushed
-    trigger = ctx.triggered[0]
-    if 'add-button' in trigger['prop_id']: # add a new panel
-        uid = add_n_clicks # unique id 
-        new_controls = controls_card_factory(uid=uid)
-        return controls_container_list+[new_controls]
-    else: # some delete button has been pushed
-        match = re.search(r'"uid":(\d+)',trigger['prop_id'])
-        if match:
-            uid = int(match.group(1)) # uid of the card
-            return [c for c in controls_container_list if c['props']['id']['uid'] != uid]
-        else:
-            raise PreventUpdate # needed when app starts         
+    return update_container(_id('add-button'), add_n_clicks, card_ids, controls_card_factory)
 
 @callback(Output({'type':_id('p50-output'), 'uid': MATCH}, 'children'),
               Input({'type':_id('p50-slider'), 'uid': MATCH}, 'value'))
@@ -161,29 +149,39 @@ def update_pO2_slider(val):
     return f'pO\u2082 = [{val[0]}-{val[1]}] mbar'
 
             
+def curve_traces(p50, n, pO2, color):
+    '''compute the traces of the curve of a controls card (no other information is needed)'''
+    pvals, s = adaptive_sample(lambda p: hill(p, p50, n), pO2[0], pO2[1], y_range=(0, 1))
+    data = [go.Scatter(x=pvals, y=s, mode='lines', line={'color': color}, showlegend=True,
+                       name=f'p50 = {p50}, n = {n}')]
+    return data, None
+
+
 # this is the most important function
 @callback([Output(_id('plot'), 'figure'),
                Output({'type':_id('controls-card'), 'uid': ALL}, 'style'),
+               Output(_id('traces'), 'data'),
               ],
               [Input({'type':_id('p50-slider'), 'uid': ALL}, 'value'),
                Input({'type':_id('n-slider'), 'uid': ALL}, 'value'),
                Input(_id('pO2-slider'), 'value')],
-               [State({'type':_id('controls-card'), 'uid': ALL}, 'style')]
+               [State({'type':_id('controls-card'), 'uid': ALL}, 'style'),
+                State({'type':_id('controls-card'), 'uid': ALL}, 'id'),
+                State(_id('traces'), 'data')]
              )
-def update_plot(p50_list, n_list, pO2, styles):
-    data = []
-    new_styles = []
-    for i, (p50, n, st) in enumerate(zip(p50_list, n_list, styles)):
+def update_plot(p50_list, n_list, pO2, styles, card_ids, traces):
+    curves = []
+    for i, (p50, n, card_id) in enumerate(zip(p50_list, n_list, card_ids)):
         color = colors[i%len(colors)]
-        st['border-color'] = color
-        new_styles.append(st)
-        pvals = np.linspace(pO2[0], pO2[1], 1000)
-        s = hill(pvals, p50, n)
-        data.append(go.Scatter(x=pvals, y=s, mode='lines', line={'color': color}, showlegend=True,
-                    name=f'p50 = {p50}, n = {n}'))
+        params = (p50, n, pO2, color)
+        curves.append((card_id['uid'], params, lambda params=params: curve_traces(*params)))
     layout = {'xaxis': {'title': 'pO\u2082 /mbar', 'range': (pO2[0], pO2[1])},
               'yaxis': {'title': _('saturation'), 'range': (0, 1)}}
-    return go.Figure(data=data, layout=layout), new_styles
+    fig, infos, changed, traces = update_figure(_id('plot'), traces, tuple(pO2), curves, lambda infos: layout)
+    # update only the cards whose curve has changed
+    new_styles = [dict(st, **{'border-color': params[-1]}) if c else no_update
+                  for st, (uid, params, factory), c in zip(styles, curves, changed)]
+    return fig, new_styles, traces
 
 @callback([Output(_id('add-button'), 'children')],
           [Input(_id('add-button'), 'children')])
@@ -4,8 +4,7 @@ import dash_bootstrap_components as dbc
 import dash_daq as daq
 import plotly.colors as pcolors
 import plotly.graph_objs as go
-import re
-from dash import callback, dcc, html
+from dash import callback, dcc, html, no_update
 from dash.dependencies import Input, Output, State, MATCH, ALL
 from dash.exceptions import PreventUpdate
 from flask import Flask, request
@@ -15,9 +14,9 @@ try: # when running as an independent app
 except: # when running in a multipage dashboard
     from .model import DG_mix, DS_mix, DH_mix, R
 try: # when running as an independent app
-    from utilities import _id, common_setup
+    from utilities import _id, adaptive_sample, common_setup, update_container, update_figure
 except Exception as e: # when running in a multipage dashboard
-    from .utilities import _id, common_setup
+    from .utilities import _id, adaptive_sample, common_setup, update_container, update_figure
     
 
 # define translator function
@@ -127,6 +126,7 @@ def controls_factory(uid):
 add_button = dbc.Button(_('Add plot'), id=_id('add-button'), style={'margin-bottom':5})
 controls_container = dbc.Container([], id=_id('controls-container'), fluid=True)
 plot = dcc.Graph(id=_id('plot'), style={'height': '80vh'})
+traces = dcc.Store(id=_id('traces')) # number of traces of each curve in the plot
 
 # Layout of the app with all the widgets
 def layout():
@@ -136,7 +136,7 @@ def layout():
     add_button,
     dbc.Row([
         dbc.Col(controls_container, align='left'),
-        dbc.Col([plot], xl=8, align='left')
+        dbc.Col([plot, traces], xl=8, align='left')
         ])
     ],
     fluid=True,
@@ -157,78 +157,88 @@ def setup_language_specific(*messages):
 @callback(Output(_id('controls-container'), 'children'),
               [Input(_id('add-button'), 'n_clicks'),
                Input({'type':_id('delete-button'), 'uid': ALL}, 'n_clicks')],
-              State(_id('controls-container'), 'children')
+              State({'type':_id('controls-card'), 'uid': ALL}, 'id')
              )
-def update_controls_container(add_n_clicks, clear_n_clicks, controls_container_list):
+def update_controls_container(add_n_clicks, clear_n_clicks, card_ids):
     '''update container adding or removing controls as required'''
-    ctx = dash.callback_context # this is needed to know which button has been pushed
-    trigger = ctx.triggered[0]
-    if 'add-button' in trigger['prop_id']: # add a new panel
-        uid = add_n_clicks # unique id 
-        new_controls = controls_factory(uid=uid)
-        return controls_container_list+[new_controls]
-    else: # some delete button has been pushed
-        match = re.search(r'"uid":(\d+)',trigger['prop_id'])
-        if match:
-            uid = int(match.group(1)) # uid of the card
-            return [c for c in controls_container_list if c['props']['id']['uid'] != uid]
-        else:
-            raise PreventUpdate # needed when app starts
+    return update_container(_id('add-button'), add_n_clicks, card_ids, controls_factory)
             
 
+def curve_traces(beta, T, DG, DS, DH, minima, color):
+    '''
+    compute the traces of the curves of a controls card
+    
+    Returns
+    -------
+    traces : list
+        plotly traces of the curves
+    info : tuple
+        labels with the compositions of the minima
+    '''
+    data = []
+    beta = beta*1000 # convert to J/mol
+    alpha = beta/(R*T)
+    if DG:
+        # the curve is sampled only where it bends, minima are found on the dense grid
+        xs, ys = adaptive_sample(lambda x1: DG_mix(beta, T, x1)[1], 0.0001, 1)
+        x, y = DG_mix(beta, T)
+        y = y*0.001 # kJ/mol
+        data.append(go.Scatter(x=xs, y=ys*0.001, mode='lines', line=dict(color=color), name=f'\u0394G: \u03B2 {beta/1000:.1f} kJ/mol, {T} K', showlegend=True)) 
+        if alpha>2:
+            idx = np.argsort(y)[:2]
+        else:
+            idx = [int(len(x)/2)]
+        x1_min = f'\u03C7\u2081 min = {x[idx][-1]:.3f}'
+        x1_max = f'\u03C7\u2081 max = {x[idx][0]:.3f}'
+        if minima: # show minima on plot
+            data.append(go.Scatter(x=x[idx], y=y[idx], mode='markers', marker_color='black', marker_symbol='circle-open', marker_size=10, name='stable composition'))
+    else:
+        x1_min = '\u03C7\u2081 min = --'
+        x1_max = '\u03C7\u2081 max = --'
+        
+    if DS:
+        x, y = adaptive_sample(lambda x1: DS_mix(T, x1)[1], 0.0001, 1)
+        y = y*0.001 # kJ/mol
+        data.append(go.Scatter(x=x, y=T*y, mode='lines', line=dict(color=color, dash='dash'), name=f'T\u0394S: \u03B2 {beta/1000:.1f} kJ/mol, {T} K', showlegend=True))
+    if DH:
+        x, y = adaptive_sample(lambda x1: DH_mix(beta, T, x1)[1], 0.0001, 1)
+        y = y*0.001 # kJ/mol
+        data.append(go.Scatter(x=x, y=y, mode='lines', line=dict(color=color, dash='dashdot'), name=f'\u0394H: \u03B2 {beta/1000:.1f} kJ/mol, {T} K', showlegend=True))
+    return data, (x1_min, x1_max)
+
+
 # this is the most important function
 @callback([Output(_id('plot'), 'figure'),
                Output({'type':_id('controls-card'), 'uid': ALL}, 'style'),
                Output({'type':_id('x1-min'), 'uid': ALL}, 'children'),
-               Output({'type':_id('x1-max'), 'uid': ALL}, 'children')],
+               Output({'type':_id('x1-max'), 'uid': ALL}, 'children'),
+               Output(_id('traces'), 'data')],
               [Input({'type':_id('beta-input'), 'uid': ALL}, 'value'),
                Input({'type':_id('t-input'), 'uid': ALL}, 'value'),
                Input({'type':_id('DG-switch'), 'uid': ALL}, 'on'),
                Input({'type':_id('DS-switch'), 'uid': ALL}, 'on'),
                Input({'type':_id('DH-switch'), 'uid': ALL}, 'on'),
                Input({'type':_id('minima-switch'), 'uid': ALL}, 'on')],
-               [State({'type':_id('controls-card'), 'uid': ALL}, 'style')]
+               [State({'type':_id('controls-card'), 'uid': ALL}, 'style'),
+                State({'type':_id('controls-card'), 'uid': ALL}, 'id'),
+                State(_id('traces'), 'data')]
              )
-def update_plot(beta_list, T_list, DG_list, DS_list, DH_list, minima_list, styles):
-    data = []
-    new_styles = []
-    x1_min_values = []
-    x1_max_values = []
-    for i, (beta, DG, DS, DH, minima, T, st) in enumerate(zip(beta_list, DG_list, DS_list, DH_list, minima_list, T_list, styles)):
+def update_plot(beta_list, T_list, DG_list, DS_list, DH_list, minima_list, styles, card_ids, traces):
+    curves = []
+    for i, (beta, DG, DS, DH, minima, T, card_id) in enumerate(zip(beta_list, DG_list, DS_list, DH_list, minima_list, T_list, card_ids)):
         if None in (beta, T): # values outside range
-            return go.Figure(), {}
+            raise PreventUpdate
         color = colors[i%len(colors)]
-        st['border-color'] = color
-        new_styles.append(st)
-        beta = beta*1000 # convert to J/mol
-        alpha = beta/(R*T)
-        if DG:
-            x, y = DG_mix(beta, T)
-            y = y*0.001 # kJ/mol
-            data.append(go.Scatter(x=x, y=y, mode='lines', line=dict(color=color), name=f'\u0394G: \u03B2 {beta/1000:.1f} kJ/mol, {T} K', showlegend=True)) 
-            if alpha>2:
-                idx = np.argsort(y)[:2]
-            else:
-                idx = [int(len(x)/2)]
-            x1_min_values.append(f'\u03C7\u2081 min = {x[idx][-1]:.3f}')
-            x1_max_values.append(f'\u03C7\u2081 max = {x[idx][0]:.3f}')
-            if minima: # show minima on plot
-                data.append(go.Scatter(x=x[idx], y=y[idx], mode='markers', marker_color='black', marker_symbol='circle-open', marker_size=10, name='stable composition'))
-        else:
-            x1_min_values.append('\u03C7\u2081 min = --')
-            x1_max_values.append('\u03C7\u2081 max = --')
-            
-        if DS:
-            x, y = DS_mix(T)
-            y = y*0.001 # kJ/mol
-            data.append(go.Scatter(x=x, y=T*y, mode='lines', line=dict(color=color, dash='dash'), name=f'T\u0394S: \u03B2 {beta/1000:.1f} kJ/mol, {T} K', showlegend=True))
-        if DH:
-            x, y = DH_mix(beta, T)
-            y = y*0.001 # kJ/mol
-            data.append(go.Scatter(x=x, y=y, mode='lines', line=dict(color=color, dash='dashdot'), name=f'\u0394H: \u03B2 {beta/1000:.1f} kJ/mol, {T} K', showlegend=True))
-        
+        params = (beta, T, DG, DS, DH, minima, color)
+        curves.append((card_id['uid'], params, lambda params=params: curve_traces(*params)))
     layout = {'xaxis': {'title': _('\u03C7\u2081'), 'range': (0,1)}, 'yaxis': {'title': _('Energy kJ/mol')}}
-    return go.Figure(data=data, layout=layout), new_styles, x1_min_values, x1_max_values
+    fig, infos, changed, traces = update_figure(_id('plot'), traces, (), curves, lambda infos: layout)
+    # update only the cards whose curve has changed
+    new_styles = [dict(st, **{'border-color': params[-1]}) if c else no_update
+                  for st, (uid, params, factory), c in zip(styles, curves, changed)]
+    x1_min_values = [x1_min if c else no_update for (x1_min, x1_max), c in zip(infos, changed)]
+    x1_max_values = [x1_max if c else no_update for (x1_min, x1_max), c in zip(infos, changed)]
+    return fig, new_styles, x1_min_values, x1_max_values, traces
 
 
 if __name__ == '__main__':
@@ -1,32 +1,37 @@
 import numpy as np
 
 R = 8.31 # universal gas constant J/ K mol
-def DG_mix(beta: float, T: float) -> (np.ndarray, np.ndarray):
+def DG_mix(beta: float, T: float, x1: np.ndarray = None) -> (np.ndarray, np.ndarray):
     '''
     compute molar Gibbs energy of mixing
+    (on a dense grid of molar fractions x1 of component 1, if x1 is None)
     '''
     # molar fraction of component 1
-    x1 = np.linspace(0.0001, 1, 10000)
+    if x1 is None:
+        x1 = np.linspace(0.0001, 1, 10000)
     x2 = 1.0001-x1
     DG = R*T*(x1*np.log(x1)+x2*np.log(x2))+beta*x1*x2
     return x1, DG
 
-def DS_mix(T: float) -> (np.ndarray, np.ndarray):
+def DS_mix(T: float, x1: np.ndarray = None) -> (np.ndarray, np.ndarray):
     '''
     compute molar entropy of mixing
+    (on a dense grid of molar fractions x1 of component 1, if x1 is None)
     '''
     # molar fraction of component 1
-    x1 = np.linspace(0.0001, 1, 10000)
+    if x1 is None:
+        x1 = np.linspace(0.0001, 1, 10000)
     x2 = 1.0001-x1
     DS = -R*(x1*np.log(x1)+x2*np.log(x2))
     return x1, DS
 
-def DH_mix(beta: float, T: float) -> (np.ndarray, np.ndarray):
+def DH_mix(beta: float, T: float, x1: np.ndarray = None) -> (np.ndarray, np.ndarray):
     '''
     compute molar hentalpy of mixing
+    (on a dense grid of molar fractions x1 of component 1, if x1 is None)
     '''
-    x1 = np.linspace(0.0001, 1, 10000)
+    if x1 is None:
+        x1 = np.linspace(0.0001, 1, 10000)
     x2 = 1.0001-x1
     DH = beta*x1*x2
     return x1, DH
-    
\ No newline at end of file
@@ -1,23 +1,23 @@
+import base64
 import dash
 import dash_bootstrap_components as dbc
 import dash_daq as daq
 import numpy as np
 import plotly.colors as pcolors
 import plotly.graph_objs as go
-import re
-from dash import callback, dcc, html
+from dash import callback, clientside_callback, dcc, html, no_update
 from dash.dependencies import Input, Output, State, MATCH, ALL
 from dash.exceptions import PreventUpdate
 from flask import Flask, request
 from flask_babel import Babel, gettext
 try: # when running as an independent app
-    from model import MB, v_p, v_avg, v_rms, molecules
+    from model import MB, MB_family, MB_probability, MB_sample, v_p, v_avg, v_rms, molecules
 except: # when running in a multipage dashboard
-    from .model import MB, v_p, v_avg, v_rms, molecules
+    from .model import MB, MB_family, MB_probability, MB_sample, v_p, v_avg, v_rms, molecules
 try: # when running as an independent app
-    from utilities import _id, common_setup
+    from utilities import _id, adaptive_sample, common_setup, update_container, update_figure
 except Exception as e: # when running in a multipage dashboard
-    from .utilities import _id, common_setup
+    from .utilities import _id, adaptive_sample, common_setup, update_container, update_figure
     
 # define translator function to use with flask_babel
 _ = gettext
@@ -57,6 +57,15 @@ v_dict = {'v_p': {'func': v_p, 'label': html.Span(['v', html.Sub('p')]), 'dash':
   'v_avg': {'func': v_avg, 'label': html.Span(['v', html.Sub('avg')]), 'dash': 'dot'},
   'v_rms': {'func': v_rms, 'label': html.Span(['v', html.Sub('rms')]), 'dash': 'dashdot'}}
 
+# number of molecules that can be sampled, with their labels
+superscripts = str.maketrans('0123456789', '\u2070\u00b9\u00b2\u00b3\u2074\u2075\u2076\u2077\u2078\u2079')
+sample_sizes = {10**k: '10' + str(k).translate(superscripts) for k in range(3, 9)}
+sample_bins = 100 # number of bins of the sampled speeds histogram
+
+# temperatures and speeds of the curves precomputed for the temperature sweep
+sweep_T = np.arange(200, 1000+10, 10) # same range and step as the temperature sliders
+sweep_v = np.linspace(0, 6000, 300)
+
 # labels for each molecule to use in the dashboard
 # label: for the dropdown widget, label2: for the plot legend
 for mol in molecules:
@@ -113,6 +122,16 @@ def controls_card_factory(uid=None):
                                                   6000: '6000 m/s'},
                                            value=[0, 6000], disabled=True)
                             ],)
+    # Monte Carlo sampling of the velocities, shown as histograms
+    sample_controls = dbc.Container(dbc.Row([
+        dbc.Col(daq.BooleanSwitch(id={'type':_id('sample-switch'), 'uid':uid},
+                                  on=False,
+                                  label=_('Sampling'),
+                                  labelPosition='left')),
+        dbc.Col(dcc.Dropdown(id={'type':_id('sample-size'), 'uid':uid},
+                             options=[{'label': label, 'value': N} for N, label in sample_sizes.items()],
+                             value=10**5, clearable=False))
+        ]))
     clear_button = dbc.Button(_('Delete'), id={'type':_id('clear-button'), 'uid':uid})    
     
     # assemble the card
@@ -123,7 +142,8 @@ def controls_card_factory(uid=None):
                  dbc.Col(speed_checklist)
         ]),
         temperature_slider,
-        area_slider
+        area_slider,
+        sample_controls
     ], body=True, id={'type':_id('controls_card'), 'uid':uid}, style={'margin-bottom':5})
     return controls_card
 
@@ -134,14 +154,29 @@ def layout():
     add_button = dbc.Button(_('Add plot'), id=_id('add-button'), style={'margin-bottom':5})
     #left panel containing all the plots and the button
     left_panel = dbc.Container([add_button, curves_container], id=_id('left-panel'))
+    # temperature sweep of all the curves
+    sweep_controls = dbc.Row([
+        dbc.Col(daq.BooleanSwitch(id=_id('sweep-switch'), on=False, label=_('sweep T'), labelPosition='left'), width='auto'),
+        dbc.Col(dbc.Button('\u25b6', id=_id('sweep-play'), disabled=True), width='auto'),
+        dbc.Col(dcc.Slider(id=_id('sweep-slider'), min=int(sweep_T[0]), max=int(sweep_T[-1]), step=int(sweep_T[1]-sweep_T[0]),
+                           marks={int(T): f'{T} K' for T in sweep_T[::20]}, value=300, disabled=True))
+        ], align='center')
 
     # specific layout of the app with all the widgets
     layout = dbc.Container([
         header(),
         html.Hr(),
         dbc.Row([dbc.Col(left_panel, xl=3),
-            dbc.Col(dcc.Graph(id=_id("MB-plot"), style={'height':'80vh'}), xl=7),],
+            dbc.Col([dcc.Graph(id=_id("MB-plot"), style={'height':'80vh'}),
+                     # same curves for all the temperatures, animated in the browser
+                     dcc.Graph(id=_id("sweep-plot"), style={'height':'80vh', 'display':'none'}),
+                     sweep_controls], xl=7),],
                  align="center",),
+        dcc.Store(id=_id('sweep-data')), # precomputed curves of the temperature sweep
+        dcc.Interval(id=_id('sweep-interval'), interval=100, disabled=True),
+        dcc.Store(id=_id('MB-traces')), # number of traces of each curve in the plot
+        # molar masses and legend labels, used to draw curves in the browser
+        dcc.Store(id=_id('molecules'), data={m: {'M': molecules[m]['M'], 'label2': molecules[m]['label2']} for m in molecules}),
     ],
     fluid=True,
     id=_id('layout')
@@ -160,27 +195,11 @@ def setup_language_specific(*messages):
 @callback(Output(_id('curves-container'), 'children'),
               [Input(_id('add-button'), 'n_clicks'),
               Input({'type':_id('clear-button'), 'uid': ALL}, 'n_clicks')],
-              State(_id('curves-container'), 'children'),
+              State({'type':_id('controls_card'), 'uid': ALL}, 'id'),
         )
-def update_curves_container(add_n_clicks, clear_n_clicks, curves_container_list):
+def update_curves_container(add_n_clicks, clear_n_clicks, card_ids):
     '''update curves-container adding or removing controls as required'''
-    ctx = dash.callback_context # this is needed to know which button has been pushed
-    trigger = ctx.triggered[0]
-    if _id('add-button') in trigger['prop_id']: # add a new controls_card
-        uid = add_n_clicks # generate a unique id for each curve
-        new_controls_card = controls_card_factory(uid=uid)
-        return curves_container_list+[new_controls_card]
-    else: # some delete button has been pushed
-        # find witch uid
-        match = re.search(r'"uid":(\d+)',trigger['prop_id'])
-        if match:
-            uid = int(match.group(1)) # uid of the curve
-            #regenerate the list of curves, removing uid
-            new_list = [curve for curve in curves_container_list
-                        if curve['props']['id']['uid'] != uid]
-            return new_list
-        else:
-            raise PreventUpdate # needed when app starts for the first time
+    return update_container(_id('add-button'), add_n_clicks, card_ids, controls_card_factory)
         
 @callback(Output({'type':_id('temperature-output'), 'uid': MATCH}, 'children'),
               Input({'type':_id('temperature-slider'), 'uid': MATCH}, 'value'))
@@ -193,89 +212,305 @@ def display_temperature_value(value):
 def activate_area_slider(on):
     return not on
 
+def curve_traces(mol, T, a_s, v_r, v_s, sample, N, color):
+    '''
+    compute the traces of the curve of a controls card
+    
+    Returns
+    -------
+    traces : list
+        plotly traces of the curve
+    info : tuple
+        probability label and characteristic speeds options to show on the card
+    '''
+    data = []
+    # find the molecular mass for the chosen molecule in the dictionary
+    M = molecules[mol]['M']
+    # compute the probability density, sampled only where the curve bends
+    v, fv = adaptive_sample(lambda v: MB(v, M, T), 0, 6000)
+    show=True
+    label = _('Probability ---')
+    mol_label = molecules[mol]['label2'] + f' - {T} K'
+    if a_s and v_r: # plot area requested
+        # probability density in the speed range v2, on the same scale as the whole curve
+        v2, fv2 = adaptive_sample(lambda v: MB(v, M, T), v_r[0], v_r[1], y_range=(0, fv.max()))
+        #append the plot to data, filling the area below the curve
+        data.append(go.Scatter(x=v2, y=fv2, mode='lines', fill='tozeroy', name=mol_label, line={'color':color}, showlegend=True,
+                               meta={'role': 'area'}))
+        show=False
+        # compute the probability, from the cumulative distribution
+        prob = MB_probability(v_r[0], v_r[1], M, T)
+        # update the probability value in the controls card
+        label = _('Probability') + f'[{v_r[0]}-{v_r[1]}] m/s = {prob:.3f}'
+    if sample: # histograms of N sampled velocities
+        v_edges, fv_N, u_edges, fu_N = MB_sample(M, T, N, bins=sample_bins, v_max=v[-1])
+        dv = v_edges[1] - v_edges[0]
+        data.append(go.Bar(x=v_edges[:-1]+dv/2, y=fv_N, width=dv, marker={'color':color}, opacity=0.4, meta={'role': 'sample'},
+                           name=mol_label + f' - N = {sample_sizes.get(N, N)}', showlegend=True))
+        # components are symmetric: fold them on positive values and average them
+        half = len(fu_N[0])//2
+        fu_abs = (fu_N[:, half:] + fu_N[:, :half][:, ::-1]).mean(axis=0)
+        du = u_edges[1] - u_edges[0]
+        data.append(go.Scatter(x=u_edges[half:-1]+du/2, y=fu_abs, mode='lines', line={'color':color, 'dash':'dot', 'shape':'hvh'}, meta={'role': 'sample'},
+                               name=mol_label + ' - |v<sub>x</sub>|, |v<sub>y</sub>|, |v<sub>z</sub>|', showlegend=True))
+    # plot the distribution curve
+    data.append(go.Scatter(x=v, y=fv, mode='lines', name=mol_label, line={'color':color}, showlegend=show,
+                           meta={'role': 'density'}))
+    # update characteristic speeds values
+    options = []
+    for v_type in v_dict:
+        v_val = v_dict[v_type]['func'](M, T)
+        v_label = html.Span(list(v_dict[v_type]["label"].children)) # use list() to make a copy of the original list
+        v_label.children.append(f' = {v_val:.0f}') # append value
+        v_label.children.append(html.Span([' m s', html.Sup('-1')])) # append units
+        options.append({'label': v_label,
+                        'value': v_type
+                       })
+        if v_type in v_s: # plot speed value has been selected
+            dash = v_dict[v_type]['dash']
+            data.append(go.Scatter(x=[v_val, v_val], y=[0, MB(v_val, M, T)],
+                                   mode='lines', showlegend=False,
+                                   line={'dash':dash, 'color':color}, meta={'role': 'speed', 'speed': v_type}))
+    return data, (label, options)
+
+
+def plot_layout(infos):
+    '''layout of the plot'''
+    layout = {'xaxis': {'title': _('speed m/s')}, 'yaxis': {'title': _('probability density s/m')}, 'legend':{'orientation': 'h'},
+              'barmode': 'overlay'} # histograms of sampled speeds are on top of each other
+    layout.update(legend=dict(
+        orientation="h",
+        yanchor="bottom",
+        y=1.02,
+        xanchor="right",
+        x=1)
+        )
+    return layout
+
+
 # This is the most important callback doing nearly all the work
 @callback([Output(_id('MB-plot'), 'figure'),
                Output({'type':_id('controls_card'), 'uid': ALL}, 'style'),
                Output({'type':_id('area-switch'), 'uid': ALL}, 'label'),
-               Output({'type':_id('speed-checklist'), 'uid': ALL}, 'options')
+               Output({'type':_id('speed-checklist'), 'uid': ALL}, 'options'),
+               Output(_id('MB-traces'), 'data')
               ],
               [Input({'type':_id('molecule-dropdown'), 'uid': ALL}, 'value'),
                Input({'type':_id('temperature-slider'), 'uid': ALL}, 'value'),
                Input({'type':_id('area-switch'), 'uid': ALL}, 'on'),
                Input({'type':_id('area-slider'), 'uid': ALL}, 'value'),
-               Input({'type':_id('speed-checklist'), 'uid': ALL}, 'value')
+               Input({'type':_id('speed-checklist'), 'uid': ALL}, 'value'),
+               Input({'type':_id('sample-switch'), 'uid': ALL}, 'on'),
+               Input({'type':_id('sample-size'), 'uid': ALL}, 'value')
               ],
               State({'type':_id('controls_card'), 'uid': ALL}, 'style'),
-              State({'type':_id('speed-checklist'), 'uid': ALL}, 'options')
+              State({'type':_id('controls_card'), 'uid': ALL}, 'id'),
+              State(_id('MB-traces'), 'data')
 )
-def update_plot(mols, T_vals, a_switch, v_range, v_selected, style, options):
-    '''update plots and values on the relative panel everytime something changes'''
-    data = []
-    v = np.linspace(0, 6000, 1000)
-    new_style = []
-    new_label = []
-    new_options = [] 
-    for i, (mol, T, a_s, v_r, v_s, st, opt) in enumerate(zip(mols, T_vals, a_switch, v_range, v_selected, style, options)):
+def update_plot(mols, T_vals, a_switch, v_range, v_selected, sample_switch, sample_size, style, card_ids, traces):
+    '''
+    update plots and values on the relative panel everytime something changes;
+    only curves whose parameters have changed are computed and sent again
+    '''
+    curves = []
+    for i, (mol, T, a_s, v_r, v_s, s_s, N, card_id) in enumerate(zip(mols, T_vals, a_switch, v_range, v_selected, sample_switch, sample_size, card_ids)):
         if not mol:
-            break
-        # find the molecular mass for the chosen molecule in the dictionary
-        M = molecules[mol]['M']
-        # compute the probability density
-        fv = MB(v, M, T)
-        show=True
-        label = _('Probability ---')
+            continue
         # choose the correct color
         color = colors[i%len(colors)]
-        mol_label = molecules[mol]['label2'] + f' - {T} K'
-        if a_s and v_r: # plot area requested
-            idx = v.searchsorted(v_r)
-            v2 = v[idx[0]:idx[1]]
-            # compute probability density in the speed range v2
-            fv2 = MB(v[idx[0]:idx[1]], M, T)
-            #append the plot to data, filling the area below the curve
-            data.append(go.Scatter(x=v2, y=fv2, mode='lines', fill='tozeroy', name=mol_label, line={'color':color}, showlegend=True))
-            show=False
-            # compute the integral, e.g. the probability
-            prob = np.trapz(fv2, dx=v2[1]-v2[0])
-            # update the probability value in the controls card
-            label = _('Probability') + f'[{v_r[0]}-{v_r[1]}] m/s = {prob:.3f}'
-        # plot the distribution curve
-        data.append(go.Scatter(x=v, y=fv, mode='lines', name=mol_label, line={'color':color}, showlegend=show))
-        # update border color for the specific controls card 
-        st['border-color'] = color
-        new_style.append(st)
-        # update characteristic speeds values
-        opt2 = []
-        for o in opt:
-            v_type = o['value']
-            v_val = v_dict[v_type]['func'](M, T)
-            v_label = html.Span(list(v_dict[v_type]["label"].children)) # use list() to make a copy of the original list
-            v_unit = html.Span(['m', html.Sup('-1')]) # trick because you cannot put a \ sign into a f-string directly
-            #v_label.children = v_label.children[0:2] # take just the name
-            v_label.children.append(f' = {v_val:.0f}') # append value
-            v_label.children.append(html.Span([' m s', html.Sup('-1')])) # append units
-            opt2.append({'label': v_label,
-                         'value': v_type
-                        })
-            if v_type in v_s: # plot speed value has been selected
-                dash = v_dict[v_type]['dash']
-                data.append(go.Scatter(x=[v_val, v_val], y=[0, MB(v_val, M, T)],
-                                       mode='lines', showlegend=False,
-                                       line={'dash':dash, 'color':color}))
-        new_options.append(opt2)
-        # update probability         
-        new_label.append(label)
-    layout = {'xaxis': {'title': _('speed m/s')}, 'yaxis': {'title': _('probability density s/m')}, 'legend':{'orientation': 'h'}}
-    layout.update(legend=dict(
-        orientation="h",
-        yanchor="bottom",
-        y=1.02,
-        xanchor="right",
-        x=1)
-        )
-    
-    #print(go.Figure(data=data, layout=layout), new_style, new_label, new_options)
-    return go.Figure(data=data, layout=layout), new_style, new_label, new_options
+        params = (mol, T, a_s, v_r, v_s, s_s, N, color)
+        curves.append((card_id['uid'], params, lambda params=params: curve_traces(*params)))
+    fig, infos, changed, traces = update_figure(_id('MB-plot'), traces, (), curves, plot_layout)
+    # update only the cards whose curve has changed
+    new_style = [no_update]*len(card_ids)
+    new_label = [no_update]*len(card_ids)
+    new_options = [no_update]*len(card_ids)
+    uids = [card_id['uid'] for card_id in card_ids]
+    for (uid, params, factory), (label, options), c in zip(curves, infos, changed):
+        if c:
+            i = uids.index(uid)
+            # update border color for the specific controls card 
+            new_style[i] = dict(style[i], **{'border-color': params[-1]})
+            new_label[i] = label
+            new_options[i] = options
+    return fig, new_style, new_label, new_options, traces
+
+# while a temperature or range slider is dragged, curves of its card are drawn
+# in the browser (the role of each trace is in its meta property); when the slider
+# is released, update_plot redraws them on the server, as for any other change
+clientside_callback(
+    """
+    function(T_drag, range_drag, mols, T_vals, range_vals, figure, traces, molecules) {
+        const ctx = window.dash_clientside.callback_context;
+        if (!figure || !traces || !ctx.triggered.length) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const prop_id = ctx.triggered[0].prop_id;
+        const uid = JSON.parse(prop_id.slice(0, prop_id.lastIndexOf('.'))).uid;
+        const i = ctx.inputs_list[0].findIndex(x => x.id.uid === uid);
+        // position of the traces of the card in the figure
+        let start = 0;
+        let curve = null;
+        for (const [c_uid, key, n] of traces.curves) {
+            if (c_uid === uid) {
+                curve = [start, n];
+                break;
+            }
+            start += n;
+        }
+        if (i < 0 || !curve || !molecules[mols[i]]) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const T = T_drag[i] == null ? T_vals[i] : T_drag[i];
+        const range = range_drag[i] == null ? range_vals[i] : range_drag[i];
+        const R = 8.31; // J K^-1 mol^-1
+        const M = molecules[mols[i]].M/1000.; // kg mol^-1
+        const name = molecules[mols[i]].label2 + ' - ' + T + ' K';
+        const N = Math.sqrt(Math.pow(M/(2*Math.PI*R*T), 3)); // normalization factor
+        const MB = v => N*4*Math.PI*v*v*Math.exp(-M*v*v/(2*R*T));
+        const speeds = {v_p: Math.sqrt(2*R*T/M),
+                        v_avg: Math.sqrt(8*R*T/(Math.PI*M)),
+                        v_rms: Math.sqrt(3*R*T/M)};
+        // curves from the server are sampled for their own temperature:
+        // while dragging they are drawn on a uniform grid
+        const grid = Array.from({length: 1000}, (_, k) => 6000*k/999);
+        const data = figure.data.slice();
+        for (let j = curve[0]; j < curve[0] + curve[1]; j++) {
+            const trace = data[j];
+            const role = trace.meta && trace.meta.role;
+            if (role === 'density') {
+                data[j] = {...trace, name: name, x: grid, y: grid.map(MB)};
+            } else if (role === 'area') {
+                const x = [range[0], ...grid.filter(v => v > range[0] && v < range[1]), range[1]];
+                data[j] = {...trace, name: name, x: x, y: x.map(MB)};
+            } else if (role === 'speed') {
+                const v = speeds[trace.meta.speed];
+                data[j] = {...trace, x: [v, v], y: [0, MB(v)]};
+            } // sampled histograms are drawn again only by the server
+        }
+        return {...figure, data: data};
+    }
+    """,
+    Output(_id('MB-plot'), 'figure', allow_duplicate=True),
+    [Input({'type':_id('temperature-slider'), 'uid': ALL}, 'drag_value'),
+     Input({'type':_id('area-slider'), 'uid': ALL}, 'drag_value')],
+    [State({'type':_id('molecule-dropdown'), 'uid': ALL}, 'value'),
+     State({'type':_id('temperature-slider'), 'uid': ALL}, 'value'),
+     State({'type':_id('area-slider'), 'uid': ALL}, 'value'),
+     State(_id('MB-plot'), 'figure'),
+     State(_id('MB-traces'), 'data'),
+     State(_id('molecules'), 'data')],
+    prevent_initial_call=True
+)
+
+@callback([Output(_id('sweep-data'), 'data'),
+           Output(_id('MB-plot'), 'style'),
+           Output(_id('sweep-plot'), 'style'),
+           Output(_id('sweep-slider'), 'disabled'),
+           Output(_id('sweep-play'), 'disabled')],
+          [Input(_id('sweep-switch'), 'on'),
+           Input({'type':_id('molecule-dropdown'), 'uid': ALL}, 'value')],
+          [State(_id('MB-plot'), 'style'),
+           State(_id('sweep-plot'), 'style')],
+          prevent_initial_call=True
+)
+def update_sweep(on, mols, plot_style, sweep_style):
+    '''
+    compute the curves of all the selected molecules at all the temperatures
+    of the sweep, to be animated in the browser without calling the server
+    '''
+    if not on:
+        if plot_style.get('display') != 'none': # the sweep is already off
+            raise PreventUpdate
+        return None, dict(plot_style, display='block'), dict(sweep_style, display='none'), True, True
+    # colors as in update_plot, following the order of the cards
+    curves = [(mol, colors[i%len(colors)]) for i, mol in enumerate(mols) if mol]
+    fv = MB_family(sweep_v, [molecules[mol]['M'] for mol, color in curves], sweep_T)
+    layout = plot_layout(None)
+    # fixed axes, so that curves are compared among frames
+    layout['xaxis'].update(range=[sweep_v[0], sweep_v[-1]])
+    layout['yaxis'].update(range=[0, 1.05*float(fv.max()) if fv.size else 1])
+    data = {'T': sweep_T.tolist(),
+            'v': sweep_v.tolist(),
+            'curves': [{'name': molecules[mol]['label2'],
+                        'color': color,
+                        # little-endian float32 array (n temperatures x n speeds)
+                        'fv': base64.b64encode(f.astype('<f4').tobytes()).decode()} for (mol, color), f in zip(curves, fv)],
+            'layout': go.Layout(layout).to_plotly_json()}
+    return data, dict(plot_style, display='none'), dict(sweep_style, display='block'), False, False
+
+
+# draw the frame of the sweep at the temperature of the slider
+clientside_callback(
+    """
+    function(T, T_drag, data) {
+        if (!data) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        if (T_drag != null) {
+            T = T_drag;
+        }
+        // decode each family of curves only once
+        const cache = window.dash_clientside._MB_sweep || {};
+        if (cache.data !== data) {
+            cache.data = data;
+            cache.fv = data.curves.map(c => {
+                const bytes = Uint8Array.from(atob(c.fv), ch => ch.charCodeAt(0));
+                return new Float32Array(bytes.buffer);
+            });
+            window.dash_clientside._MB_sweep = cache;
+        }
+        const n_T = data.T.length;
+        const n_v = data.v.length;
+        const step = data.T[1] - data.T[0];
+        const k = Math.min(n_T - 1, Math.max(0, Math.round((T - data.T[0])/step)));
+        const traces = data.curves.map((c, i) => ({
+            type: 'scatter', mode: 'lines', x: data.v,
+            y: Array.from(cache.fv[i].subarray(k*n_v, (k+1)*n_v)),
+            name: c.name + ' - ' + data.T[k] + ' K', line: {color: c.color}
+        }));
+        return {data: traces, layout: data.layout};
+    }
+    """,
+    Output(_id('sweep-plot'), 'figure'),
+    [Input(_id('sweep-slider'), 'value'),
+     Input(_id('sweep-slider'), 'drag_value'),
+     Input(_id('sweep-data'), 'data')]
+)
+
+# play and pause the sweep, which is stopped when switched off
+clientside_callback(
+    """
+    function(n_clicks, on, disabled) {
+        const ctx = window.dash_clientside.callback_context;
+        const switched = ctx.triggered.some(t => t.prop_id.endsWith('.on'));
+        const stop = switched || !disabled;
+        return [stop, stop ? '\u25b6' : '\u23f8'];
+    }
+    """,
+    [Output(_id('sweep-interval'), 'disabled'),
+     Output(_id('sweep-play'), 'children')],
+    [Input(_id('sweep-play'), 'n_clicks'),
+     Input(_id('sweep-switch'), 'on')],
+    State(_id('sweep-interval'), 'disabled'),
+    prevent_initial_call=True
+)
+
+# move the slider to the next temperature, restarting from the lowest one
+clientside_callback(
+    """
+    function(n_intervals, T, T_min, T_max, step) {
+        return T + step > T_max ? T_min : T + step;
+    }
+    """,
+    Output(_id('sweep-slider'), 'value'),
+    Input(_id('sweep-interval'), 'n_intervals'),
+    [State(_id('sweep-slider'), 'value'),
+     State(_id('sweep-slider'), 'min'),
+     State(_id('sweep-slider'), 'max'),
+     State(_id('sweep-slider'), 'step')],
+    prevent_initial_call=True
+)
 
 if __name__ == '__main__': # use as a standalone dash app
     ####################
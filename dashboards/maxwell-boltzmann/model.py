@@ -1,6 +1,18 @@
+import math
 import numpy as np
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from numpy.random import default_rng, SeedSequence
 
 
+# sampled velocities are processed in chunks of chunk_size molecules,
+# so that memory does not depend on the number of molecules
+chunk_size = 2**20
+# use a pool of processes only above this number of molecules
+parallel_threshold = 10**7
 
 # dictionary with molecules information molecular masses in g mol^-1
 molecules = {
@@ -101,3 +113,598 @@ def v_rms(M: float, T: float):
     R = 8.31 # J K^-1 mol^-1
     M = M/1000. # kg mol^-1
     return np.sqrt(3*R*T/M)
+
+def MB_family(v, M, T):
+    '''
+    compute Maxwell Boltzmann distributions for several molecules and
+    temperatures in a single broadcast evaluation
+
+    Parameters
+    ----------
+    v : numpy.ndarray
+        speed range
+    M : numpy.ndarray
+        molecular molar masses in g mol-1
+    T : numpy.ndarray
+        temperatures in K
+
+    Returns
+    ------
+    fv : numpy.ndarray
+        probabilty density as float32 (n molecules x n temperatures x n speeds)
+    '''
+    M = np.asarray(M, dtype=float).reshape(-1, 1, 1)
+    T = np.asarray(T, dtype=float).reshape(1, -1, 1)
+    return MB(np.asarray(v, dtype=float).reshape(1, 1, -1), M, T).astype(np.float32)
+
+
+##########################################
+# cumulative distribution and quantiles #
+##########################################
+
+# error function working on arrays
+# we could use scipy.special.erf, but there is no need to have such big dependency
+_erf = np.frompyfunc(math.erf, 1, 1)
+
+def _cdf(a):
+    '''cumulative distribution as a function of the reduced speed a = v/v_p'''
+    a = np.asarray(a, dtype=float)
+    F = np.asarray(_erf(a), dtype=float) - 2/np.sqrt(np.pi)*a*np.exp(-a*a)
+    # use the series expansion for small a, where the difference loses precision
+    a2 = a*a
+    series = 4/np.sqrt(np.pi)*a*a2*(1/3 - a2*(1/5 - a2*(1/14 - a2/54)))
+    return np.where(a < 0.05, series, F)
+
+def MB_cdf(v, M, T):
+    '''
+    compute the cumulative Maxwell Boltzmann distribution, i.e. the probability
+    of a speed lower than v. Arguments can be arrays (e.g. of molecules,
+    temperatures or speeds) with shapes that broadcast together
+    
+    Parameters
+    ----------
+    v : float or numpy.ndarray
+        speed in m s-1
+    M : float or numpy.ndarray
+        molecular molar mass in g mol-1
+    T : float or numpy.ndarray
+        temperature in K
+    
+    Returns
+    ------
+    F : float or numpy.ndarray
+        cumulative probability
+    '''
+    return _cdf(np.asarray(v)/v_p(np.asarray(M), np.asarray(T)))
+
+def MB_probability(v1, v2, M, T):
+    '''
+    compute the probability of a speed between v1 and v2 (exact, without integrating
+    the probability density on a grid). Arguments can be arrays with shapes that
+    broadcast together
+    
+    Parameters
+    ----------
+    v1, v2 : float or numpy.ndarray
+        lower and upper limits of the speed range in m s-1
+    M : float or numpy.ndarray
+        molecular molar mass in g mol-1
+    T : float or numpy.ndarray
+        temperature in K
+    
+    Returns
+    ------
+    P : float or numpy.ndarray
+        probability
+    '''
+    return MB_cdf(v2, M, T) - MB_cdf(v1, M, T)
+
+def MB_quantile(q, M, T, tol=1e-12, max_iter=50):
+    '''
+    compute the speed below which there is a fraction q of the molecules
+    (the inverse of MB_cdf), with Newton's method kept inside a bracket by bisection.
+    Arguments can be arrays with shapes that broadcast together
+    
+    Parameters
+    ----------
+    q : float or numpy.ndarray
+        cumulative probability (between 0 and 1)
+    M : float or numpy.ndarray
+        molecular molar mass in g mol-1
+    T : float or numpy.ndarray
+        temperature in K
+    tol : float
+        tolerance on the reduced speed v/v_p
+    max_iter : int
+        maximum number of iterations
+    
+    Returns
+    ------
+    v : float or numpy.ndarray
+        speed in m s-1
+    '''
+    q, vp = np.broadcast_arrays(np.asarray(q, dtype=float), v_p(np.asarray(M), np.asarray(T)))
+    lo = np.zeros(q.shape)
+    hi = np.full(q.shape, 10.) # 1 - F(10) is below the double precision
+    # initial guess from the asymptotic behaviour of the tails
+    with np.errstate(divide='ignore'):
+        a = np.where(q < 0.5, np.cbrt(0.75*np.sqrt(np.pi)*q),
+                     np.sqrt(np.maximum(-np.log((1 - q)*np.sqrt(np.pi)/2), 1)))
+    a = np.clip(a, lo, hi)
+    for i in range(max_iter):
+        F = _cdf(a) - q
+        # update the bracket
+        lo = np.where(F < 0, a, lo)
+        hi = np.where(F > 0, a, hi)
+        dF = 4/np.sqrt(np.pi)*a*a*np.exp(-a*a) # probability density of a
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new = a - F/dF
+        # bisection if the Newton step goes out of the bracket
+        new = np.where((new >= lo) & (new <= hi), new, (lo + hi)/2)
+        new = np.where(F == 0, a, new) # already exact
+        done = np.abs(new - a) < tol
+        a = new
+        if done.all():
+            break
+    v = a*vp
+    return v if v.ndim else float(v)
+
+
+############################
+# Monte Carlo sampling     #
+############################
+
+def _sample_shard(M, T, N, bins, v_max, seeds):
+    '''
+    draw N velocities in chunks, one for each seed, and bin speeds
+    and components (see MB_sample)
+    '''
+    R = 8.31 # J K^-1 mol^-1
+    sigma = np.sqrt(R*T/(M/1000.)) # standard deviation of each component
+    v_counts = np.zeros(bins, dtype=np.int64)
+    u_counts = np.zeros(3*bins, dtype=np.int64)
+    offset = (np.arange(3)*bins).reshape(3, 1) # bins of v_x, v_y and v_z follow each other
+    for start, seed in zip(range(0, N, chunk_size), seeds):
+        rng = default_rng(seed)
+        u = rng.standard_normal((3, min(chunk_size, N-start)), dtype=np.float32)
+        u *= np.float32(sigma)
+        v = np.sqrt((u*u).sum(axis=0))
+        # bin index of each value; values out of range are not counted
+        i = (v*np.float32(bins/v_max)).astype(np.int32)
+        v_counts += np.bincount(i[i < bins], minlength=bins)[:bins]
+        # floor, not truncation toward zero: values just below -v_max must not fall in bin 0
+        j = np.floor((u + np.float32(v_max))*np.float32(bins/(2*v_max))).astype(np.int32)
+        inside = (j >= 0) & (j < bins)
+        u_counts += np.bincount((j + offset)[inside], minlength=3*bins)
+    return v_counts, u_counts.reshape(3, bins)
+
+
+def MB_sample(M, T, N, bins=100, v_max=6000, processes=None, seed=None):
+    '''
+    sample the velocities of N molecules (each component from a normal distribution)
+    and compute the histograms of speeds and of velocity components.
+    Velocities are drawn in chunks of fixed size, so that memory does not depend on N,
+    and only histograms are kept. When N is large, chunks are split among a pool
+    of processes.
+    
+    Parameters
+    ----------
+    M : float
+        molecular molar mass in g mol-1
+    T : float
+        temperature in K
+    N : int
+        number of molecules
+    bins : int
+        number of bins of each histogram
+    v_max : float
+        largest speed in m s-1 (components are binned between -v_max and v_max)
+    processes : int
+        number of processes to use; if None, all the available cores are used
+        when N is larger than parallel_threshold
+    seed : int or numpy.random.SeedSequence
+        seed for the random number generators
+    
+    Returns
+    ------
+    v_edges : numpy.ndarray
+        edges of the speed bins
+    fv : numpy.ndarray
+        probability density of the speed in each bin (s m-1), comparable with MB
+    u_edges : numpy.ndarray
+        edges of the velocity components bins
+    fu : numpy.ndarray
+        probability density of v_x, v_y, v_z in each bin (one row for each component)
+    '''
+    if processes is None:
+        processes = (os.cpu_count() or 1) if N >= parallel_threshold else 1
+    # each chunk has an independent random number generator, so that
+    # results do not depend on the number of processes
+    n_chunks = -(-N//chunk_size)
+    seeds = SeedSequence(seed).spawn(n_chunks)
+    # split the molecules in whole chunks among the processes
+    processes = max(1, min(processes, n_chunks))
+    bounds = np.linspace(0, n_chunks, processes+1).astype(int)
+    args = [(M, T, min(b*chunk_size, N) - a*chunk_size, bins, v_max, seeds[a:b])
+            for a, b in zip(bounds[:-1], bounds[1:])]
+    if processes > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_sample_shard, *zip(*args)))
+    else:
+        results = [_sample_shard(*args[0])]
+    v_counts = sum(r[0] for r in results)
+    u_counts = sum(r[1] for r in results)
+    v_edges = np.linspace(0, v_max, bins+1)
+    u_edges = np.linspace(-v_max, v_max, bins+1)
+    fv = v_counts/(N*(v_edges[1] - v_edges[0]))
+    fu = u_counts/(N*(u_edges[1] - u_edges[0]))
+    return v_edges, fv, u_edges, fu
+
+
+
+#####################################
+# hard-sphere molecular dynamics    #
+#####################################
+
+def _neighbour_cells(n_cells, dim):
+    '''
+    table of the neighbouring cells to search for pairs, in a periodic box:
+    the cell itself (first row) and half of its neighbours, so that each
+    pair of cells is visited once
+
+    Returns
+    -------
+    neighbours : array
+        index of the neighbouring cell (n offsets x n_cells**dim)
+    '''
+    offsets = [(0,)*dim] + [o for o in product((-1, 0, 1), repeat=dim) if o > (0,)*dim]
+    shape = (n_cells,)*dim
+    coords = np.indices(shape).reshape(dim, -1)
+    return np.array([np.ravel_multi_index((coords + np.reshape(o, (dim, 1))) % n_cells, shape)
+                     for o in offsets], dtype=np.int32)
+
+
+def _collision_pairs(pos, cell, start, count, neighbours, box, lo, hi):
+    '''
+    find the pairs of overlapping spheres (of unit diameter) whose first
+    particle is in lo:hi; particles are sorted by cell (see HardSphereGas)
+
+    Parameters
+    ----------
+    pos : array
+        positions of the particles (n x dim), in a periodic box
+    cell : array
+        cell of each particle
+    start, count : array
+        index of the first particle and number of particles of each cell
+    neighbours : array
+        neighbouring cells of each cell (see _neighbour_cells)
+    box : float
+        side of the box
+    lo, hi : int
+        range of particles to search
+
+    Returns
+    -------
+    i, j : array
+        indices of the two particles of each pair
+    '''
+    ids = np.arange(lo, hi)
+    pairs_i, pairs_j = [], []
+    for row, table in enumerate(neighbours):
+        nc = table[cell[lo:hi]]
+        first = start[nc]
+        k = count[nc]
+        if not row: # same cell: only the particles that follow
+            first = ids + 1
+            k = k - (first - start[nc])
+        # all the candidates j of each particle i, in one flat array
+        total = k.sum()
+        if not total:
+            continue
+        i = np.repeat(ids, k)
+        j = np.repeat(first - (np.cumsum(k) - k), k) + np.arange(total)
+        d = pos[j] - pos[i]
+        d -= box*np.round(d/box) # minimum image
+        close = np.einsum('ij,ij->i', d, d) < 1
+        pairs_i.append(i[close])
+        pairs_j.append(j[close])
+    if not pairs_i:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+# table of neighbouring cells in each process of the pool, sent only once
+_neighbours = None
+
+def _init_pairs_worker(neighbours):
+    '''store the table of neighbouring cells in a process of the pool'''
+    global _neighbours
+    _neighbours = neighbours
+
+
+def _worker_pairs(pos, cell, start, count, box, lo, hi):
+    '''_collision_pairs in a process of the pool'''
+    return _collision_pairs(pos, cell, start, count, _neighbours, box, lo, hi)
+
+
+class HardSphereGas:
+    '''
+    Molecular dynamics of a gas of hard spheres in a periodic box (2D or 3D),
+    relaxing from a non-equilibrium distribution of velocities to the
+    Maxwell-Boltzmann distribution.
+
+    Each step moves all the particles, finds the overlapping pairs with a
+    cell list (cells are at least one diameter wide and particles are kept
+    sorted by cell, so that a step is O(n)), and makes the approaching pairs
+    collide elastically. A particle can collide only once in each pass:
+    conflicting pairs are resolved in the following passes, so that energy
+    is conserved exactly.
+
+    Lengths are in units of the diameter and velocities in units of
+    sqrt(R T/M), the standard deviation of each component at equilibrium;
+    speeds are given in m s-1. The order of the particles is not preserved.
+
+    Attributes
+    ----------
+    n : int
+        number of particles
+    dim : int
+        number of dimensions
+    box : float
+        side of the box
+    pos, vel : array
+        positions and velocities of the particles (n x dim)
+    nsteps : int
+        number of steps run so far
+    collisions : deque of int
+        number of collisions at each of the last `history` steps
+    timings : dict
+        time (s) spent in each phase: 'move', 'cells', 'pairs' and 'collide'
+        at each of the last `history` steps; 'histogram' has one value for
+        each of the last `history` histograms
+    total_collisions : int
+        number of collisions since the beginning
+    total_timings : dict
+        time (s) spent in each phase since the beginning
+    '''
+    history = 1000 # steps kept in collisions and timings, for long runs
+    def __init__(self, n=10000, M=32., T=300., dim=3, packing=0.05, dt=0.05, initial='shell',
+                 bins=100, v_max=6000, processes=1, seed=None):
+        '''
+        Parameters
+        ----------
+        n : int
+            number of particles
+        M : float
+            molecular molar mass in g mol-1
+        T : float
+            temperature in K (of the equilibrium the gas relaxes to)
+        dim : int
+            number of dimensions (2 or 3)
+        packing : float
+            fraction of the box occupied by the spheres
+        dt : float
+            time step, in units of diameter/sqrt(R T/M)
+        initial : str
+            initial velocities: 'shell' (same speed, random directions) or
+            'box' (components uniformly distributed), with the same energy
+            as the equilibrium distribution
+        bins : int
+            number of bins of the speed histograms
+        v_max : float
+            largest speed of the histograms in m s-1
+        processes : int
+            number of processes among which the cells are spread to search
+            for pairs (worth only for very large n)
+        seed : int or numpy.random.SeedSequence
+            seed for the random number generator
+        '''
+        if dim not in (2, 3):
+            raise ValueError('dim must be 2 or 3')
+        rng = default_rng(seed)
+        self.n = n
+        self.M = M
+        self.T = T
+        self.dim = dim
+        self.dt = dt
+        self.sigma = np.sqrt(8.31*T/(M/1000.)) # velocity unit (m s-1)
+        volume = np.pi/4 if dim == 2 else np.pi/6 # volume of one sphere
+        self.box = (n*volume/packing)**(1/dim)
+        self.n_cells = int(self.box) # cells of side at least 1
+        if self.n_cells < 3:
+            raise ValueError('the box must be at least 3 diameters wide: use more particles or a lower packing')
+        # particles on the sites of a lattice, so that they do not overlap
+        side = int(np.ceil(n**(1/dim)))
+        spacing = self.box/side
+        if spacing < 1:
+            raise ValueError('packing is too high to place the particles on a lattice')
+        sites = np.array(list(product(range(side), repeat=dim)))
+        self.pos = (sites[rng.choice(len(sites), n, replace=False)] + 0.5)*spacing
+        # random directions
+        u = rng.standard_normal((n, dim))
+        u /= np.linalg.norm(u, axis=1, keepdims=True)
+        if initial == 'shell':
+            self.vel = u*np.sqrt(dim)
+        elif initial == 'box':
+            self.vel = rng.uniform(-np.sqrt(3), np.sqrt(3), (n, dim))
+        else:
+            raise ValueError(f'unknown initial distribution {initial}')
+        self.vel -= self.vel.mean(axis=0) # the box does not move
+        self.vel *= np.sqrt(n*dim/(self.vel*self.vel).sum()) # exactly the energy at T
+        self.bins = bins
+        self.v_edges = np.linspace(0, v_max, bins+1)
+        self.nsteps = 0
+        self.collisions = deque(maxlen=self.history)
+        phases = ('move', 'cells', 'pairs', 'collide', 'histogram')
+        self.timings = {key: deque(maxlen=self.history) for key in phases}
+        self.total_collisions = 0
+        self.total_timings = dict.fromkeys(phases, 0.)
+        self._neighbours = _neighbour_cells(self.n_cells, dim)
+        self.processes = processes
+        self._pool = None
+        if processes > 1:
+            self._pool = ProcessPoolExecutor(processes, initializer=_init_pairs_worker, initargs=(self._neighbours,))
+        self._sort()
+
+    def close(self):
+        '''shut down the pool of processes, if any'''
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _sort(self):
+        '''compute the cell of each particle and sort particles by cell'''
+        coords = np.minimum((self.pos*(self.n_cells/self.box)).astype(int), self.n_cells-1)
+        cell = np.ravel_multi_index(coords.T, (self.n_cells,)*self.dim)
+        # particles move little at each step, so that they are nearly sorted
+        order = np.argsort(cell, kind='stable')
+        self.pos = self.pos[order]
+        self.vel = self.vel[order]
+        self._cell = cell[order]
+        self._count = np.bincount(cell, minlength=self.n_cells**self.dim)
+        self._start = np.cumsum(self._count) - self._count
+
+    def _pairs(self):
+        '''
+        overlapping pairs, searched in slabs of cells by the pool, if any;
+        pairs are sorted, so that the results do not depend on the pool
+        '''
+        args = (self.pos, self._cell, self._start, self._count, self.box)
+        if self._pool is None:
+            i, j = _collision_pairs(*args[:4], self._neighbours, self.box, 0, self.n)
+            order = np.lexsort((j, i))
+            return i[order], j[order]
+        # slabs of cells along the first axis, i.e. contiguous ranges of particles
+        slabs = np.linspace(0, self.n_cells, self.processes+1).astype(int)
+        bounds = self._start.reshape(self.n_cells, -1)[:, 0].tolist() + [self.n]
+        bounds = [bounds[s] for s in slabs]
+        results = list(self._pool.map(_worker_pairs, *zip(*[args + (lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])])))
+        i, j = np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+        order = np.lexsort((j, i))
+        return i[order], j[order]
+
+    def _collide(self, i, j, max_passes=20):
+        '''elastic collisions of the approaching pairs; returns their number'''
+        n_collisions = 0
+        for _ in range(max_passes):
+            d = self.pos[i] - self.pos[j]
+            d -= self.box*np.round(d/self.box)
+            b = np.einsum('ij,ij->i', d, self.vel[i] - self.vel[j])
+            approaching = b < 0
+            if not approaching.any():
+                break
+            i, j, d, b = i[approaching], j[approaching], d[approaching], b[approaching]
+            # keep only the first pair of each particle
+            k = np.arange(len(i))
+            first = np.full(self.n, len(i))
+            np.minimum.at(first, i, k)
+            np.minimum.at(first, j, k)
+            keep = (first[i] == k) & (first[j] == k)
+            # exchange the velocity components along the line of centers
+            impulse = (b[keep]/np.einsum('ij,ij->i', d[keep], d[keep]))[:, None]*d[keep]
+            self.vel[i[keep]] -= impulse
+            self.vel[j[keep]] += impulse
+            n_collisions += keep.sum()
+        return int(n_collisions)
+
+    def step(self):
+        '''
+        advance the simulation by one time step
+
+        Returns
+        -------
+        collisions : int
+            number of collisions in the step
+        '''
+        t0 = time.perf_counter()
+        self.pos += self.vel*self.dt
+        self.pos %= self.box
+        t1 = time.perf_counter()
+        self._sort()
+        t2 = time.perf_counter()
+        i, j = self._pairs()
+        t3 = time.perf_counter()
+        collisions = self._collide(i, j)
+        t4 = time.perf_counter()
+        for key, t in zip(('move', 'cells', 'pairs', 'collide'), (t1-t0, t2-t1, t3-t2, t4-t3)):
+            self.timings[key].append(t)
+            self.total_timings[key] += t
+        self.collisions.append(collisions)
+        self.total_collisions += collisions
+        self.nsteps += 1
+        return collisions
+
+    def stream(self, nsteps, every=10):
+        '''
+        advance the simulation by nsteps, yielding the speed histogram
+        every `every` steps
+
+        Yields
+        ------
+        step : int
+            number of steps run so far
+        fv : array
+            probability density of the speed in each bin (s m-1), comparable with MB
+        '''
+        for t in range(1, nsteps+1):
+            self.step()
+            if not t % every:
+                yield self.nsteps, self.hist
+
+    def run(self, nsteps, every=10):
+        '''
+        advance the simulation by nsteps (see stream)
+
+        Returns
+        -------
+        steps : array
+            step of each histogram
+        fv : array
+            speed histograms, one row every `every` steps
+        '''
+        frames = list(self.stream(nsteps, every))
+        if not frames:
+            return np.zeros(0, dtype=int), np.zeros((0, self.bins))
+        steps, fv = zip(*frames)
+        return np.array(steps), np.array(fv)
+
+    @property
+    def speeds(self):
+        '''speed of each particle (m s-1)'''
+        return np.sqrt((self.vel*self.vel).sum(axis=1))*self.sigma
+
+    @property
+    def hist(self):
+        '''probability density of the current speeds in each bin (s m-1)'''
+        t0 = time.perf_counter()
+        # bin index of each speed; speeds out of range are not counted
+        i = (self.speeds*(self.bins/self.v_edges[-1])).astype(int)
+        fv = np.bincount(i[i < self.bins], minlength=self.bins)/(self.n*(self.v_edges[1] - self.v_edges[0]))
+        t = time.perf_counter() - t0
+        self.timings['histogram'].append(t)
+        self.total_timings['histogram'] += t
+        return fv
+
+    @property
+    def temperature(self):
+        '''kinetic temperature of the gas (K), constant during the simulation'''
+        return (self.vel*self.vel).sum()/(self.n*self.dim)*self.T
+
+    def equilibrium(self, v=None):
+        '''
+        equilibrium speed distribution (MB in 3D, its 2D analogue in 2D)
+        at the centers of the bins, or at speeds v (m s-1)
+        '''
+        if v is None:
+            v = (self.v_edges[:-1] + self.v_edges[1:])/2
+        if self.dim == 3:
+            return MB(v, self.M, self.T)
+        s2 = self.sigma**2
+        return v/s2*np.exp(-v*v/(2*s2))
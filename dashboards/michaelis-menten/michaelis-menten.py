@@ -4,8 +4,7 @@ import dash_bootstrap_components as dbc
 import dash_daq as daq
 import plotly.colors as pcolors
 import plotly.graph_objs as go
-import re
-from dash import callback, dcc, html
+from dash import callback, dcc, html, no_update
 from dash.dependencies import Input, Output, State, MATCH, ALL
 from dash.exceptions import PreventUpdate
 from flask import Flask, request
@@ -15,9 +14,9 @@ try: # when running as an independent app
 except: # when running in a multipage dashboard
     from .model import michaelis_menten
 try: # when running as an independent app
-    from utilities import _id, common_setup
+    from utilities import _id, adaptive_sample, common_setup, update_container, update_figure
 except Exception as e: # when running in a multipage dashboard
-    from .utilities import _id, common_setup
+    from .utilities import _id, adaptive_sample, common_setup, update_container, update_figure
     
 
 # define translator function
@@ -162,9 +161,12 @@ S_slider = dbc.Container([dbc.Label("[S] max = 0.5 mol/L", id=_id('S-output')),
 controls_container = dbc.Container([], id=_id('controls-container'), fluid=True)
 plot_MM = dcc.Graph(id=_id('plot-MM'), style={'height': '60vh'}) # Michaelis-Menten
 plot_LB = dcc.Graph(id=_id('plot-LB'), style={'height': '60vh'}) # Lineweaver-Burk
+# number of traces of each curve in the plots
+traces_MM = dcc.Store(id=_id('traces-MM'))
+traces_LB = dcc.Store(id=_id('traces-LB'))
 
 left = dbc.Container([add_button, S_slider, html.Hr(), controls_container])
-right = dbc.Row([dbc.Col(plot_MM), dbc.Col(plot_LB)])
+right = dbc.Row([dbc.Col(plot_MM), dbc.Col(plot_LB), traces_MM, traces_LB])
 
 
 def layout():
@@ -189,33 +191,51 @@ def layout():
 @callback(Output(_id('controls-container'), 'children'),
               [Input(_id('add-button'), 'n_clicks'),
                Input({'type':_id('clear-button'), 'uid': ALL}, 'n_clicks')],
-              State(_id('controls-container'), 'children')
+              State({'type':_id('controls-card'), 'uid': ALL}, 'id')
              )
-def update_controls_container(add_n_clicks, clear_n_clicks, controls_container_list):
+def update_controls_container(add_n_clicks, clear_n_clicks, card_ids):
     '''update container adding or removing controls as required'''
-    ctx = dash.callback_context # this is needed to know which button has been pushed
-    trigger = ctx.triggered[0]
-    if 'add-button' in trigger['prop_id']: # add a new panel
-        uid = add_n_clicks # unique id 
-        new_controls = controls_card_factory(uid=uid)
-        return controls_container_list+[new_controls]
-    else: # some delete button has been pushed
-        match = re.search(r'"uid":(\d+)',trigger['prop_id'])
-        if match:
-            uid = int(match.group(1)) # uid of the card
-            return [c for c in controls_container_list if c['props']['id']['uid'] != uid]
-        else:
-            raise PreventUpdate # needed when app starts         
+    return update_container(_id('add-button'), add_n_clicks, card_ids, controls_card_factory)
 
 @callback(Output({'type':_id('S-output'), 'uid': MATCH}, 'children'),
               Input({'type':_id('S-slider'), 'uid': MATCH}, 'value'))
 def update_S_slider(val):
     return f"[S] max = {val} mol/L"
             
+def curve_traces(KM, k2, E0, I, KI, I_type, Smax, color):
+    '''
+    compute the traces of the curves of a controls card
+    
+    Returns
+    -------
+    traces : list
+        plotly traces of the Michaelis-Menten plot
+    info : tuple
+        plotly traces of the Lineweaver-Burk plot, maximum of 1/v0 and value of 1/v0
+        at [S] = Smax/999*10 (used to set the range of the Lineweaver-Burk plot)
+    '''
+    # start from 1e-8 to avoid runtime error divide by zero
+    S, v0 = adaptive_sample(lambda S: michaelis_menten(S, KM, k2, E0, I, KI, I_type)[0], 1e-8, Smax)
+    v0_10, KM_eff, k2_eff = michaelis_menten(np.array([Smax/999*10]), KM, k2, E0, I, KI, I_type)
+    data_MM = [go.Scatter(x=S, y=v0, mode='lines', line={'color': color}, showlegend=False)]
+    # compute extrapolation line for LB plots
+    S_ex = [-1/KM_eff, 0] # this is actually 1/S
+    v0_ex = [0, 1/(k2_eff*E0)] # this is actually 1/v0
+    # the Lineweaver-Burk plot is a straight line in 1/[S]: its ends are enough,
+    # from [S] = Smax to the first point of a uniform grid of 1000 points
+    S_LB = np.array([Smax/999, Smax])
+    v0_LB = michaelis_menten(S_LB, KM, k2, E0, I, KI, I_type)[0]
+    data_LB = [go.Scatter(x=1/S_LB, y=1/v0_LB, mode='lines', line={'color': color}, showlegend=False),
+               go.Scatter(x=S_ex, y=v0_ex, mode='lines', line={'color': color, 'dash': 'dash'}, showlegend=False)]
+    return data_MM, (data_LB, (1/v0).max(), 1/v0_10[0])
+
+
 # this is the most important function
 @callback([Output(_id('plot-MM'), 'figure'),
                Output(_id('plot-LB'), 'figure'),
-               Output({'type':_id('controls-card'), 'uid': ALL}, 'style')
+               Output({'type':_id('controls-card'), 'uid': ALL}, 'style'),
+               Output(_id('traces-MM'), 'data'),
+               Output(_id('traces-LB'), 'data')
               ],
               [Input(_id('S-slider'), 'value'),
                Input({'type':_id('KM-input'), 'uid': ALL}, 'value'),
@@ -225,42 +245,40 @@ def update_S_slider(val):
                Input({'type':_id('KI-input'), 'uid': ALL}, 'value'),
                Input({'type':_id('I-type-dropdown'), 'uid': ALL}, 'value')
               ],
-              [State({'type':_id('controls-card'), 'uid': ALL}, 'style')]
+              [State({'type':_id('controls-card'), 'uid': ALL}, 'style'),
+               State({'type':_id('controls-card'), 'uid': ALL}, 'id'),
+               State(_id('traces-MM'), 'data'),
+               State(_id('traces-LB'), 'data')]
              )
-def update_plots(Smax, KM_vals, k2_vals, E0_vals, I_vals, KI_vals, I_type_vals, styles):
-    data_MM = []
-    data_LB = []
-    new_styles = []
-    S = np.linspace(Smax*0, Smax, 1000)
-    S[0] = S[0]+1e-8 # to avoid runtime error divide by zero
+def update_plots(Smax, KM_vals, k2_vals, E0_vals, I_vals, KI_vals, I_type_vals, styles, card_ids, traces_MM, traces_LB):
     if not KM_vals:
         raise PreventUpdate
-    v0_inv_max = np.zeros(1)
-    for i, (KM, k2, E0, I, KI, I_type, st) in enumerate(zip(KM_vals, k2_vals, E0_vals, I_vals, KI_vals, I_type_vals, styles)):
+    curves = []
+    for i, (KM, k2, E0, I, KI, I_type, st, card_id) in enumerate(zip(KM_vals, k2_vals, E0_vals, I_vals, KI_vals, I_type_vals, styles, card_ids)):
         if None in (KM, k2, E0, I, KI, I_type, st):
             raise PreventUpdate
         color = colors[i%len(colors)]
-        st['border-color'] = color
-        new_styles.append(st)
-        v0, KM_eff, k2_eff = michaelis_menten(S, KM, k2, E0, I, KI, I_type)
-        data_MM.append(go.Scatter(x=S, y=v0, mode='lines', line={'color': color}, showlegend=False))
-        # compute extrapolation line for LB plots
-        S_ex = [-1/KM_eff, 0] # this is actually 1/S
-        v0_ex = [0, 1/(k2_eff*E0)] # this is actually 1/v0
-        # avoid S == 0 first value
-        data_LB.append(go.Scatter(x=1/S[1:], y=1/v0[1:], mode='lines', line={'color': color}, showlegend=False))
-        data_LB.append(go.Scatter(x=S_ex, y=v0_ex, mode='lines', line={'color': color, 'dash': 'dash'}, showlegend=False))
-        if (1/v0).max()>v0_inv_max.max():
-            v0_inv_max = 1/v0
+        params = (KM, k2, E0, I, KI, I_type, Smax, color)
+        curves.append((card_id['uid'], params, lambda params=params: curve_traces(*params)))
+    S_10 = Smax/999*10 # 10th value of [S] on a uniform grid of 1000 points
     layout_MM = {'xaxis': {'title': '[S]', 'range': (0, Smax)},
                  'yaxis': {'title': 'v\u2080', 'rangemode':'nonnegative'}}
-    layout_LB = {'xaxis': {'title': '1/[S]', 'range': (-1/S[10], 1/S[10])},
-                 'yaxis': {'title': '1/v\u2080', 'range':(0, v0_inv_max[10])}}
-    plot_MM  = go.Figure(data=data_MM, layout=layout_MM)
-    plot_LB = go.Figure(data=data_LB, layout=layout_LB)
-    plot_LB.add_hline(y=0)
-    plot_LB.add_vline(x=0)
-    return plot_MM, plot_LB, new_styles
+    plot_MM, infos, changed, traces_MM = update_figure(_id('plot-MM'), traces_MM, Smax, curves, lambda infos: layout_MM)
+    # Lineweaver-Burk traces have been computed together with the Michaelis-Menten ones
+    curves_LB = [(uid, params, lambda info=info: (info[0], None)) for (uid, params, factory), info in zip(curves, infos)]
+    def layout_LB(infos_LB):
+        # range of the curve with the highest 1/v0
+        v0_inv_max = max(infos, key=lambda info: info[1])[2]
+        return {'xaxis': {'title': '1/[S]', 'range': (-1/S_10, 1/S_10)},
+                'yaxis': {'title': '1/v\u2080', 'range':(0, v0_inv_max)},
+                # horizontal and vertical axes
+                'shapes': [{'type': 'line', 'x0': 0, 'x1': 1, 'xref': 'x domain', 'y0': 0, 'y1': 0, 'yref': 'y'},
+                           {'type': 'line', 'x0': 0, 'x1': 0, 'xref': 'x', 'y0': 0, 'y1': 1, 'yref': 'y domain'}]}
+    plot_LB, infos_LB, changed_LB, traces_LB = update_figure(_id('plot-LB'), traces_LB, Smax, curves_LB, layout_LB)
+    # update only the cards whose curve has changed
+    new_styles = [dict(st, **{'border-color': params[-1]}) if c else no_update
+                  for st, (uid, params, factory), c in zip(styles, curves, changed)]
+    return plot_MM, plot_LB, new_styles, traces_MM, traces_LB
 
 @callback([Output(_id('add-button'), 'children')],
           [Input(_id('add-button'), 'children')])
@@ -1,6 +1,15 @@
+import copy
 import numpy as np
 import pint
 import warnings
+try: # scipy is not needed, but its tridiagonal solver is much faster than the fallback
+    from scipy.linalg import eigh_tridiagonal
+except ImportError:
+    eigh_tridiagonal = None
+try: # when running as an independent app
+    from utilities import LRUCache
+except: # when running in a multipage dashboard
+    from .utilities import LRUCache
 
 # define needed physical constants
 # we could use scipy for this, but there is no need to have such big dependency
@@ -9,6 +18,7 @@ import warnings
 h = 6.62607015e-34 # the Planck constant
 c = 299792458.0 # speed of light in vacuum
 u = 1.6605390666e-27 # atomic mass constant (in kg)
+k_B = 1.380649e-23 # the Boltzmann constant (in J/K)
 
 
 # initialize units registry
@@ -22,6 +32,13 @@ with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     Q_([]) 
 
+# units are checked only at the boundary of the model: parameters are
+# converted once to SI magnitudes, computations are done on plain arrays
+# and only the results are tagged with units.
+# Set to True to do all the computations with pint quantities instead
+# (much slower, useful to validate the model)
+CHECK_UNITS = False
+
 # Dictionary with scpectroscopic data for various diatomic molecules from
 # Handbook of Chemistry and Physics 87th editions
 # SPECTROSCOPIC CONSTANTS OF DIATOMIC MOLECULES 9-82
@@ -44,6 +61,64 @@ molecules = {
              }
 
 
+def _boundary(x, unit):
+    '''
+    convert a parameter at the boundary of the model
+
+    Parameters
+    ----------
+    x : float, array or pint.Quantity
+        value of the parameter (in unit, if it has no units)
+    unit : str
+        default unit of the parameter
+
+    Returns
+    -------
+    x : float, array or pint.Quantity
+        magnitude of x in SI units, or x as a pint.Quantity if CHECK_UNITS is True
+    '''
+    if not isinstance(x, pint.Quantity):
+        x = Q_(x, unit)
+    if CHECK_UNITS:
+        return x
+    return x.to_base_units().magnitude
+
+
+def _output(x, unit):
+    '''tag a result with its SI unit, if it has been computed without units'''
+    if isinstance(x, pint.Quantity):
+        return x
+    return Q_(x, unit)
+
+
+def _constants():
+    '''Planck constant and speed of light, with units if they are checked'''
+    if CHECK_UNITS:
+        return ureg.planck_constant, ureg.speed_of_light
+    return h, c
+
+
+def _quantity(name, unit, default):
+    '''
+    attribute stored as a plain SI magnitude (in _name) and
+    returned as a pint.Quantity
+
+    Parameters
+    ----------
+    name : str
+        name of the attribute
+    unit : str
+        SI unit of the stored magnitude
+    default : str
+        unit of values without units assigned to the attribute
+    '''
+    def get(self):
+        return _output(getattr(self, '_'+name), unit)
+    def set(self, value):
+        setattr(self, '_'+name, _boundary(value, default))
+    return property(get, set, doc=f'{name} (pint.Quantity)')
+
+
 def oscillator(mol, oscillator_type, **kwargs):
     ''' oscillator factory '''
     if oscillator_type.lower() in ('morse', 'anharmonic', 'realistic'):
@@ -54,10 +129,272 @@ def oscillator(mol, oscillator_type, **kwargs):
         raise ValueError
 
 
+oscillator_cache_size = 64 # maximum number of oscillators kept in the cache
+_oscillator_cache = LRUCache(oscillator_cache_size)
+
+def cached_oscillator(mol, oscillator_type, r, nu_max=None, De=None):
+    '''
+    get an oscillator from a least recently used cache, building it only if
+    it is not there. If the same oscillator is cached on a different grid of
+    distances, its parameters are reused and only potential and levels are
+    computed again on the new grid.
+    Oscillators are shared: they must not be modified.
+
+    Parameters
+    ----------
+    mol : str
+        molecule (a key of molecules)
+    oscillator_type : str
+        type of oscillator (see oscillator)
+    r : array of float
+        distances, in angstrom
+    nu_max : int
+        maximum vibrational level to consider (default of the oscillator, if None)
+    De : float or pint.Quantity
+        well depth, in joule (only for the harmonic oscillator)
+
+    Returns
+    -------
+    osc : BaseOscillator
+        the oscillator
+    '''
+    r = np.asarray(r, dtype=float)
+    kwargs = {}
+    if nu_max is not None:
+        kwargs['nu_max'] = nu_max
+    if De is not None:
+        kwargs['De'] = De
+        De = _output(De, 'J').to('J').magnitude
+    params = (mol, oscillator_type.lower(), nu_max, De)
+    def build():
+        # the same oscillator on another grid, the most recently used first
+        same = _oscillator_cache.find(lambda key: key[:4] == params)
+        if same is None:
+            return oscillator(mol, oscillator_type, r=r, **kwargs)
+        osc = copy.copy(same)
+        osc.r = r
+        osc.compute()
+        _oscillator_cache.count('regrids')
+        return osc
+    return _oscillator_cache.get(params + (r.shape, r.tobytes()), build)
+
+
+def oscillator_cache_info():
+    '''
+    statistics of the cache of oscillators
+
+    Returns
+    -------
+    info : dict
+        number of hits, misses, misses served by reusing the parameters
+        on a new grid (regrids) and current size of the cache
+    '''
+    return dict({'regrids': 0}, **_oscillator_cache.info())
+
+
+#########################################
+# numerical eigenstates of a potential  #
+#########################################
+
+def _sturm_count(d, e2, x):
+    '''
+    number of eigenvalues lower than each x of the symmetric tridiagonal
+    matrix with diagonal d and squared off-diagonal e2 (Sturm sequence)
+    '''
+    q = np.empty((len(d),) + x.shape) # pivots of the LDL^T factorization of T - x
+    q[0] = d[0] - x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # a zero pivot gives an infinite next pivot, that counts once, as it should
+        for i in range(1, len(d)):
+            np.subtract(d[i] - e2[i-1]/q[i-1], x, out=q[i])
+    return (q < 0).sum(axis=0)
+
+
+def _tridiagonal_solve(d, e, shift, b):
+    '''
+    solve (T - shift) y = b for each column of b, with its own shift, where
+    T is symmetric tridiagonal with diagonal d and off-diagonal e; rows of b
+    are the grid points. Gaussian elimination with partial pivoting (as
+    LAPACK gttrf), that is stable for the nearly singular systems of inverse
+    iteration
+    '''
+    n = len(d)
+    tiny = np.finfo(float).eps*(np.abs(d).max() + np.abs(e).max())
+    diag = d[:, None] - shift # diagonal, then the pivots
+    du = np.tile(e[:, None], (1, len(shift))) # first superdiagonal
+    du2 = np.zeros((n, len(shift))) # second superdiagonal, filled by interchanges
+    y = b.copy()
+    for i in range(n-1):
+        swap = np.abs(diag[i]) < abs(e[i])
+        # pivot on the larger of the diagonal and the subdiagonal element
+        pivot = np.where(swap, e[i], diag[i])
+        fact = np.where(swap, diag[i], e[i])/pivot
+        next_diag = diag[i+1].copy()
+        next_du = du[i+1].copy() if i < n-2 else 0
+        diag[i] = pivot
+        diag[i+1] = np.where(swap, du[i] - fact*next_diag, next_diag - fact*du[i])
+        du[i] = np.where(swap, next_diag, du[i])
+        if i < n-2:
+            du2[i] = np.where(swap, next_du, 0)
+            du[i+1] = np.where(swap, -fact*next_du, next_du)
+        yi = np.where(swap, y[i+1], y[i])
+        y[i+1] = np.where(swap, y[i], y[i+1]) - fact*yi
+        y[i] = yi
+    diag[np.abs(diag) < tiny] = tiny
+    y[n-1] /= diag[n-1]
+    y[n-2] = (y[n-2] - du[n-2]*y[n-1])/diag[n-2]
+    for i in range(n-3, -1, -1):
+        y[i] = (y[i] - du[i]*y[i+1] - du2[i]*y[i+2])/diag[i]
+    return y
+
+
+def _tridiagonal_eigenpairs(d, e, index):
+    '''
+    eigenvalues and eigenvectors of the symmetric tridiagonal matrix with
+    diagonal d and off-diagonal e, selected by their index in ascending order.
+    Uses scipy, if available; otherwise eigenvalues are isolated by
+    multisection with Sturm counts and refined, with their eigenvectors, by
+    inverse and Rayleigh quotient iteration (both vectorized over the
+    eigenvalues, with python loops only along the matrix)
+
+    Parameters
+    ----------
+    index : array of int
+        indices of the eigenvalues (0 is the lowest), in ascending order
+
+    Returns
+    -------
+    w : array
+        eigenvalues, in ascending order
+    v : array
+        normalized eigenvectors, one column for each eigenvalue
+    '''
+    index = np.asarray(index)
+    if eigh_tridiagonal is not None:
+        w, v = eigh_tridiagonal(d, e, select='i', select_range=(index[0], index[-1]))
+        return w[index - index[0]], v[:, index - index[0]]
+    # the neighbours of each eigenvalue are isolated as well, to tell when
+    # its bracket is small compared with the distance from them
+    j = np.union1d(index, np.concatenate((index - 1, index + 1)))
+    j = j[(j >= 0) & (j < len(d))]
+    wanted = np.searchsorted(j, index)
+    k = len(j)
+    # Gershgorin bounds of the spectrum
+    radius = np.abs(np.concatenate(([0.], e))) + np.abs(np.concatenate((e, [0.])))
+    lo = np.full(k, (d - radius).min())
+    hi = np.full(k, (d + radius).max())
+    points = max(8, 1024//k) # points in the bracket of each eigenvalue
+    t = np.arange(1, points+1)/(points+1)
+    while True:
+        # the j-th eigenvalue is in [lo, hi]
+        x = lo[:, None] + (hi - lo)[:, None]*t
+        n_below = (_sturm_count(d, e*e, x) <= j[:, None]).sum(axis=1) # points below the j-th eigenvalue
+        rows = np.arange(k)
+        lo = np.where(n_below > 0, x[rows, np.maximum(n_below-1, 0)], lo)
+        hi = np.where(n_below < points, x[rows, np.minimum(n_below, points-1)], hi)
+        # stop when each bracket is much smaller than the distance from the
+        # other eigenvalues, so that inverse iteration picks the right one
+        mid = (lo + hi)/2
+        gap = np.minimum(np.diff(mid, prepend=-np.inf), np.diff(mid, append=np.inf))
+        if ((hi - lo) < 0.1*gap)[wanted].all():
+            break
+    lo, hi, mid = lo[wanted], hi[wanted], mid[wanted]
+    k = len(index)
+    # random starting vectors, not orthogonal to any eigenvector (symmetric
+    # potentials have antisymmetric eigenvectors)
+    v = np.random.default_rng(0).uniform(-1, 1, (len(d), k))
+    shift = mid
+    tol = 1e-12*(np.abs(d).max() + 2*np.abs(e).max())
+    for _ in range(10):
+        v = _tridiagonal_solve(d, e, shift, v)
+        v /= np.linalg.norm(v, axis=0)
+        Tv = d[:, None]*v
+        Tv[:-1] += e[:, None]*v[1:]
+        Tv[1:] += e[:, None]*v[:-1]
+        rq = (v*Tv).sum(axis=0)
+        residual = np.linalg.norm(Tv - rq*v, axis=0)
+        if (residual < tol).all():
+            return rq, v
+        # Rayleigh quotient shift, if it is inside the bracket (it is not
+        # while a starting vector is still far from the eigenvector)
+        shift = np.where((rq > lo) & (rq < hi), rq, mid)
+    warnings.warn(f'{(residual >= tol).sum()} eigenvectors did not converge '
+                  f'(largest residual {residual.max()/tol:.1e} times the tolerance)', RuntimeWarning)
+    return rq, v
+
+
+eigen_cache_size = 32 # maximum number of eigen-decompositions kept in the cache
+_eigen_cache = LRUCache(eigen_cache_size)
+
+def radial_eigenstates(r, V, mu, k, states=None):
+    '''
+    lowest (or selected) vibrational eigenstates of a potential, from the radial
+    Schroedinger equation discretized with finite differences on a uniform
+    grid (a tridiagonal matrix, with wavefunctions vanishing outside the grid).
+    Results are kept in a least recently used cache.
+
+    Parameters
+    ----------
+    r : array
+        uniform grid of distances, in m
+    V : array
+        potential on the grid, in J
+    mu : float
+        reduced mass, in kg
+    k : int
+        number of eigenstates
+    states : array of int, optional
+        quantum numbers of the eigenstates to compute, in ascending order,
+        instead of the lowest k (the others are not computed at all)
+
+    Returns
+    -------
+    E : array
+        energy of each eigenstate, in J
+    psi : array
+        wavefunctions normalized on the grid (one row for each eigenstate
+        and one column for each point of r), in m^-1/2
+    '''
+    r = np.asarray(r, dtype=float)
+    V = np.asarray(V, dtype=float)
+    if states is None:
+        states = range(min(int(k), len(r)))
+    states = np.asarray(states, dtype=int)
+    states = states[states < len(r)]
+    def compute():
+        dr = np.diff(r)
+        if not np.allclose(dr, dr[0]):
+            raise ValueError('the grid of distances must be uniform')
+        dr = dr[0]
+        hbar = h/(2*np.pi)
+        t = hbar**2/(2*mu*dr**2) # kinetic energy scale
+        # matrix in units of t, for a better conditioning
+        w, v = _tridiagonal_eigenpairs(2 + V/t, -np.ones(len(r)-1), states)
+        psi = v.T/np.sqrt(dr)
+        psi *= np.sign(psi[np.arange(len(states)), np.abs(psi).argmax(axis=1)])[:, None] # largest lobe is positive
+        return w*t, psi
+    return _eigen_cache.get((r.tobytes(), V.tobytes(), float(mu), states.tobytes()), compute)
+
+
 class BaseOscillator:
     '''
-    base class for oscillator potential computation
+    base class for oscillator potential computation.
+    Parameters are stored as magnitudes in SI units, converted once when
+    they are set, and the computations are done on plain arrays; they are
+    tagged with units only when they are read (see CHECK_UNITS)
     '''
+    we = _quantity('we', '1/m', '1/cm')
+    m1 = _quantity('m1', 'kg', 'u')
+    m2 = _quantity('m2', 'kg', 'u')
+    re = _quantity('re', 'm', 'angstrom')
+    r = _quantity('r', 'm', 'angstrom')
+    De = _quantity('De', 'J', 'J')
+    mu = _quantity('mu', 'kg', 'u')
+    V = _quantity('V', 'J', 'J')
+    levels = _quantity('levels', 'J', 'J')
+    # distances of the turning points of each level (n_levels x 2)
+    turning_points = _quantity('turning_points', 'm', 'angstrom')
+
     def __init__(self, r=np.array([])):
         self.r = r # distance
         self.V = self.compute()
@@ -68,31 +405,76 @@ class BaseOscillator:
     def _energy_levels(self):
         raise NotImplementedError
     
-    def _compute_levels(self, n_lines=30):
+    def _classical_turning_points(self, levels):
+        raise NotImplementedError
+
+    def _potential(self, r):
+        raise NotImplementedError
+
+    def potential(self, r):
+        '''
+        potential energy at any distances (not only on the grid r)
+
+        Parameters
+        ----------
+        r : array of float or pint.Quantity
+            distances, in angstrom
+
+        Returns
+        -------
+        V : pint.Quantity
+            potential energy
+        '''
+        return _output(self._potential(_boundary(r, 'angstrom')), 'J')
+
+    def _force(self, r):
+        raise NotImplementedError
+
+    def eigenstates(self, k=None, states=None):
+        '''
+        vibrational eigenstates computed numerically on the grid r
+        (see radial_eigenstates), to compare with the analytic levels
+
+        Parameters
+        ----------
+        k : int
+            number of eigenstates (nu_max, if None)
+        states : array of int, optional
+            quantum numbers of the eigenstates, in ascending order,
+            instead of the lowest k
+
+        Returns
+        -------
+        E : pint.Quantity
+            energy of each eigenstate
+        psi : pint.Quantity
+            normalized wavefunctions (one row for each eigenstate)
         '''
-        compute levels to plot in the graph
+        r = _output(self._r, 'm').to('m').magnitude
+        V = _output(self._V, 'J').to('J').magnitude
+        mu = _output(self._mu, 'kg').to('kg').magnitude
+        E, psi = radial_eigenstates(r, V, mu, k or self.nu_max, states)
+        return _output(E, 'J'), _output(psi, 'm**-0.5')
+
+    def _compute_levels(self):
+        '''
+        compute energy levels and their classical turning points,
+        i.e. the intercepts between each level and the potential curve,
+        clipped to the range of distances r
         '''
-        lines = []
-        r = self.r
-        re = self.re
-        V = self.V
         levels = self._energy_levels()
-        # each line has an y value corresponding to the energy of the level
-        # and x values that corresponds to the intercept between energy level
-        # and the potential curve
-        i_re = (np.abs(r-re)).argmin()
-        for l in levels:
-            idx1 = (np.abs(V[:i_re]-l)).argmin()
-            idx2 = (np.abs(V[i_re:]-l)).argmin() + i_re
-            lx = r[[idx1, idx2]]
-            ly = np.array([l.magnitude]*2) * l.units
-            lines.append((lx, ly))
-        self.levels = levels
-        self.lines = lines
+        r = self._r
+        turning_points = self._classical_turning_points(levels)
+        if len(r):
+            turning_points = np.clip(turning_points, r.min(), r.max())
+        self._levels = levels
+        self._turning_points = turning_points
     
 
 class Hooke(BaseOscillator):
     '''harmonic (Hooke) oscillator'''
+    k = _quantity('k', 'N/m', 'N/m')
+
     def __init__(self, we, m1, m2, re, r = None, De=0, nu_max=100):
         '''
         Parameters
@@ -112,59 +494,62 @@ class Hooke(BaseOscillator):
         '''
         if r is None:
             r = np.linspace(0*re, 5*re, 1000)
-        # use quantites with units
-        if not isinstance(we, pint.Quantity):
-            we /= ureg.centimeter 
-        if not isinstance(m1, pint.Quantity):
-            m1 *= ureg.unified_atomic_mass_unit
-        if not isinstance(m2, pint.Quantity):
-            m2 *= ureg.unified_atomic_mass_unit
-        if not isinstance(re, pint.Quantity):
-            re *= ureg.angstrom
-        if not isinstance(r, pint.Quantity):
-            r *= ureg.angstrom
-        if not isinstance(De, pint.Quantity):
-            De *= ureg.joule
+        # units are converted only once, here
         self.we = we
         self.m1 = m1
-        self.m1 = m2
+        self.m2 = m2
         self.re = re
         self.r = r
         self.De = De
         self.nu_max = nu_max
-        self.mu = (m1*m2)/(m1+m2) # reduced mass
-        c = ureg.speed_of_light
+        m1, m2 = self._m1, self._m2
+        self._mu = (m1*m2)/(m1+m2) # reduced mass
+        h, c = _constants()
         # force constant
-        self.k = self.mu * (2 * ureg.pi * c * we)**2
+        self._k = self._mu * (2 * np.pi * c * self._we)**2
         self.compute()
 
     def compute(self):
         '''
-        compute potential and lines for energy levels
+        compute potential, energy levels and their turning points
         '''
-        r = self.r
-        re = self.re
-        k = self.k
-        De = self.De
-        x = r-re
-        self.V = 0.5*k*x**2 - De
+        self._V = self._potential(self._r)
         self._compute_levels()
 
+    def _potential(self, r):
+        '''potential energy at distances r'''
+        return 0.5*self._k*(r - self._re)**2 - self._De
+
+    def _force(self, r):
+        '''force, -dV/dr, at distances r'''
+        return -self._k*(r - self._re)
+
     def _energy_levels(self):
         '''
         compute vibrational energy levels
             
         Returns
         -------
-        levels : array of pint.Quantity
+        levels : array
             energy levels
         '''
         nu = np.arange(self.nu_max)
-        we = self.we
-        De = self.De
-        h = ureg.planck_constant
-        c = ureg.speed_of_light
+        we = self._we
+        De = self._De
+        h, c = _constants()
         return ((nu + 0.5) * we * h * c) - De
+
+    def _classical_turning_points(self, levels):
+        '''
+        turning points of each level, where 1/2 k (r-re)^2 - De = E
+
+        Returns
+        -------
+        turning_points : array
+            distances of the two turning points (n_levels x 2)
+        '''
+        x = np.sqrt(2*(levels + self._De)/self._k)
+        return self._re + np.stack([-x, x], axis=-1)
     
     @classmethod
     def from_spect_data(cls, data, **kwargs):
@@ -175,6 +560,9 @@ class Hooke(BaseOscillator):
     
 class Morse(BaseOscillator):
     '''anharmonic (Morse) oscillator'''
+    wexe = _quantity('wexe', '1/m', '1/cm')
+    alfa = _quantity('alfa', '1/m', '1/m')
+
     def __init__(self, we, wexe, m1, m2, re, r = None, nu_max = None):
         '''
         compute Morse oscillator potential
@@ -195,60 +583,53 @@ class Morse(BaseOscillator):
         '''
         if r is None:
             r = np.linspace(0*re, 5*re, 1000)
-        # use quantites with units
-        if not isinstance(we, pint.Quantity):
-            we /= ureg.centimeter 
-        if not isinstance(wexe, pint.Quantity):
-            wexe /= ureg.centimeter 
-        if not isinstance(m1, pint.Quantity):
-            m1 *= ureg.unified_atomic_mass_unit
-        if not isinstance(m2, pint.Quantity):
-            m2 *= ureg.unified_atomic_mass_unit
-        if not isinstance(re, pint.Quantity):
-            re *= ureg.angstrom
-        if not isinstance(r, pint.Quantity):
-            r *= ureg.angstrom
+        # units are converted only once, here
         self.we = we
         self.wexe = wexe
         self.m1 = m1
-        self.m1 = m2
+        self.m2 = m2
         self.re = re
         self.r = r
-        self.mu = (m1*m2)/(m1+m2)
+        m1, m2 = self._m1, self._m2
+        self._mu = (m1*m2)/(m1+m2)
         self._morse_params()
         if not nu_max:
-            De = self.De
-            h = ureg.planck_constant
-            c = ureg.speed_of_light
-            nu_max = int(2*De/(h*c*we))
+            h, c = _constants()
+            nu_max = int(2*self._De/(h*c*self._we))
         self.nu_max = nu_max
         self.compute()
     
     def compute(self):
-        De = self.De
-        r = self.r
-        re = self.re
-        a = self.alfa
-        x = r - re
+        self._V = self._potential(self._r)
+        self._compute_levels()
+
+    def _potential(self, r):
+        '''potential energy at distances r'''
+        De = self._De
+        x = r - self._re
+        ex = np.exp(-self._alfa*x)
         # attractive part of potential
-        attr = -2*De*np.exp(-a*x)
+        attr = -2*De*ex
         # repulsive part of potential
-        rep = De*np.exp(-2*a*x)
-        self.V = attr + rep
-        self._compute_levels()
+        rep = De*ex*ex
+        return attr + rep
+
+    def _force(self, r):
+        '''force, -dV/dr, at distances r'''
+        ex = np.exp(-self._alfa*(r - self._re))
+        return -2*self._De*self._alfa*(1 - ex)*ex
 
     def _morse_params(self):
         '''
         compute Morse oscillator parameters from specttroscopic data
         '''
-        mu = self.mu
-        we = self.we
-        wexe = self.wexe
-        c = ureg.speed_of_light
-        h = ureg.planck_constant 
+        mu = self._mu
+        we = self._we
+        wexe = self._wexe
+        h, c = _constants()
         De = we * we / (4 * wexe) * h * c # well depth
-        self.De = De
-        self.alfa = we * np.sqrt(2 * mu/De) * ureg.pi * c # exponential parameter
+        self._De = De
+        self._alfa = we * np.sqrt(2 * mu/De) * np.pi * c # exponential parameter
 
     def _energy_levels(self):
         '''
@@ -256,20 +637,471 @@ class Morse(BaseOscillator):
             
         Returns
         -------
-        levels : array of pint.Quantity
+        levels : array
             energy levels
         '''
-        we = self.we
-        wexe = self.wexe
-        De = self.De
+        we = self._we
+        wexe = self._wexe
+        De = self._De
         nu_max = self.nu_max
-        c = ureg.speed_of_light
-        h = ureg.planck_constant 
+        h, c = _constants()
         nu = np.arange(nu_max)
         levels = h*c*((nu+0.5)*we - (nu+0.5)*(nu+0.5)*wexe) - De
         return levels
+
+    def _classical_turning_points(self, levels):
+        '''
+        turning points of each bound level, where De ((1 - exp(-a (r-re)))^2 - 1) = E,
+        i.e. r = re - ln(1 -+ s)/a, with s = sqrt(1 + E/De)
+
+        Returns
+        -------
+        turning_points : array
+            distances of the two turning points (n_levels x 2)
+        '''
+        s = np.sqrt(1 + levels/self._De)
+        with np.errstate(divide='ignore'): # the outer turning point of the dissociation limit is at infinity
+            return self._re - np.log1p(np.stack([s, -s], axis=-1))/self._alfa
     
     @classmethod
     def from_spect_data(cls, data, **kwargs):
         params = ['we', 'wexe', 'm1', 'm2', 're']
         return cls(**{p: data[p] for p in params}, **kwargs)
+
+
+##########################
+# Franck-Condon factors  #
+##########################
+
+def _parameters_key(osc):
+    '''parameters that define an oscillator, as plain SI magnitudes, to use as a cache key'''
+    values = [getattr(osc, '_'+n, None) for n in ('we', 'wexe', 'mu', 're', 'De')]
+    return (type(osc).__name__,) + tuple(None if x is None else float(getattr(x, 'magnitude', x))
+                                         for x in values)
+
+
+def _broaden(x, positions, weights, fwhm):
+    '''
+    spectrum of lines at positions with intensities weights on the uniform
+    grid x, broadened with a gaussian of full width at half maximum fwhm:
+    lines are binned on the grid and convolved with the gaussian by FFT
+    '''
+    dx = x[1] - x[0]
+    i = np.rint((positions - x[0])/dx).astype(int)
+    inside = (i >= 0) & (i < len(x))
+    sticks = np.bincount(i[inside], weights=weights[inside], minlength=len(x))
+    sigma = fwhm/(2*np.sqrt(2*np.log(2)))
+    # gaussian kernel, centered on the first point of a periodic grid
+    # twice as long as x, so that the convolution does not wrap around
+    n = 2*len(x)
+    offsets = np.fft.fftfreq(n, 1/n)*dx
+    kernel = np.exp(-offsets**2/(2*sigma**2))/(np.sqrt(2*np.pi)*sigma)
+    return np.fft.irfft(np.fft.rfft(sticks, n)*np.fft.rfft(kernel), n)[:len(x)]
+
+
+fc_cache_size = 16 # maximum number of Franck-Condon matrices kept in the cache
+_fc_cache = LRUCache(fc_cache_size)
+
+def franck_condon(lower, upper, n_lower=None, n_upper=None, n_r=1500):
+    '''
+    Franck-Condon factors between the vibrational levels of two electronic
+    states: the squared overlaps of the wavefunctions, computed numerically
+    (see radial_eigenstates) on a common grid and multiplied all at once.
+    Results are kept in a least recently used cache.
+
+    Parameters
+    ----------
+    lower, upper : BaseOscillator
+        potentials of the lower and upper electronic states (e.g. Morse with
+        different re, we, wexe)
+    n_lower, n_upper : int
+        number of vibrational levels of each state (all of them, if None)
+    n_r : int
+        number of points of the grid
+
+    Returns
+    -------
+    fc : array
+        Franck-Condon factors (n_upper x n_lower), rows for v', columns for v''
+    '''
+    n_lower = min(n_lower or lower.nu_max, lower.nu_max)
+    n_upper = min(n_upper or upper.nu_max, upper.nu_max)
+    # a grid wide enough for the highest levels of both states
+    tp = np.concatenate([_output(osc._turning_points[:n], 'm').to('angstrom').magnitude
+                         for osc, n in ((lower, n_lower), (upper, n_upper))])
+    # with some room for the tails of the wavefunctions (turning points
+    # at the edges of the grid of the oscillators are clipped)
+    lo, hi = tp.min(), tp.max()
+    r_min, r_max = max(lo - 0.3*(hi - lo), 0), hi + 0.3*(hi - lo)
+    # the grid depends on the grids of the oscillators, through the clipping
+    key = (_parameters_key(lower), _parameters_key(upper), n_lower, n_upper, n_r, float(r_min), float(r_max))
+    def compute():
+        r = np.linspace(r_min, r_max, n_r)
+        psi = []
+        for osc, n in ((lower, n_lower), (upper, n_upper)):
+            osc = copy.copy(osc) # the oscillator on the common grid
+            osc.r = r
+            osc.compute()
+            psi.append(osc.eigenstates(n)[1].to('angstrom**-0.5').magnitude)
+        overlap = psi[1] @ psi[0].T*(r[1] - r[0])
+        return overlap**2
+    return _fc_cache.get(key, compute)
+
+
+def vibronic_spectrum(lower, upper, Te, T=0, n_lower=None, n_upper=None, fwhm=20, n_points=4000):
+    '''
+    vibronic progressions of an electronic transition: each line v'' -> v'
+    has the intensity of its Franck-Condon factor times the Boltzmann
+    population of v'' at temperature T (only v'' = 0 at T = 0)
+
+    Parameters
+    ----------
+    lower, upper : BaseOscillator
+        potentials of the lower and upper electronic states
+    Te : float or pint.Quantity
+        energy between the minima of the two potentials (cm-1 by default)
+    T : float or pint.Quantity
+        temperature (kelvin, by default)
+    n_lower, n_upper : int
+        number of vibrational levels of each state (all of them, if None)
+    fwhm : float
+        full width at half maximum of the lines, in cm-1
+    n_points : int
+        number of points of the spectrum
+
+    Returns
+    -------
+    lines : dict
+        v'' ('v_lower'), v' ('v_upper'), wavenumber (cm-1) and intensity of each line
+    x : array
+        wavenumbers of the spectrum (cm-1)
+    spectrum : array
+        intensity of the spectrum, broadened with gaussian lines
+    '''
+    fc = franck_condon(lower, upper, n_lower, n_upper)
+    n_upper, n_lower = fc.shape
+    h, c = _constants()
+    E_lower = _output(lower._levels[:n_lower], 'J').to('J').magnitude
+    E_upper = _output(upper._levels[:n_upper], 'J').to('J').magnitude
+    # energies from the minimum of each potential
+    E_lower = E_lower + _output(lower._De, 'J').to('J').magnitude
+    E_upper = E_upper + _output(upper._De, 'J').to('J').magnitude
+    Te = _output(_boundary(Te, '1/cm'), '1/m').to('1/cm').magnitude
+    T = _output(_boundary(T, 'kelvin'), 'kelvin').magnitude
+    to_wavenumber = 1/(float(_output(h*c, 'J*m').to('J*cm').magnitude))
+    nu = Te + (E_upper[:, None] - E_lower[None, :])*to_wavenumber
+    if T > 0:
+        population = np.exp(-(E_lower - E_lower[0])/(k_B*T))
+        population /= population.sum()
+    else:
+        population = np.zeros(n_lower)
+        population[0] = 1
+    intensity = fc*population
+    v_upper, v_lower = np.indices(fc.shape)
+    lines = {'v_lower': v_lower.ravel(), 'v_upper': v_upper.ravel(),
+             'wavenumber': nu.ravel(), 'intensity': intensity.ravel()}
+    strong = intensity > 1e-6*intensity.max()
+    x = np.linspace(nu[strong].min() - 5*fwhm, nu[strong].max() + 5*fwhm, n_points)
+    return lines, x, _broaden(x, nu.ravel(), intensity.ravel(), fwhm)
+
+
+##########################
+# rovibrational spectra  #
+##########################
+
+rovibrational_cache_size = 32 # maximum number of level tables and of line lists kept in each cache
+_level_table_cache = LRUCache(rovibrational_cache_size)
+_line_list_cache = LRUCache(rovibrational_cache_size)
+
+
+def rovibrational_levels(mol, J_max=300, nu_max=None):
+    '''
+    rovibrational term values of a molecule, as a vibrating rotor:
+    E(v, J) = G(v) + B_v J(J+1) - D_e J^2(J+1)^2, with G(v) from the Morse
+    levels, B_v = B_e - alpha_e (v+1/2), B_e from re and the reduced mass,
+    alpha_e from the Pekeris relation of the Morse potential and
+    D_e = 4 B_e^3/we^2. Levels above the dissociation limit, or beyond the
+    J where the rotational energy stops increasing, are excluded.
+    Tables are kept in a least recently used cache (they do not depend on
+    temperature, so they are shared by all the line lists of a molecule);
+    they must not be modified.
+
+    Parameters
+    ----------
+    mol : str
+        molecule (a key of molecules)
+    J_max : int
+        maximum rotational quantum number
+    nu_max : int
+        number of vibrational levels (all the bound ones, if None)
+
+    Returns
+    -------
+    table : dict
+        term values in cm-1 from the lowest level ('E', nu_max x J_max+1),
+        mask of the levels to consider ('valid') and constants in cm-1
+        ('we', 'wexe', 'Be', 'alpha_e', 'De_rot' and 'D0', the dissociation
+        energy from the lowest level)
+    '''
+    def compute():
+        osc = Morse.from_spect_data(molecules[mol], nu_max=nu_max)
+        h, c = _constants()
+        we = float(osc.we.to('1/cm').magnitude)
+        wexe = float(osc.wexe.to('1/cm').magnitude)
+        De = float(_output(osc._De/(h*c), '1/m').to('1/cm').magnitude)
+        Be = float(_output(h/(8*np.pi**2*c*osc._mu*osc._re**2), '1/m').to('1/cm').magnitude)
+        alpha_e = 6*(np.sqrt(wexe*Be**3) - Be**2)/we # Pekeris relation
+        De_rot = 4*Be**3/we**2
+        v = np.arange(osc.nu_max)[:, None] + 0.5
+        J = np.arange(J_max + 1)
+        JJ = J*(J + 1)
+        Bv = Be - alpha_e*v
+        G = we*v - wexe*v**2
+        E = G + Bv*JJ - De_rot*JJ**2
+        valid = (E < De) & (Bv - 2*De_rot*JJ > 0) # bound, with energy increasing with J
+        return {'E': E - E[0, 0], 'valid': valid, 'we': we, 'wexe': wexe, 'Be': Be,
+                'alpha_e': alpha_e, 'De_rot': De_rot, 'D0': De - E[0, 0]}
+    return _level_table_cache.get((mol, J_max, nu_max), compute)
+
+
+def rovibrational_lines(mol, T, J_max=300, nu_max=None):
+    '''
+    P (J -> J-1) and R (J -> J+1) branches of the fundamental and hot bands
+    (v -> v+1) of a molecule, with intensities proportional to the
+    Boltzmann population of the lower level (with degeneracy 2J+1, and the
+    partition function as a log-sum-exp on all the levels), to the
+    Hoenl-London factor, to v+1 (harmonic transition moment) and to the
+    wavenumber, corrected for stimulated emission. At T = 0 only the lowest
+    level is populated.
+    The level table is shared by all temperatures (see rovibrational_levels);
+    line lists are kept in a least recently used cache and must not be modified.
+
+    Parameters
+    ----------
+    mol : str
+        molecule (a key of molecules)
+    T : float or pint.Quantity
+        temperature (kelvin, by default), not negative
+    J_max : int
+        maximum rotational quantum number
+    nu_max : int
+        number of vibrational levels (all the bound ones, if None)
+
+    Returns
+    -------
+    lines : dict
+        v'' ('v_lower'), J'' ('J_lower'), branch ('P' or 'R'), wavenumber
+        (cm-1) and intensity (normalized to a sum of 1) of each line
+    '''
+    T = float(_output(_boundary(T, 'kelvin'), 'kelvin').magnitude)
+    if T < 0:
+        raise ValueError('the temperature must not be negative')
+    def compute():
+        table = rovibrational_levels(mol, J_max, nu_max)
+        E, valid = table['E'], table['valid']
+        h, c = _constants()
+        c2 = float(_output(h*c/k_B, 'm*K').to('cm*K').magnitude) # second radiation constant
+        J = np.arange(J_max + 1)
+        v = np.arange(len(E))[:, None]
+        # log of the Boltzmann factor of each level (at T = 0 only the lowest
+        # level is populated) and of its weight, with the degeneracy
+        ln_b = -c2*E/T if T > 0 else np.where(E == 0, 0., -np.inf)
+        ln_w = np.where(valid, np.log(2*J + 1) + ln_b, -np.inf)
+        m = ln_w.max()
+        lnQ = m + np.log(np.exp(ln_w - m).sum())
+        # lower and upper levels of each line, as slices of the level table,
+        # and J'' + offset, the Hoenl-London factor times 2J''+1
+        branches = {'R': ((slice(None, -1), slice(None, -1)), (slice(1, None), slice(1, None)), 1),
+                    'P': ((slice(None, -1), slice(1, None)), (slice(1, None), slice(None, -1)), 0)}
+        lines = {'v_lower': [], 'J_lower': [], 'branch': [], 'wavenumber': [], 'intensity': []}
+        for branch, (lower, upper, offset) in branches.items():
+            nu = E[upper] - E[lower]
+            ok = valid[lower] & valid[upper]
+            v_lower = np.broadcast_to(v[lower[0]], nu.shape)[ok]
+            J_lower = np.broadcast_to(J[lower[1]], nu.shape)[ok]
+            nu = nu[ok]
+            # the degeneracy of the population simplifies with the
+            # denominator of the Hoenl-London factor
+            emission = -np.expm1(-c2*nu/T) if T > 0 else 1 # stimulated emission
+            intensity = np.exp(ln_b[lower][ok] - lnQ)*(J_lower + offset)*(v_lower + 1)*nu*emission
+            lines['v_lower'].append(v_lower)
+            lines['J_lower'].append(J_lower)
+            lines['branch'].append(np.full(len(nu), branch))
+            lines['wavenumber'].append(nu)
+            lines['intensity'].append(intensity)
+        lines = {key: np.concatenate(value) for key, value in lines.items()}
+        lines['intensity'] /= lines['intensity'].sum()
+        return lines
+    return _line_list_cache.get((mol, T, J_max, nu_max), compute)
+
+
+def rovibrational_spectrum(mol, T, J_max=300, nu_max=None, fwhm=0.5, step=None):
+    '''
+    rovibrational absorption spectrum of a molecule (see rovibrational_lines),
+    broadened with gaussian lines by FFT convolution on a fine grid
+
+    Parameters
+    ----------
+    mol : str
+        molecule (a key of molecules)
+    T : float or pint.Quantity
+        temperature (kelvin, by default), not negative
+    J_max : int
+        maximum rotational quantum number
+    nu_max : int
+        number of vibrational levels (all the bound ones, if None)
+    fwhm : float
+        full width at half maximum of the lines, in cm-1
+    step : float
+        spacing of the grid, in cm-1 (fwhm/10, if None)
+
+    Returns
+    -------
+    lines : dict
+        line list (see rovibrational_lines)
+    x : array
+        wavenumbers of the spectrum (cm-1)
+    spectrum : array
+        intensity of the spectrum
+    '''
+    lines = rovibrational_lines(mol, T, J_max, nu_max)
+    nu, intensity = lines['wavenumber'], lines['intensity']
+    strong = intensity > 1e-6*intensity.max()
+    step = step or fwhm/10
+    x = np.arange(nu[strong].min() - 5*fwhm, nu[strong].max() + 5*fwhm, step)
+    return lines, x, _broaden(x, nu, intensity, fwhm)
+
+
+###########################
+# classical trajectories  #
+###########################
+
+def classical_ensemble(osc, E, n_steps=10000, dt=None, n_saved=200, bins=200, r_max=None):
+    '''
+    classical trajectories of the diatomic on the potential of an oscillator,
+    for an ensemble of total energies, integrated with velocity Verlet.
+    The integration is vectorized over the ensemble, with a python loop only
+    over time steps; positions are buffered in chunks of steps, that give
+    the position distributions and the crossings of re at full resolution.
+    Each trajectory starts at re, moving outwards; it dissociates if it
+    goes beyond r_max.
+
+    Parameters
+    ----------
+    osc : BaseOscillator
+        the oscillator (Hooke or Morse)
+    E : array of float or pint.Quantity
+        total energies, from the same zero as the levels, i.e. -De at the
+        minimum of the potential and 0 at the dissociation limit (eV by default)
+    n_steps : int
+        number of time steps
+    dt : float or pint.Quantity
+        time step (fs by default); 1/100 of the harmonic period, if None
+    n_saved : int
+        number of points of the trajectories returned for plotting
+    bins : int
+        number of bins of the position distributions
+    r_max : float or pint.Quantity
+        distance of dissociation (angstrom by default); 5 re (the default
+        range of distances of the oscillators), or beyond the outer turning
+        point of the highest bound energy, if None
+
+    Returns
+    -------
+    result : dict
+        't': times of the saved points (fs);
+        'r', 'v': saved positions (angstrom) and velocities (angstrom/fs),
+        (n_saved x n_E, float32);
+        'r_bins': edges of the bins of the distributions (angstrom);
+        'distribution': time averaged probability density of the position
+        of each trajectory (n_E x bins, 1/angstrom);
+        'period': period of each trajectory, from its crossings of re (fs,
+        nan if it dissociates or does not complete two periods);
+        'frequency', 'shift': vibrational frequency (cm-1) and its shift
+        from the harmonic one (we);
+        'dissociated': if the trajectory went beyond r_max;
+        'energy_error': relative change of the energy at the end of the
+        integration, for the bound trajectories
+    '''
+    h, c = _constants()
+    E = np.atleast_1d(_output(_boundary(E, 'eV'), 'J').to('J').magnitude).astype(float)
+    De = float(_output(osc._De, 'J').to('J').magnitude)
+    re = float(_output(osc._re, 'm').to('m').magnitude)
+    mu = float(_output(osc._mu, 'kg').to('kg').magnitude)
+    we = float(_output(osc._we, '1/m').to('1/m').magnitude)
+    if CHECK_UNITS: # the integration is done on plain arrays, in SI units
+        force = lambda r: _output(osc._force(Q_(r, 'm')), 'N').to('N').magnitude
+        potential = lambda r: _output(osc._potential(Q_(r, 'm')), 'J').to('J').magnitude
+    else:
+        force, potential = osc._force, osc._potential
+    if dt is None:
+        dt = 1/(100*c*we)
+    else:
+        dt = float(_output(_boundary(dt, 'fs'), 's').to('s').magnitude)
+    E = np.maximum(E, -De) # not below the minimum of the potential
+    with np.errstate(invalid='ignore'): # no outer turning point above the dissociation limit
+        tp = _output(osc._classical_turning_points(E), 'm').to('m').magnitude
+    if r_max is None:
+        outer = tp[:, 1][np.isfinite(tp[:, 1])]
+        r_max = max(5*re, 1.05*outer.max(initial=0))
+    else:
+        r_max = float(_output(_boundary(r_max, 'angstrom'), 'm').to('m').magnitude)
+    r_lo = max(np.nanmin(tp[:, 0]) - 0.05*(r_max - re), 0)
+    width = (r_max - r_lo)/bins
+    n = len(E)
+    r = np.full(n, re)
+    v = np.sqrt(2*(E + De)/mu) # all the energy is kinetic at re
+    a = force(r)/mu
+    every = max(1, n_steps//n_saved)
+    saved_r, saved_v = [], []
+    hist = np.zeros(n*bins)
+    crossings = np.zeros(n, dtype=int) # number of upward crossings of re
+    first = np.full(n, np.nan) # time of the first and of the last of them
+    last = np.full(n, np.nan)
+    dissociated = np.zeros(n, dtype=bool)
+    chunk = max(1, min(n_steps, 2**20//n)) # steps buffered before processing
+    buffer = np.empty((chunk + 1, n))
+    buffer[0] = r
+    for start in range(0, n_steps, chunk):
+        size = min(chunk, n_steps - start)
+        for i in range(1, size + 1):
+            v += 0.5*dt*a
+            r += dt*v
+            a = force(r)/mu
+            v += 0.5*dt*a
+            buffer[i] = r
+            if (start + i) % every == 0:
+                saved_r.append(r.astype(np.float32))
+                saved_v.append(v.astype(np.float32))
+        x = buffer[:size + 1] - re
+        dissociated |= (x[1:] > r_max - re).any(axis=0)
+        # upward crossings of re, with their times interpolated linearly
+        step, particle = np.nonzero((x[:-1] < 0) & (x[1:] >= 0))
+        t = (start + step - x[step, particle]/(x[step + 1, particle] - x[step, particle]))*dt
+        crossings += np.bincount(particle, minlength=n)
+        np.fmin.at(first, particle, t)
+        np.fmax.at(last, particle, t)
+        # histograms of the positions, one for each trajectory
+        b = np.floor((buffer[1:size + 1] - r_lo)/width)
+        inside = (b >= 0) & (b < bins)
+        index = (np.arange(n)*bins + b)[inside].astype(np.int64)
+        hist += np.bincount(index, minlength=n*bins)
+        buffer[0] = buffer[size]
+    hist = hist.reshape(n, bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        distribution = hist/(hist.sum(axis=1, keepdims=True)*width*1e10)
+        period = np.where((crossings > 1) & ~dissociated, (last - first)/(crossings - 1), np.nan)
+        frequency = 1/(period*c*100) # cm-1
+        E_end = 0.5*mu*v**2 + potential(r)
+        energy_error = np.where(dissociated, np.nan, (E_end - E)/np.abs(E + De))
+    we_cm = we/100
+    return {'t': np.arange(1, len(saved_r) + 1)*every*dt*1e15,
+            'r': np.array(saved_r).reshape(-1, n)*np.float32(1e10),
+            'v': np.array(saved_v).reshape(-1, n)*np.float32(1e-5),
+            'r_bins': (r_lo + width*np.arange(bins + 1))*1e10,
+            'distribution': distribution,
+            'period': period*1e15,
+            'frequency': frequency,
+            'shift': frequency - we_cm,
+            'dissociated': dissociated,
+            'energy_error': energy_error}
@@ -6,20 +6,19 @@ import pint
 import plotly.colors as pcolors
 import plotly.graph_objs as go
 import plotly.io as pio
-import re
-from dash import callback, dcc, html
+from dash import callback, dcc, html, no_update
 from dash.dependencies import Input, Output, State, MATCH, ALL
 from dash.exceptions import PreventUpdate
 from flask import Flask, request
 from flask_babel import Babel, gettext
 try: # when running as an independent app
-    from model import oscillator, molecules
+    from model import Morse, cached_oscillator, molecules, vibronic_spectrum
 except: # when running in a multipage dashboard
-    from .model import oscillator, molecules
+    from .model import Morse, cached_oscillator, molecules, vibronic_spectrum
 try: # when running as an independent app
-    from utilities import _id, common_setup
+    from utilities import _id, adaptive_sample, common_setup, update_container, update_figure
 except Exception as e: # when running in a multipage dashboard
-    from .utilities import _id, common_setup
+    from .utilities import _id, adaptive_sample, common_setup, update_container, update_figure
     
 # define translator function
 _ = gettext
@@ -87,6 +86,10 @@ def controls_card_factory(uid=None):
                                  dbc.Col(daq.BooleanSwitch(id={'type':_id('h-levels-switch'), 'uid':uid},
                                                            on=False,
                                                            label=_('Levels'),
+                                                           labelPosition='left')),
+                                 dbc.Col(daq.BooleanSwitch(id={'type':_id('h-psi-switch'), 'uid':uid},
+                                                           on=False,
+                                                           label='|\u03c8|\u00b2',
                                                            labelPosition='left'))])
                                 ]) 
     m_container = dbc.Container([dbc.Row([
@@ -97,6 +100,10 @@ def controls_card_factory(uid=None):
                                  dbc.Col(daq.BooleanSwitch(id={'type':_id('m-levels-switch'), 'uid':uid},
                                                            on=False,
                                                            label=_('Levels'),
+                                                           labelPosition='left')),
+                                 dbc.Col(daq.BooleanSwitch(id={'type':_id('m-psi-switch'), 'uid':uid},
+                                                           on=False,
+                                                           label='|\u03c8|\u00b2',
                                                            labelPosition='left'))])
                                 ])
     
@@ -121,6 +128,28 @@ r_slider = dbc.Container([dbc.Label(_('distance'), id=_id('distance-label')),
 curves_container = dbc.Container([], id=_id('curves-container')) # put all the cards together
 add_button = dbc.Button(_('add plot'), id=_id('add-button'), style={'margin-bottom':5})
 left_panel = dbc.Container([r_slider, add_button, curves_container], id=_id('left-panel'))
+
+# electronic transition to an upper state, a Morse potential with a
+# longer bond and a lower frequency than the ground state
+vibronic_controls = dbc.Container([
+    dbc.Label(_('electronic transition'), id=_id('vibronic-label')),
+    dcc.Dropdown(id=_id('vibronic-molecule'),
+                 options=[{"label": molecules[m]['label'], "value": m} for m in molecules.keys()],
+                 value='I_2', clearable=False),
+    dbc.Label(_('upper state: bond length shift, \u212B'), id=_id('shift-label')),
+    dcc.Slider(id=_id('shift-slider'), min=0, max=0.5, step=0.01,
+               marks={0: '0', 0.25: '0.25', 0.5: '0.5'}, value=0.35),
+    dbc.Label(_('upper state: frequency ratio'), id=_id('ratio-label')),
+    dcc.Slider(id=_id('ratio-slider'), min=0.3, max=1.2, step=0.05,
+               marks={0.3: '0.3', 0.6: '0.6', 0.9: '0.9', 1.2: '1.2'}, value=0.6),
+    dbc.Label(_('temperature, K'), id=_id('vibronic-T-label')),
+    dcc.Slider(id=_id('vibronic-T-slider'), min=0, max=1000, step=50,
+               marks={0: '0', 300: '300', 600: '600', 1000: '1000'}, value=300),
+    dbc.Label(_('electronic energy, cm\u207b\u00b9'), id=_id('Te-label')),
+    dbc.Input(id=_id('Te-input'), type='number', min=0, value=15769),
+    ], id=_id('vibronic-panel'))
+max_lower_levels = 20 # vibrational levels of the lower state in the spectrum
+
 def layout():
     'set layout of the app with all the widgets'
     layout = dbc.Container([
@@ -128,7 +157,13 @@ def layout():
         html.Hr(),
         dbc.Row([dbc.Col(left_panel, xl=3),
                  dbc.Col(dcc.Graph(id=_id("V-plot"), style={'height':'80vh'}), xl=7),],
-                 align="center",),],                           
+                 align="center",),
+        html.Hr(),
+        dbc.Row([dbc.Col(vibronic_controls, xl=3),
+                 dbc.Col(dcc.Graph(id=_id('vibronic-plot'), style={'height':'50vh'}), xl=7),],
+                 align="center",),
+        dcc.Store(id=_id('V-traces')), # number of traces of each curve in the plot
+        ],
         fluid=True,
         id=_id('layout')
         )
@@ -140,9 +175,19 @@ def layout():
 ######################
 @callback([Output(_id('distance-label'), 'children'),
                Output(_id('add-button'), 'children'),
+               Output(_id('vibronic-label'), 'children'),
+               Output(_id('shift-label'), 'children'),
+               Output(_id('ratio-label'), 'children'),
+               Output(_id('vibronic-T-label'), 'children'),
+               Output(_id('Te-label'), 'children'),
               ],
               [Input(_id('distance-label'), 'children'),
                Input(_id('add-button'), 'children'),
+               Input(_id('vibronic-label'), 'children'),
+               Input(_id('shift-label'), 'children'),
+               Input(_id('ratio-label'), 'children'),
+               Input(_id('vibronic-T-label'), 'children'),
+               Input(_id('Te-label'), 'children'),
               ])
 def setup_language_specific(*messages):
     return [_(m) for m in messages]
@@ -150,89 +195,212 @@ def setup_language_specific(*messages):
 @callback(Output(_id('curves-container'), 'children'),
               [Input(_id('add-button'), 'n_clicks'),
               Input({'type':_id('clear-button'), 'uid': ALL}, 'n_clicks')],
-              State(_id('curves-container'), 'children'),
+              State({'type':_id('controls_card'), 'uid': ALL}, 'id'),
         )
-def update_curves_container(add_n_clicks, clear_n_clicks, curves_container_list):
+def update_curves_container(add_n_clicks, clear_n_clicks, card_ids):
     '''update curves-container adding or removing controls as required'''
-    ctx = dash.callback_context # this is needed to know which button has been pushed
-    trigger = ctx.triggered[0]
-    if 'add-button' in trigger['prop_id']: # add a new controls_card
-        uid = add_n_clicks # unique id 
-        new_controls_card = controls_card_factory(uid=uid)
-        return curves_container_list+[new_controls_card]
-    else: # some delete button has been pushed
-        match = re.search(r'"uid":(\d+)',trigger['prop_id'])
-        if match:
-            uid = int(match.group(1)) # uid of the curve
-            new_list = [curve for curve in curves_container_list
-                        if curve['props']['id']['uid'] != uid]
-            return new_list
-        else:
-            raise PreventUpdate # needed when app starts
+    return update_container(_id('add-button'), add_n_clicks, card_ids, controls_card_factory)
+
+
+def level_trace(osc, n_lines, **kwargs):
+    '''
+    a single trace with (at most about n_lines) energy levels of an oscillator,
+    each one drawn between its turning points and separated by NaN
+
+    Parameters
+    ----------
+    osc : BaseOscillator
+        oscillator
+    n_lines : int
+        number of levels to draw
+    kwargs :
+        other properties of the trace
+
+    Returns
+    -------
+    trace : go.Scatter
+        the energy levels
+    '''
+    step = int(len(osc.levels)/n_lines) or 1
+    x = osc.turning_points[::step].to('angstrom').magnitude
+    y = osc.levels[::step].to('eV').magnitude
+    n = len(y)
+    x = np.column_stack([x, np.full(n, np.nan)]).ravel()
+    y = np.column_stack([y, y, np.full(n, np.nan)]).ravel()
+    return go.Scatter(x=x, y=y, mode='lines', **kwargs)
+
+
+def psi_trace(osc, n_lines, **kwargs):
+    '''
+    a single trace with the probability densities |psi|^2 of (at most about
+    n_lines) eigenstates of an oscillator, computed numerically, each one
+    drawn on top of its energy and separated by NaN
+
+    Parameters
+    ----------
+    osc : BaseOscillator
+        oscillator
+    n_lines : int
+        number of eigenstates to draw
+    kwargs :
+        other properties of the trace
+
+    Returns
+    -------
+    trace : go.Scatter
+        the probability densities
+    '''
+    # only the eigenstates drawn are computed
+    step = int(osc.nu_max/n_lines) or 1
+    states = np.arange(0, osc.nu_max, step)
+    E, psi = osc.eigenstates(states=states)
+    E = E.to('eV').magnitude
+    psi2 = (psi**2).to('1/angstrom').magnitude
+    # the highest peak is as high as the average distance between levels
+    scale = (E[-1] - E[0])/max(states[len(E)-1], 1)/psi2.max()
+    # each density is sent only where it can be seen, from its first to its
+    # last point above 1/1000 of its peak (its nodes in between are kept)
+    visible = psi2 > 1e-3*psi2.max(axis=1, keepdims=True)
+    visible = np.maximum.accumulate(visible, axis=1) & np.maximum.accumulate(visible[:, ::-1], axis=1)[:, ::-1]
+    # and with about 16 points for each of its nu+1 lobes
+    n = len(psi2)
+    i = np.arange(psi2.shape[1]) - visible.argmax(axis=1)[:, None] # from the first visible point
+    stride = np.maximum(visible.sum(axis=1)//(16*(states[:n] + 1)), 1)
+    visible &= (i % stride[:, None] == 0) | (i == visible.sum(axis=1)[:, None] - 1)
+    x = np.tile(osc.r.to('angstrom').magnitude, (n, 1))
+    y = E[:, None] + scale*psi2
+    # a NaN closes each density
+    keep = np.column_stack([visible, np.ones(n, dtype=bool)])
+    x = np.column_stack([x, np.full(n, np.nan)])[keep]
+    y = np.column_stack([y, np.full(n, np.nan)])[keep]
+    return go.Scatter(x=np.round(x, 3), y=np.round(y, 4), mode='lines', **kwargs)
 
             
+def curve_traces(mol, morse, morse_levels, morse_psi, hooke, hooke_levels, hooke_psi, r_max, color):
+    '''
+    compute the traces of the curves of a controls card
+    
+    Returns
+    -------
+    traces : list
+        plotly traces of the curves
+    info : tuple
+        dissociation energy (eV) and shortest distance of the highest Hooke level (angstrom),
+        used to set the range of the plot
+    '''
+    data = []
+    r = np.linspace(0, r_max, 1000)
+    n_lines = 30
+    # oscillators are cached: switching curves or levels does not build them again
+    mym = cached_oscillator(mol, 'morse', r)
+    myh = cached_oscillator(mol, 'hooke', r, nu_max=mym.nu_max, De=mym.De)
+    # potentials are sampled only where they bend, in the range of energies of the plot
+    De = mym.De.to('eV').magnitude
+    def potential(osc):
+        return adaptive_sample(lambda x: osc.potential(x).to('eV').magnitude, 0, r_max, y_range=(-1.2*De, 0.5*De))
+    if hooke: # Hooke potential without levels
+        x, y = potential(myh)
+        data.append(go.Scatter(x=x, y=y, mode='lines', name=f'{molecules[mol]["label2"]} - Hooke', line={'color':color, 'width':2}, opacity=0.5, showlegend=True))
+    if hooke_levels: # Hooke potential with energy levels
+        data.append(level_trace(myh, n_lines, line={'color':color, 'width':0.5}, opacity=0.5, showlegend=False))
+    if hooke_psi: # probability densities of the Hooke eigenstates
+        data.append(psi_trace(myh, n_lines, line={'color':color, 'width':1, 'dash':'dot'}, opacity=0.5, showlegend=False))
+    if morse: # Morse potential without energy levels
+        x, y = potential(mym)
+        data.append(go.Scatter(x=x, y=y, mode='lines', name=f'{molecules[mol]["label2"]} - Morse', line={'color':color, 'width':2}, showlegend=True))
+    if morse_levels: # Morse potential with energy levels
+        data.append(level_trace(mym, n_lines, line={'color':color, 'width':0.5}, showlegend=False))
+    if morse_psi: # probability densities of the Morse eigenstates
+        data.append(psi_trace(mym, n_lines, line={'color':color, 'width':1}, showlegend=False))
+    return data, (De, myh.turning_points[-1, 0].to('angstrom').magnitude)
+
+
 # This is the most important callback doing nearly all the work
 @callback([Output(_id('V-plot'), 'figure'),
                Output({'type':_id('controls_card'), 'uid': ALL}, 'style'),
+               Output(_id('V-traces'), 'data'),
               ],
               [Input(_id('r-slider'), 'value'),
                Input({'type':_id('molecule-dropdown'), 'uid': ALL}, 'value'),
                Input({'type':_id('m-plot-switch'), 'uid': ALL}, 'on'),
                Input({'type':_id('m-levels-switch'), 'uid': ALL}, 'on'),
+               Input({'type':_id('m-psi-switch'), 'uid': ALL}, 'on'),
                Input({'type':_id('h-plot-switch'), 'uid': ALL}, 'on'),
                Input({'type':_id('h-levels-switch'), 'uid': ALL}, 'on'),
+               Input({'type':_id('h-psi-switch'), 'uid': ALL}, 'on'),
               ],
               State({'type':_id('controls_card'), 'uid': ALL}, 'style'),
+              State({'type':_id('controls_card'), 'uid': ALL}, 'id'),
+              State(_id('V-traces'), 'data'),
 )
-def update_plot(r_max, mols, morse, morse_levels, hooke, hooke_levels, style):
-    '''update plots area values on panel everytime something changes'''
-    data = []
-    new_style = []
-    Dmax = 0
-    xmin = r_max
-    r = np.linspace(0, r_max, 1000)
-    n_lines = 30
-    for i, (mol, m_plot, ml_plot, h_plot, hl_plot, st) in enumerate(zip(mols, morse, morse_levels, hooke, hooke_levels, style)):
+def update_plot(r_max, mols, morse, morse_levels, morse_psi, hooke, hooke_levels, hooke_psi, style, card_ids, traces):
+    '''
+    update plots area values on panel everytime something changes;
+    only curves whose parameters have changed are computed and sent again
+    '''
+    curves = []
+    for i, (mol, m_plot, ml_plot, mp_plot, h_plot, hl_plot, hp_plot, card_id) in enumerate(zip(mols, morse, morse_levels, morse_psi, hooke, hooke_levels, hooke_psi, card_ids)):
         color = colors[i%len(colors)]
-        mym = oscillator(mol, 'morse', r=r)
-        myh = oscillator(mol, 'hooke', r=r, nu_max=mym.nu_max, De=mym.De)
-        if h_plot: # Hooke potential without levels
-            x = myh.r.to('angstrom').magnitude
-            y = myh.V.to('eV').magnitude
-            data.append(go.Scatter(x=x, y=y, mode='lines', name=f'{molecules[mol]["label2"]} - Hooke', line={'color':color, 'width':2}, opacity=0.5, showlegend=True))
-        if hl_plot: # Hooke potential with energy levels
-            step =int(len(myh.lines)/n_lines) or 1
-            for l in myh.lines[::step]:
-                lx = l[0].to('angstrom').magnitude
-                ly = l[1].to('eV').magnitude
-                data.append(go.Scatter(x=lx, y=ly, mode='lines', line={'color':color, 'width':0.5}, opacity=0.5, showlegend=False))
-        if m_plot: # Morse potential without energy levels
-            x = mym.r.to('angstrom').magnitude
-            y = mym.V.to('eV').magnitude
-            data.append(go.Scatter(x=x, y=y, mode='lines', name=f'{molecules[mol]["label2"]} - Morse', line={'color':color, 'width':2}, showlegend=True))
-        if ml_plot: # Morse potential with energy levels
-            step =int(len(mym.lines)/n_lines) or 1
-            for l in mym.lines[::step]:
-                lx = l[0].to('angstrom').magnitude
-                ly = l[1].to('eV').magnitude
-                data.append(go.Scatter(x=lx, y=ly, mode='lines', line={'color':color, 'width':0.5}, showlegend=False))
-        # update border color 
-        st['border-color'] = color
-        new_style.append(st)
-        Dmax = max((Dmax, mym.De.to('eV').magnitude))
-        xmin = min(xmin, myh.lines[-1][0].to('angstrom').magnitude[0])
-    layout = {'xaxis': {'title': _('distance, \u212B'), 'range':[xmin, r_max]},
-              'yaxis': {'title': _('energy, eV') , 'range':[-1.2*Dmax, 0.5*Dmax]}}
-    layout.update(legend=dict(
-        orientation="h",
-        yanchor="bottom",
-        y=1.02,
-        xanchor="right",
-        x=1)
-    )
-    myfig = go.Figure(data=data, layout=layout)
-    myfig.add_hline(y=0, line_dash="dash")
-    return myfig, new_style, 
+        params = (mol, m_plot, ml_plot, mp_plot, h_plot, hl_plot, hp_plot, r_max, color)
+        curves.append((card_id['uid'], params, lambda params=params: curve_traces(*params)))
+    def layout(infos):
+        Dmax = max([0] + [De for De, xmin in infos])
+        xmin = min([r_max] + [xmin for De, xmin in infos])
+        layout = {'xaxis': {'title': _('distance, \u212B'), 'range':[xmin, r_max]},
+                  'yaxis': {'title': _('energy, eV') , 'range':[-1.2*Dmax, 0.5*Dmax]},
+                  # dissociation limit
+                  'shapes': [{'line': {'dash': 'dash'}, 'type': 'line', 'x0': 0, 'x1': 1, 'xref': 'x domain', 'y0': 0, 'y1': 0, 'yref': 'y'}]}
+        layout.update(legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1)
+        )
+        return layout
+    myfig, infos, changed, traces = update_figure(_id('V-plot'), traces, r_max, curves, layout)
+    # update border color only of the cards whose curve has changed
+    new_style = [dict(st, **{'border-color': params[-1]}) if c else no_update
+                 for st, (uid, params, factory), c in zip(style, curves, changed)]
+    return myfig, new_style, traces
+
+
+@callback(Output(_id('vibronic-plot'), 'figure'),
+          [Input(_id('vibronic-molecule'), 'value'),
+           Input(_id('shift-slider'), 'value'),
+           Input(_id('ratio-slider'), 'value'),
+           Input(_id('vibronic-T-slider'), 'value'),
+           Input(_id('Te-input'), 'value'),
+          ])
+def update_vibronic_plot(mol, shift, ratio, T, Te):
+    '''
+    vibronic progression of the transition from the ground state of a
+    molecule to an upper state with the same atoms, a longer bond and
+    a different frequency (see vibronic_spectrum)
+    '''
+    if Te is None:
+        raise PreventUpdate
+    data = molecules[mol]
+    re = data['re']
+    r = np.linspace(0.5*re, 3*(re + shift), 1000)
+    lower = cached_oscillator(mol, 'morse', r)
+    # the anharmonicity is scaled as the frequency, and so the well depth
+    upper = Morse(data['we']*ratio, data['wexe']*ratio, data['m1'], data['m2'], re + shift, r=r)
+    lines, x, spectrum = vibronic_spectrum(lower, upper, Te, T, n_lower=max_lower_levels)
+    # stick spectrum of the strongest lines, on the scale of the broadened one
+    intensity = lines['intensity']
+    strong = intensity > 1e-3*intensity.max()
+    nu = lines['wavenumber'][strong]
+    height = intensity[strong]/intensity.max()*spectrum.max()
+    n = len(nu)
+    sticks_x = np.column_stack([nu, nu, np.full(n, np.nan)]).ravel()
+    sticks_y = np.column_stack([np.zeros(n), height, np.full(n, np.nan)]).ravel()
+    fig = go.Figure([go.Scatter(x=sticks_x, y=sticks_y, mode='lines', line={'width': 0.5, 'color': colors[1]},
+                                hoverinfo='skip', showlegend=False),
+                     go.Scatter(x=x, y=spectrum, mode='lines', line={'color': colors[0]}, showlegend=False)])
+    fig.update_layout(xaxis={'title': _('wavenumber, cm\u207b\u00b9')},
+                      yaxis={'title': _('intensity'), 'showticklabels': False})
+    return fig
     
 if __name__ == '__main__':
     ####################
@@ -1,9 +1,14 @@
 import dash_bootstrap_components as dbc
 import inspect
+import numpy as np
 import os
-from dash import callback, dcc, html
+import plotly.graph_objs as go
+import threading
+from collections import OrderedDict
+from dash import callback, ctx, dcc, html, Patch
 from dash.dependencies import Input, Output, State, MATCH, ALL
-from flask_babel import Babel, gettext
+from dash.exceptions import PreventUpdate
+from flask_babel import Babel, gettext, get_locale
 
 # define translator function to use with flask_babel
 _ = gettext
@@ -65,4 +70,370 @@ def common_setup(title, subtitle, info):
             button_text = _('more info')
         return button_text, text
     
-    return header, setup_language_general, show_info
\ No newline at end of file
+    return header, setup_language_general, show_info
+
+###################
+# card containers #
+###################
+
+def update_container(add_id, add_n_clicks, card_ids, card_factory, wrapper=None):
+    '''
+    add or remove a card from a container, with a partial update of its children:
+    only the new card is sent to the browser when a card is added, and only the
+    position of the card to remove when it is deleted, however many cards are there.
+    To be called by a callback with the container children as output, triggered
+    by the add button and by the delete buttons of all the cards
+    
+    Parameters
+    ----------
+    add_id : str
+        id of the add button
+    add_n_clicks : int
+        number of clicks of the add button, used as unique id of the new card
+    card_ids : list of dict
+        ids of all the cards in the container, in the same order as the children
+        of the container (State({'type': ..., 'uid': ALL}, 'id'))
+    card_factory : function
+        function creating a new card, given its uid
+    wrapper : function, optional
+        function wrapping each card in the child of the container (such as a column)
+        
+    Returns
+    -------
+    children : dash.Patch
+        partial update of the children of the container
+    '''
+    trigger = ctx.triggered_id
+    # new delete buttons trigger the callback as well, without being clicked
+    if trigger is None or ctx.triggered[0]['value'] is None:
+        raise PreventUpdate # needed when app starts
+    children = Patch()
+    if trigger == add_id: # add a new card
+        card = card_factory(uid=add_n_clicks)
+        children.append(wrapper(card) if wrapper else card)
+    else: # some delete button has been pushed
+        uids = [card_id['uid'] for card_id in card_ids]
+        if trigger['uid'] not in uids: # already removed
+            raise PreventUpdate
+        del children[uids.index(trigger['uid'])]
+    return children
+
+####################################
+# least recently used (LRU) caches #
+####################################
+
+class LRUCache:
+    '''
+    least recently used cache, shared by the threads of the server:
+    the least recently used values are dropped when there are more than size
+    
+    Parameters
+    ----------
+    size : int
+        maximum number of values kept in the cache
+    '''
+    def __init__(self, size):
+        self.size = size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get(self, key, factory):
+        '''
+        get a value from the cache, computing it only if it is not there
+        (factory runs outside the lock, so that other threads are not blocked)
+        
+        Parameters
+        ----------
+        key : tuple
+            hashable key identifying the value
+        factory : function
+            function without arguments returning the value
+            
+        Returns
+        -------
+        value : object
+            the cached value
+        '''
+        with self._lock:
+            found = key in self._values
+            value = self._values.pop(key, None)
+            self._stats['hits' if found else 'misses'] += 1
+        if not found:
+            value = factory()
+        with self._lock:
+            self._values[key] = value # the most recently used is the last one
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+        return value
+
+    def find(self, match):
+        '''
+        the most recently used value whose key satisfies match (a function
+        of the key), or None, without changing the order of the cache
+        '''
+        with self._lock:
+            return next((v for k, v in reversed(self._values.items()) if match(k)), None)
+
+    def count(self, event):
+        '''add one to the count of an event in the statistics of the cache'''
+        with self._lock:
+            self._stats[event] = self._stats.get(event, 0) + 1
+
+    def info(self):
+        '''
+        statistics of the cache
+
+        Returns
+        -------
+        info : dict
+            number of hits, misses (and other events counted) and current size
+        '''
+        with self._lock:
+            return dict(self._stats, size=len(self._values))
+
+    def clear(self):
+        '''remove all the values from the cache'''
+        with self._lock:
+            self._values.clear()
+
+
+trace_cache_size = 512 # maximum number of curves kept in the cache
+_trace_cache = LRUCache(trace_cache_size)
+
+def cached_traces(key, factory):
+    '''
+    get the traces of a curve from a least recently used cache,
+    computing them only if they are not there
+    
+    Parameters
+    ----------
+    key : tuple
+        hashable key identifying the curve
+    factory : function
+        function without arguments returning the traces of the curve
+        (a list of plotly traces) and any other information about the curve
+        needed by the page (such as values to show on its card)
+        
+    Returns
+    -------
+    traces : list of dict
+        traces of the curve
+    info : object
+        information about the curve, as returned by factory
+    '''
+    def compute():
+        traces, info = factory()
+        return ([trace.to_plotly_json() for trace in traces], info)
+    return _trace_cache.get(key, compute)
+
+
+def update_figure(figure_id, stored, grid, curves, layout):
+    '''
+    update a figure with a curve for each card, computing only the curves whose
+    parameters have changed. Traces of each curve are taken from the cache and,
+    if the figure already shows the same grid, only the traces of the curves
+    that have been changed, added or removed are sent to the browser (as a
+    partial update of the figure). The number of traces of each curve is
+    kept in a dcc.Store, that must be both an output and a state of the callback
+    
+    Parameters
+    ----------
+    figure_id : str
+        id of the figure (unique in the whole dashboard)
+    stored : dict or None
+        data of the store, as set by the previous call
+    grid : tuple
+        parameters shared by all the curves (such as the range of x values)
+    curves : list of tuple
+        (uid, params, factory) for each card: uid of the card, tuple with all the
+        parameters of the curve (including its color) and function computing
+        its traces from scratch (see cached_traces)
+    layout : function
+        function returning the layout of the figure (a dict without template),
+        given the list of information about the curves
+        
+    Returns
+    -------
+    figure : plotly.graph_objs.Figure or dash.Patch
+        the whole figure, or a partial update of it
+    infos : list
+        information about each curve (see cached_traces)
+    changed : list of bool
+        whether each curve has changed since the previous call
+    store : dict
+        new data of the store
+    '''
+    grid_key = repr((grid, str(get_locale())))
+    traces, infos, entries = [], [], []
+    for uid, params, factory in curves:
+        key = repr(params)
+        t, info = cached_traces((figure_id, grid_key, key), factory)
+        traces.append(t)
+        infos.append(info)
+        entries.append([uid, key, len(t)])
+    store = {'grid': grid_key, 'curves': entries}
+    old = stored['curves'] if stored and stored['grid'] == grid_key else None
+    old_keys = {uid: key for uid, key, n in old or []}
+    changed = [old_keys.get(uid) != key for uid, key, n in entries]
+    new_uids = [uid for uid, key, n in entries]
+    kept = [uid for uid in old_keys if uid in new_uids]
+    if old is None or new_uids[:len(kept)] != kept: # new grid, or curves have been reordered
+        figure = go.Figure(data=[trace for t in traces for trace in t], layout=layout(infos))
+        return figure, infos, changed, store
+    # old curves are updated from the last one, so that positions of the
+    # traces of the previous curves do not change
+    figure = Patch()
+    data = figure['data']
+    offsets = np.cumsum([0] + [n for uid, key, n in old])
+    position = {uid: i for i, uid in enumerate(new_uids)}
+    for (uid, key, n), start in reversed(list(zip(old, offsets))):
+        i = position.get(uid)
+        if i is None: # removed
+            new = []
+        elif changed[i]:
+            new = traces[i]
+        else:
+            continue
+        for j, trace in enumerate(new[:n]):
+            data[start+j] = trace
+        for j in range(n, len(new)):
+            data.insert(start+j, new[j])
+        for j in reversed(range(len(new), n)):
+            del data[start+j]
+    for t in traces[len(kept):]: # new curves
+        data.extend(t)
+    figure['layout'].update(go.Layout(layout(infos)).to_plotly_json()) # validated as in the whole figure
+    return figure, infos, changed, store
+
+#####################
+# display utilities #
+#####################
+
+def minmax_decimate(y, bucket, start=0):
+    '''
+    decimate a time series for display, keeping only the minimum and
+    the maximum value in each bucket of consecutive points, so that
+    the shape of the curve (including its spikes) is preserved
+    
+    Parameters
+    ----------
+    y : array
+        values of the time series
+    bucket : int
+        number of consecutive points in each bucket
+    start : int
+        x value (step) of the first point
+        
+    Returns
+    -------
+    x, y : array
+        x and y values of the decimated time series
+    '''
+    y = np.asarray(y)
+    if bucket <= 1:
+        return np.arange(start, start+len(y)), y
+    # pad the last bucket repeating its last value
+    nb = -(-len(y)//bucket) # number of buckets
+    padded = np.concatenate((y, np.repeat(y[-1:], nb*bucket-len(y))))
+    buckets = padded.reshape(nb, bucket)
+    offset = np.arange(nb)*bucket
+    i_min = buckets.argmin(axis=1) + offset
+    i_max = buckets.argmax(axis=1) + offset
+    # keep the two points in time order
+    idx = np.sort(np.stack((i_min, i_max), axis=1), axis=1).ravel()
+    idx = np.minimum(idx, len(y)-1)
+    return start + idx, y[idx]
+
+
+def minmax_rebucket(x, y, bucket, start=0):
+    '''
+    decimate again a time series already decimated with minmax_decimate,
+    with a larger bucket, so that a growing series can be kept within
+    a fixed number of points
+
+    Parameters
+    ----------
+    x, y : array
+        x (step) and y values of the decimated time series, in time order
+    bucket : int
+        number of consecutive steps in each new bucket
+    start : int
+        first step of the first bucket
+
+    Returns
+    -------
+    x, y : array
+        x and y values with only the minimum and the maximum in each bucket
+    '''
+    x, y = np.asarray(x), np.asarray(y)
+    if bucket <= 1 or not len(x):
+        return x, y
+    group = (x - start)//bucket
+    # sort by bucket and then by value: the extremes are at the boundaries
+    order = np.lexsort((y, group))
+    first = np.append(True, group[order][1:] != group[order][:-1])
+    last = np.append(first[1:], True)
+    idx = np.union1d(order[first], order[last]) # sorted, i.e. in time order
+    return x[idx], y[idx]
+
+
+def adaptive_sample(f, x_min, x_max, tol=1e-3, n_start=33, max_points=400, y_range=None):
+    '''
+    sample a curve for display on as few points as possible: starting from
+    a coarse uniform grid, intervals are split only where the curve bends,
+    i.e. where the midpoint is farther from the chord than tol (as a
+    fraction of the height of the plot), so that points are dense only where
+    curvature is high (such as a repulsive wall or a sharp minimum)
+    
+    Parameters
+    ----------
+    f : function
+        vectorized function, returning y values for an array of x values
+    x_min, x_max : float
+        range of x values
+    tol : float
+        largest distance of the curve from the drawn segments, as a fraction
+        of the y range
+    n_start : int
+        number of points of the starting uniform grid
+    max_points : int
+        maximum number of points (the intervals farthest from the curve are
+        split first)
+    y_range : tuple, optional
+        range of y values shown in the plot (range of the sampled values, if None);
+        the curve outside it is not refined
+        
+    Returns
+    -------
+    x, y : array
+        x and y values of the sampled curve
+    '''
+    x = np.linspace(x_min, x_max, n_start)
+    y = np.asarray(f(x), dtype=float)
+    min_width = (x_max - x_min)*1e-6 # do not refine discontinuities forever
+    while len(x) < max_points:
+        xm = (x[:-1] + x[1:])/2
+        ym = np.asarray(f(xm), dtype=float)
+        if y_range is None:
+            finite = np.concatenate((y, ym))
+            finite = finite[np.isfinite(finite)]
+            lo, hi = (finite.min(), finite.max()) if len(finite) else (0, 1)
+        else:
+            lo, hi = y_range
+        height = (hi - lo) or 1
+        error = np.abs(np.clip(ym, lo, hi) - np.clip((y[:-1] + y[1:])/2, lo, hi))/height
+        # segments leaving the plot are split until they are narrow, since the
+        # midpoint does not tell where the curve leaves it
+        side = np.sign(y - np.clip(y, lo, hi))
+        leaving = side[:-1] != side[1:]
+        error[leaving] = np.maximum(error[leaving], np.diff(x)[leaving]/(x_max - x_min))
+        error[~np.isfinite(error) | (np.diff(x) < min_width)] = 0
+        split = np.flatnonzero(error > tol)
+        if not len(split):
+            break
+        # split the worst intervals first, within the number of points allowed
+        split = np.sort(split[np.argsort(error[split])[::-1][:max_points - len(x)]])
+        x = np.insert(x, split + 1, xm[split])
+        y = np.insert(y, split + 1, ym[split])
+    return x, y